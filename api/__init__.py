@@ -1,3 +1,5 @@
+default_app_config = 'api.apps.ApiConfig'
+
 RESERVATION_CREATED = 1
 RESERVATION_CONFIRMED = 2
 RESERVATION_REJECTED = 3
@@ -13,3 +15,69 @@ RESERVATION_STATUS = [
 ]
 
 DEFAULT_CANCELLATION_REASON = 'No especificado'
+
+EVENT_KIND_EVENT = 1
+EVENT_KIND_RESTAURANT = 2
+
+EVENT_KINDS = [
+    (EVENT_KIND_EVENT, 'Event'),
+    (EVENT_KIND_RESTAURANT, 'Restaurant'),
+]
+
+RESTAURANT_CATEGORY = 'restaurant'
+
+SEARCH_DOCUMENT_EVENT = 1
+SEARCH_DOCUMENT_WINERY = 2
+
+SEARCH_DOCUMENT_KINDS = [
+    (SEARCH_DOCUMENT_EVENT, 'Event'),
+    (SEARCH_DOCUMENT_WINERY, 'Winery'),
+]
+
+ALL_WEEKDAYS = 0b1111111
+
+OCCURRENCE_BATCH_SIZE = 500
+
+MAIL_BATCH_SIZE = 100
+MAIL_MAX_ATTEMPTS = 5
+# Seconds before the first retry of a failed mail, doubled on each attempt
+MAIL_RETRY_BACKOFF = 60
+# Seconds a worker holds the mails it claimed before others may retry them
+MAIL_CLAIM_LEASE = 600
+# Context fields that differ between the recipients of the same mail. Bodies
+# are rendered once with a placeholder for them, so templates must output
+# them as they are, without filters
+MAIL_RECIPIENT_FIELDS = ('first_name', 'user')
+
+# Kilometers around the point searched for nearby wineries when no radius is given
+NEAREST_WINERIES_RADIUS = 100
+NEAREST_WINERIES_LIMIT = 20
+MAX_NEAREST_WINERIES = 200
+# Larger radii are cut down to about half the earth's circumference, which
+# already reaches every point
+MAX_NEAREST_WINERIES_RADIUS = 20000
+
+# Map clusters: each tile is split in a CLUSTER_GRID_SIZE x CLUSTER_GRID_SIZE
+# grid and cells with fewer wineries than CLUSTER_MIN_WINERIES list them one
+# by one, as does every cell from CLUSTER_MAX_ZOOM on
+CLUSTER_GRID_SIZE = 4
+CLUSTER_MIN_WINERIES = 5
+CLUSTER_MAX_ZOOM = 16
+MAX_CLUSTER_TILES = 64
+
+# Nearby wineries in the GeoJSON output are lighter and streamed, so more of
+# them may be asked for; they are read GEOJSON_CHUNK_SIZE at a time
+MAX_NEAREST_FEATURES = 5000
+GEOJSON_CHUNK_SIZE = 500
+
+# Vector tiles have a single layer of wineries, in tile coordinates from 0
+# to VECTOR_TILE_EXTENT, served up to VECTOR_TILES_MAX_ZOOM
+VECTOR_TILES_LAYER = 'wineries'
+VECTOR_TILE_EXTENT = 4096
+VECTOR_TILES_MAX_ZOOM = 18
+# Tiles are only cached on disk up to this zoom, deeper ones are cheap to build
+VECTOR_TILES_CACHE_MAX_ZOOM = 14
+
+# Seconds a client turned away because too many live streams are open waits
+# before trying again
+LIVE_STREAMS_RETRY_AFTER = 30
@@ -5,9 +5,11 @@ from api.models import (
     Event,
     EventOccurrence,
     EventCategory,
+    EventSchedule,
     Tag,
     Language,
     Gender,
+    OutboxMail,
     Rate,
     Reservation,
     Varietal,
@@ -23,16 +25,29 @@ class WineryAdmin(admin.ModelAdmin):
 
 class EventAdmin(admin.ModelAdmin):
     search_fields = ('name', 'winery__name')
+    list_filter = ('kind',)
+    readonly_fields = ('rating_sum', 'rating_count', 'kind', 'next_occurrence_start', 'open_occurrences_count')
 
 
 class EventOccurrenceAdmin(admin.ModelAdmin):
     search_fields = ('event__name', 'start')
 
 
+class EventScheduleAdmin(admin.ModelAdmin):
+    search_fields = ('event__name',)
+    readonly_fields = ('materialized_until',)
+
+
 class ReservationAdmin(admin.ModelAdmin):
     search_fields = ('user__email', 'event_occurrence__event__name', 'user__last_name', 'user__first_name')
 
 
+class OutboxMailAdmin(admin.ModelAdmin):
+    search_fields = ('recipient', 'subject')
+    list_display = ('recipient', 'subject', 'created', 'attempts', 'sent')
+    readonly_fields = ('created', 'attempts', 'last_error', 'sent')
+
+
 class CountryAdmin(admin.ModelAdmin):
     search_fields = ('name',)
 
@@ -52,5 +67,7 @@ admin.site.register(WineLine)
 admin.site.register(Wine)
 admin.site.register(Event, EventAdmin)
 admin.site.register(EventOccurrence, EventOccurrenceAdmin)
+admin.site.register(EventSchedule, EventScheduleAdmin)
 admin.site.register(Rate, RateAdmin)
 admin.site.register(Reservation, ReservationAdmin)
+admin.site.register(OutboxMail, OutboxMailAdmin)
@@ -0,0 +1,104 @@
+"""Reservations that take their seats from the occurrence atomically.
+
+The vacancies are checked and decremented by a single conditional UPDATE in
+the same transaction as the reservation insert, so concurrent requests can
+neither oversell an occurrence nor lose each other's decrements. Sharded
+occurrences take them from one of their VacancyShard counters instead, so
+bookings of a popular occurrence don't all queue on the same row.
+"""
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .cache import bump_catalog_version
+from .live import publish_occurrences
+from .models import EventOccurrence, Reservation, VacancyShard
+
+
+class NotEnoughVacancies(Exception):
+    def __init__(self, message, event_occurrence_id=None):
+        super().__init__(message)
+        self.event_occurrence_id = event_occurrence_id
+
+
+def take_vacancies(event_occurrence_id, amount):
+    """Decrements the vacancies of an open occurrence when at least `amount`
+    are left. Returns whether they were taken."""
+    # Only the occurrence row is filtered, so the condition is re-checked
+    # against the latest version of the row once a concurrent update commits
+    taken = EventOccurrence.objects.filter(
+        pk=event_occurrence_id,
+        vacancies__gte=amount,
+        cancelled__isnull=True,
+        sharded=False,
+    ).update(vacancies=F('vacancies') - amount) == 1
+    if taken or not EventOccurrence.objects.filter(pk=event_occurrence_id, sharded=True).exists():
+        return taken
+    return take_sharded_vacancies(event_occurrence_id, amount)
+
+
+def take_sharded_vacancies(event_occurrence_id, amount):
+    """Takes the vacancies from a counter picked at random, or from several
+    when none can seat `amount` on its own."""
+    shards = VacancyShard.objects.filter(event_occurrence_id=event_occurrence_id)
+    with transaction.atomic():
+        slots = list(range(settings.VACANCY_SHARDS))
+        random.shuffle(slots)
+        taken = any(
+            shards.filter(slot=slot, vacancies__gte=amount).update(vacancies=F('vacancies') - amount)
+            for slot in slots
+        )
+        if not taken:
+            # Locked in slot order, so concurrent bookings wait instead of deadlocking
+            locked = list(shards.select_for_update().order_by('slot'))
+            if sum(shard.vacancies for shard in locked) < amount:
+                return False
+            left = amount
+            for shard in locked:
+                used = min(shard.vacancies, left)
+                shards.filter(pk=shard.pk).update(vacancies=F('vacancies') - used)
+                left -= used
+        # Checked once the counter is held, as cancellations lock the counters
+        if not EventOccurrence.objects.filter(pk=event_occurrence_id, cancelled__isnull=True).exists():
+            transaction.set_rollback(True)
+            return False
+    return True
+
+
+def book(user_id, event_occurrence, attendee_number, **fields):
+    """Creates a reservation for `attendee_number` people, raising
+    NotEnoughVacancies when the occurrence can not seat them."""
+    with transaction.atomic():
+        if not take_vacancies(event_occurrence.pk, attendee_number):
+            raise NotEnoughVacancies('Not enough vacancies for the reservation', event_occurrence.pk)
+        reservation = Reservation.objects.create(
+            user_id=user_id,
+            event_occurrence=event_occurrence,
+            attendee_number=attendee_number,
+            **fields
+        )
+    transaction.on_commit(bump_catalog_version)
+    publish_occurrences(EventOccurrence.objects.filter(pk=event_occurrence.pk))
+    return reservation
+
+
+def book_many(user_id, items):
+    """Creates a reservation per item (the keyword arguments of `book`) or
+    none at all, raising NotEnoughVacancies for the first occurrence that can
+    not seat all of its items."""
+    seats = defaultdict(int)
+    for item in items:
+        seats[item['event_occurrence'].pk] += item['attendee_number']
+    with transaction.atomic():
+        # Rows are locked in primary key order, so two batches sharing
+        # occurrences wait on each other instead of deadlocking
+        for event_occurrence_id in sorted(seats):
+            if not take_vacancies(event_occurrence_id, seats[event_occurrence_id]):
+                raise NotEnoughVacancies('Not enough vacancies for the reservation', event_occurrence_id)
+        reservations = [Reservation.objects.create(user_id=user_id, **item) for item in items]
+    transaction.on_commit(bump_catalog_version)
+    publish_occurrences(EventOccurrence.objects.filter(pk__in=seats))
+    return reservations
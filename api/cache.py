@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'api:catalog-version'
+
+# Hits and misses of the response cache in this process. Kept in memory so
+# counting them never writes to the cache, which is a table in production.
+cache_stats = Counter()
+cache_stats_lock = threading.Lock()
+
+
+def _new_version():
+    # Milliseconds since epoch, so a version lost by an eviction or a cache
+    # restart can never collide with keys cached under an older one.
+    return int(time.time() * 1000)
+
+
+def _count(stat):
+    with cache_stats_lock:
+        cache_stats[stat] += 1
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """Invalidates every entry cached under the version at `key` at once."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    """Invalidates every cached response at once by moving to a new version.
+    Within a transaction, call it through transaction.on_commit."""
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def get_cache_stats():
+    """Hits and misses of the response cache in this process."""
+    with cache_stats_lock:
+        return {'hits': cache_stats['hits'], 'misses': cache_stats['misses']}
+
+
+def reset_cache_stats():
+    with cache_stats_lock:
+        cache_stats.clear()
+
+
+def response_cache_key(request):
+    query = sorted(request.GET.lists())
+    # Views may answer the same URL in another format depending on Accept
+    media_type = request.accepted_renderer.media_type
+    digest = hashlib.md5('{}|{}|{}|{}'.format(request.get_host(), request.path, query, media_type).encode()).hexdigest()
+    return 'api:response:{}:{}'.format(get_catalog_version(), digest)
+
+
+def cache_anonymous_response(view_method):
+    """Caches successful anonymous GET responses of a view method.
+
+    Keys include the catalog version, which is bumped whenever catalog data
+    changes, so stale entries are never read and simply expire.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.method != 'GET' or not request.user.is_anonymous:
+            return view_method(self, request, *args, **kwargs)
+
+        key = response_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            _count('hits')
+            data, status_code = cached
+            response = Response(data, status=status_code)
+            response['X-Cache'] = 'HIT'
+            patch_vary_headers(response, ['Accept'])
+            return response
+
+        _count('misses')
+        response = view_method(self, request, *args, **kwargs)
+        # Streamed responses are not held in memory to be cached
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, (response.data, response.status_code), settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        patch_vary_headers(response, ['Accept'])
+        return response
+    return wrapper
@@ -0,0 +1,122 @@
+"""Wineries on the map grouped by proximity, computed per tile.
+
+The map is split into the usual web mercator tiles of each zoom level and
+every tile into a CLUSTER_GRID_SIZE x CLUSTER_GRID_SIZE grid. A grid cell
+holding CLUSTER_MIN_WINERIES approved wineries or more is returned as one
+cluster with its count, centroid and bounds, the wineries of sparser cells
+one by one. Tiles are cached on their own, so panning only computes the
+tiles that came into view, and a winery that moves or gets approved only
+drops the tiles it was and is in.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import CLUSTER_GRID_SIZE, CLUSTER_MAX_ZOOM, CLUSTER_MIN_WINERIES, MAX_CLUSTER_TILES
+from .cache import bump_version, get_version
+from .proximity import in_box
+
+CLUSTERS_VERSION_KEY = 'api:clusters-version'
+# Latitudes beyond these are not drawn by web mercator maps
+MAX_LATITUDE = 85.0511287798
+
+
+def tile_position(lon, lat, zoom):
+    """Fractional (x, y) tile coordinates of a point at `zoom`."""
+    tiles = 2 ** zoom
+    lat = math.radians(max(min(lat, MAX_LATITUDE), -MAX_LATITUDE))
+    x = (lon + 180) / 360 * tiles
+    y = (1 - math.asinh(math.tan(lat)) / math.pi) / 2 * tiles
+    return min(max(x, 0), tiles - 1e-9), min(max(y, 0), tiles - 1e-9)
+
+
+def tile_of(lon, lat, zoom):
+    x, y = tile_position(lon, lat, zoom)
+    return int(x), int(y)
+
+
+def tile_bounds(zoom, x, y):
+    """(min_x, min_y, max_x, max_y) of a tile in degrees."""
+    tiles = 2 ** zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / tiles))))
+
+    return x / tiles * 360 - 180, latitude(y + 1), (x + 1) / tiles * 360 - 180, latitude(y)
+
+
+def tiles_in_box(box, zoom):
+    """Tiles of `zoom` covering the (min_x, min_y, max_x, max_y) box, or a
+    ValueError when there are more than MAX_CLUSTER_TILES of them."""
+    min_x, min_y, max_x, max_y = box
+    left, top = tile_of(min_x, max_y, zoom)
+    right, bottom = tile_of(max_x, min_y, zoom)
+    if (right - left + 1) * (bottom - top + 1) > MAX_CLUSTER_TILES:
+        raise ValueError('Too many tiles, zoom in')
+    return [(x, y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+
+
+def tile_key(version, zoom, x, y):
+    return 'api:clusters:{}:{}:{}:{}'.format(version, zoom, x, y)
+
+
+def build_tile(queryset, zoom, x, y):
+    cells = {}
+    wineries = in_box(queryset, tile_bounds(zoom, x, y)).values_list('pk', 'location')
+    for pk, location in wineries:
+        position_x, position_y = tile_position(location.x, location.y, zoom)
+        # The box lookup may return wineries just across the tile edges
+        if (int(position_x), int(position_y)) != (x, y):
+            continue
+        cell = int((position_x - x) * CLUSTER_GRID_SIZE), int((position_y - y) * CLUSTER_GRID_SIZE)
+        cells.setdefault(cell, []).append((pk, location.x, location.y))
+
+    tile = {'clusters': [], 'wineries': []}
+    for cell in sorted(cells):
+        members = cells[cell]
+        if len(members) < CLUSTER_MIN_WINERIES or zoom >= CLUSTER_MAX_ZOOM:
+            tile['wineries'].extend({'id': pk, 'location': [lon, lat]} for pk, lon, lat in members)
+            continue
+        longitudes = [lon for _, lon, _ in members]
+        latitudes = [lat for _, _, lat in members]
+        tile['clusters'].append({
+            'count': len(members),
+            'centroid': [sum(longitudes) / len(members), sum(latitudes) / len(members)],
+            'bbox': [min(longitudes), min(latitudes), max(longitudes), max(latitudes)],
+        })
+    return tile
+
+
+def get_clusters(queryset, box, zoom):
+    """Clusters and single wineries of `queryset` in the tiles covering
+    `box` at `zoom`, read from the cache where the tiles are computed."""
+    zoom = min(zoom, CLUSTER_MAX_ZOOM)
+    version = get_version(CLUSTERS_VERSION_KEY)
+    keys = {tile_key(version, zoom, x, y): (x, y) for x, y in tiles_in_box(box, zoom)}
+    tiles = cache.get_many(keys)
+    missing = {key: build_tile(queryset, zoom, *keys[key]) for key in keys if key not in tiles}
+    if missing:
+        cache.set_many(missing, settings.MAP_CLUSTERS_CACHE_TIMEOUT)
+        tiles.update(missing)
+
+    result = {'zoom': zoom, 'clusters': [], 'wineries': []}
+    for key in keys:
+        result['clusters'].extend(tiles[key]['clusters'])
+        result['wineries'].extend(tiles[key]['wineries'])
+    return result
+
+
+def invalidate_tiles(points):
+    """Drops the cached tiles holding any of `points`, at every zoom."""
+    version = get_version(CLUSTERS_VERSION_KEY)
+    cache.delete_many([
+        tile_key(version, zoom, *tile_of(point.x, point.y, zoom))
+        for point in points
+        for zoom in range(CLUSTER_MAX_ZOOM + 1)
+    ])
+
+
+def clear_cluster_cache():
+    """Drops every cached tile, for changes made without signals."""
+    bump_version(CLUSTERS_VERSION_KEY)
@@ -1,6 +1,8 @@
 from django_filters import DateTimeFromToRangeFilter, FilterSet, ModelMultipleChoiceFilter
+from rest_framework.filters import SearchFilter
 
 from .models import Event, EventCategory, Tag
+from .search import get_search_words, search
 
 
 class EventFilter(FilterSet):
@@ -21,3 +23,20 @@ class EventFilter(FilterSet):
     class Meta:
         model = Event
         fields = ['occurrences__start', 'category', 'tag']
+
+
+class FullTextSearchFilter(SearchFilter):
+    """Takes the same `search=` parameter as SearchFilter, but matches it
+    against the full-text index of the search documents and orders the
+    results by relevance."""
+    ordering = ('-search_rank', 'id')
+
+    @classmethod
+    def get_search_words(cls, request):
+        return get_search_words(request.query_params.get(cls.search_param, ''))
+
+    def filter_queryset(self, request, queryset, view):
+        words = self.get_search_words(request)
+        if not words:
+            return queryset
+        return search(queryset, words).order_by(*self.ordering)
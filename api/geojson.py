@@ -0,0 +1,69 @@
+"""GeoJSON output of wineries for drawing them on a map.
+
+Features only carry the id, name and thumbnail of each winery, read with
+`.values()` a chunk at a time and written out one by one, so large result
+sets are streamed instead of built in memory first.
+"""
+import json
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+from . import GEOJSON_CHUNK_SIZE
+from .models import ImagesWinery
+
+
+class GeoJSONRenderer(BaseRenderer):
+    """Lets clients ask for `application/geo+json`; errors are sent as JSON."""
+    media_type = 'application/geo+json'
+    format = 'geojson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
+
+
+def point_geometry(point):
+    """GeoJSON geometry of a point, read from its coordinates."""
+    return {'type': 'Point', 'coordinates': [point.x, point.y]}
+
+
+def winery_rows(queryset):
+    thumbnail = ImagesWinery.objects.filter(winery=OuterRef('pk')).order_by('id').values('filefield')[:1]
+    return queryset.annotate(thumbnail=Subquery(thumbnail)).values('id', 'name', 'location', 'thumbnail')
+
+
+def winery_feature(row, distance):
+    return {
+        'type': 'Feature',
+        'id': row['id'],
+        'geometry': point_geometry(row['location']),
+        'properties': {
+            'name': row['name'],
+            'thumbnail': settings.MEDIA_URL + row['thumbnail'] if row['thumbnail'] else None,
+            'distance': round(distance / 1000, 3),
+        },
+    }
+
+
+def nearby_winery_features(queryset, distances):
+    """Features of the wineries of `distances`, (pk, meters) pairs nearest
+    first, in the same order."""
+    for start in range(0, len(distances), GEOJSON_CHUNK_SIZE):
+        chunk = distances[start:start + GEOJSON_CHUNK_SIZE]
+        rows = {row['id']: row for row in winery_rows(queryset.filter(pk__in=[pk for pk, _ in chunk]))}
+        for pk, distance in chunk:
+            yield winery_feature(rows[pk], distance)
+
+
+def feature_collection(features):
+    yield '{"type": "FeatureCollection", "features": ['
+    for index, feature in enumerate(features):
+        yield (', ' if index else '') + json.dumps(feature)
+    yield ']}'
+
+
+def geojson_response(features):
+    """FeatureCollection of `features`, streamed as they are read."""
+    return StreamingHttpResponse(feature_collection(features), content_type=GeoJSONRenderer.media_type)
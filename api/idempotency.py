@@ -0,0 +1,85 @@
+"""Replays of POST requests retried with the same `Idempotency-Key` header.
+
+The key is claimed by inserting its row in the transaction that runs the
+view, and the response is stored in that row before committing. A
+duplicate sent while the first request is running blocks on the unique
+index until it commits, then replays the stored response. If the first
+request fails, its transaction is rolled back and the duplicate runs
+instead.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response(
+            {'errors': 'The Idempotency-Key was already used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    response = Response(json.loads(record.response_body), status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """Decorator for view actions whose POST may be retried by clients. It
+    only applies to authenticated requests that send the header."""
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'errors': 'The Idempotency-Key can not be longer than {} characters.'.format(MAX_KEY_LENGTH)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        expired = datetime.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        with transaction.atomic():
+            IdempotencyKey.objects.filter(user=request.user, key=key, created__lt=expired).delete()
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(user=request.user, key=key, fingerprint=fingerprint)
+            except IntegrityError:
+                return replay(IdempotencyKey.objects.get(user=request.user, key=key), fingerprint)
+
+            response = view_method(view, request, *args, **kwargs)
+            if response.status_code >= 500:
+                # Nothing is kept, so the request can be retried
+                transaction.set_rollback(True)
+                return response
+            record.status_code = response.status_code
+            record.response_body = json.dumps(response.data, cls=JSONEncoder)
+            record.save(update_fields=['status_code', 'response_body'])
+        return response
+    return wrapper
+
+
+def purge_expired_keys():
+    expired = datetime.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(created__lt=expired).delete()
+    return deleted
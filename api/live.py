@@ -0,0 +1,241 @@
+"""Live vacancy and cancellation updates of event occurrences.
+
+The booking and cancellation paths publish the new state of the occurrences
+they touch once their transaction commits. Messages fan out to the
+subscribers of the event and winery channels through the broker named by
+the LIVE_UPDATES_BACKEND setting: `LocalBroker` only reaches the streams of
+the current process, `PostgresBroker` relays them to every node through
+LISTEN/NOTIFY.
+
+Each open stream holds a request thread, so a process only serves
+LIVE_UPDATES_MAX_STREAMS of them at once and keeps its other threads for
+the rest of the API.
+"""
+import json
+import queue
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer
+
+OCCURRENCE_FIELDS = ('id', 'event', 'event__winery', 'vacancies', 'sharded', 'cancelled')
+
+broker = None
+broker_lock = threading.Lock()
+
+# Streams being served by this process
+open_streams = 0
+open_streams_lock = threading.Lock()
+
+
+def event_channel(event_id):
+    return 'event:{}'.format(event_id)
+
+
+def winery_channel(winery_id):
+    return 'winery:{}'.format(winery_id)
+
+
+class Subscription:
+    """Messages published to some channels since subscribing."""
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.messages = queue.Queue()
+
+    def get(self, timeout=None):
+        """Next message, or None when nothing arrives within `timeout` seconds."""
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Pub/sub between the threads of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self.lock:
+            for channel in channels:
+                self.subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscriptions.get(channel, set())
+                subscribers.discard(subscription)
+                if not subscribers:
+                    self.subscriptions.pop(channel, None)
+
+    def publish(self, channels, message):
+        with self.lock:
+            subscribers = set().union(*(self.subscriptions.get(channel, ()) for channel in channels))
+        for subscription in subscribers:
+            subscription.messages.put(message)
+
+
+class PostgresBroker(LocalBroker):
+    """Relays the messages to the brokers of every node with NOTIFY.
+
+    Each process keeps one extra connection listening on NOTIFY_CHANNEL and
+    fans what arrives out to its local subscribers.
+    """
+    NOTIFY_CHANNEL = 'api_live_updates'
+    POLL_SECONDS = 5
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def subscribe(self, channels):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name='live-updates', daemon=True)
+                self.listener.start()
+        return super().subscribe(channels)
+
+    def publish(self, channels, message):
+        payload = json.dumps({'channels': list(channels), 'message': message})
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.NOTIFY_CHANNEL, payload])
+
+    def listen(self):
+        while True:
+            listener = connection.copy()
+            try:
+                listener.connect()
+                listener.set_autocommit(True)
+                with listener.cursor() as cursor:
+                    cursor.execute('LISTEN {}'.format(self.NOTIFY_CHANNEL))
+                raw = listener.connection
+                while True:
+                    if select.select([raw], [], [], self.POLL_SECONDS) == ([], [], []):
+                        continue
+                    raw.poll()
+                    while raw.notifies:
+                        notify = raw.notifies.pop(0)
+                        data = json.loads(notify.payload)
+                        super().publish(data['channels'], data['message'])
+            except Exception:
+                # Reconnect after losing the connection
+                time.sleep(self.POLL_SECONDS)
+            finally:
+                listener.close()
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients ask for `text/event-stream`; errors are sent as JSON."""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
+
+
+def get_broker():
+    global broker
+    with broker_lock:
+        if broker is None:
+            broker = import_string(settings.LIVE_UPDATES_BACKEND)()
+    return broker
+
+
+def occurrence_rows(occurrences):
+    """Values of the occurrences to publish, with the counters of sharded
+    occurrences summed, as their vacancies column lags behind."""
+    return occurrences.values(*OCCURRENCE_FIELDS).annotate(shard_vacancies=Sum('vacancy_shards__vacancies'))
+
+
+def occurrence_message(row):
+    return {
+        'occurrence': row['id'],
+        'event': row['event'],
+        'vacancies': row['shard_vacancies'] or 0 if row['sharded'] else row['vacancies'],
+        'cancelled': row['cancelled'].isoformat() if row['cancelled'] else None,
+    }
+
+
+def publish_occurrences(occurrences):
+    """Publishes the state of the occurrences to their event and winery
+    channels once the current transaction commits."""
+    def publish():
+        current_broker = get_broker()
+        for row in occurrence_rows(occurrences):
+            current_broker.publish(
+                [event_channel(row['event']), winery_channel(row['event__winery'])],
+                occurrence_message(row),
+            )
+    transaction.on_commit(publish)
+
+
+def stream(channels, snapshot):
+    """Server-sent events of a subscription to the channels, starting with
+    the state of the `snapshot` occurrences. Ends after
+    LIVE_UPDATES_MAX_SECONDS to release the worker; clients reconnect."""
+    subscription = get_broker().subscribe(channels)
+    try:
+        yield 'retry: {}\n\n'.format(settings.LIVE_UPDATES_RETRY_MILLISECONDS)
+        for row in occurrence_rows(snapshot):
+            yield server_event(occurrence_message(row))
+        deadline = time.monotonic() + settings.LIVE_UPDATES_MAX_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = subscription.get(timeout=min(remaining, settings.LIVE_UPDATES_KEEPALIVE_SECONDS))
+            # A comment line keeps proxies from closing an idle stream
+            yield server_event(message) if message else ': keepalive\n\n'
+    finally:
+        subscription.close()
+
+
+class LimitedStream:
+    """Events of a stream holding one of the LIVE_UPDATES_MAX_STREAMS slots
+    of this process. The slot is given back when the response is closed,
+    whether the stream was read or not."""
+
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return self.events
+
+    def close(self):
+        global open_streams
+        if self.closed:
+            return
+        self.closed = True
+        self.events.close()
+        with open_streams_lock:
+            open_streams -= 1
+
+
+def limited_stream(channels, snapshot):
+    """`stream` of the channels, or None when this process already serves
+    LIVE_UPDATES_MAX_STREAMS streams."""
+    global open_streams
+    with open_streams_lock:
+        if open_streams >= settings.LIVE_UPDATES_MAX_STREAMS:
+            return None
+        open_streams += 1
+    return LimitedStream(stream(channels, snapshot))
+
+
+def server_event(message):
+    return 'event: occurrence\ndata: {}\n\n'.format(json.dumps(message))
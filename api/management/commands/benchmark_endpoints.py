@@ -0,0 +1,383 @@
+import json
+import logging
+import math
+import random
+import re
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+from django.contrib.admindocs.views import extract_views_from_urlpatterns, simplify_regex
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import get_resolver
+
+from api import EVENT_KIND_EVENT, EVENT_KIND_RESTAURANT, RESERVATION_CONFIRMED, RESTAURANT_CATEGORY
+from api.cache import bump_catalog_version
+from api.clusters import clear_cluster_cache
+from api.models import (
+    Country,
+    Event,
+    EventCategory,
+    EventOccurrence,
+    Gender,
+    Language,
+    Rate,
+    Reservation,
+    Tag,
+    Varietal,
+    Wine,
+    WineLine,
+    Winery,
+)
+from users.models import WineUser
+
+# Latencies below this many milliseconds apart are treated as noise
+LATENCY_NOISE_MS = 2.0
+
+PLACEHOLDER = re.compile(r'<(?:\w+:)?(\w+)>')
+
+# Query strings needed by routes that reject a bare GET
+ROUTE_QUERIES = {
+    '/api/maps/': {'q': '-68.84,-32.89'},
+    '/api/maps/clusters/': {'bbox': '-69.6,-35.0,-68.0,-32.6', 'zoom': 9},
+}
+
+# Routes whose placeholders are not object ids: a tile over Mendoza
+ROUTE_URLS = {
+    '/api/tiles/<int:z>/<int:x>/<int:y>.mvt': '/api/tiles/9/158/305.mvt',
+}
+
+# Routes outside the project: Django admin and the data dump views under it
+EXCLUDED_PREFIXES = ('/admin/',)
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests every GET route of the API against a seeded dataset and reports the p50 and p95 '
+        'latency, queries and response bytes of each. Saves them as a JSON baseline or fails when '
+        'a route regressed past the threshold. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wineries', type=int, default=20, help='Wineries in the dataset, the rest scales with it')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per route')
+        parser.add_argument('--baseline', help='JSON file to compare the results with, or to write them to')
+        parser.add_argument('--save', action='store_true', help='Write the results to the baseline file')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=20,
+            help='Percent of p95 latency or bytes growth over the baseline that counts as a regression',
+        )
+
+    def handle(self, *args, **options):
+        if options['save'] and not options['baseline']:
+            raise CommandError('--save needs a --baseline file to write to')
+        scale = {'wineries': options['wineries'], 'seed': options['seed']}
+
+        # Vector tiles of the seeded dataset go to a directory of their own
+        tiles_root = tempfile.TemporaryDirectory()
+        with tiles_root, transaction.atomic(), silence_request_log(), override_settings(
+            LIVE_UPDATES_MAX_SECONDS=0, VECTOR_TILES_ROOT=tiles_root.name
+        ):
+            objects = seed_dataset(options['wineries'], random.Random(options['seed']))
+            client = Client()
+            client.force_login(objects['user'])
+            results = {}
+            skipped = []
+            for route, view in get_routes():
+                if not allows_get(view):
+                    skipped.append(route)
+                    continue
+                results[route] = measure(client, route_url(route, objects), ROUTE_QUERIES.get(route), options['repeat'])
+            transaction.set_rollback(True)
+        # Nothing cached from the rolled back dataset may be served later
+        bump_catalog_version()
+        clear_cluster_cache()
+
+        self.stdout.write('{:<80} {:>6} {:>9} {:>9} {:>8} {:>9}'.format(
+            'route', 'status', 'p50 ms', 'p95 ms', 'queries', 'bytes'
+        ))
+        for route, result in results.items():
+            self.stdout.write('{:<80} {status:>6} {p50_ms:>9.2f} {p95_ms:>9.2f} {queries:>8} {bytes:>9}'.format(
+                route, **result
+            ))
+        self.stdout.write('Skipped {} routes without GET'.format(len(skipped)))
+
+        if not options['baseline']:
+            return
+        if options['save']:
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump({'scale': scale, 'routes': results}, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS('Saved the baseline of {} routes'.format(len(results))))
+            return
+
+        try:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as e:
+            raise CommandError('Could not read the baseline: {}'.format(e))
+        if baseline['scale'] != scale:
+            raise CommandError('The baseline was recorded with {}, run with the same options'.format(
+                baseline['scale']
+            ))
+        regressions = find_regressions(baseline['routes'], results, options['threshold'] / 100)
+        for regression in regressions:
+            self.stderr.write(regression)
+        if regressions:
+            raise CommandError('{} regressions over the baseline'.format(len(regressions)))
+        self.stdout.write(self.style.SUCCESS('No regressions over the baseline'))
+
+
+@contextmanager
+def silence_request_log():
+    """Keeps the warnings and tracebacks of failed requests out of the
+    report, which shows their status already."""
+    logger = logging.getLogger('django.request')
+    disabled = logger.disabled
+    logger.disabled = True
+    try:
+        yield
+    finally:
+        logger.disabled = disabled
+
+
+def get_routes():
+    """(route, view) of every URL pattern of the project, with placeholders
+    for the path parameters."""
+    routes = {}
+    for view, regex, namespace, name in extract_views_from_urlpatterns(get_resolver().url_patterns):
+        route = simplify_regex(regex)
+        if route.startswith(EXCLUDED_PREFIXES) or '<format>' in route:
+            continue
+        routes.setdefault(route, view)
+    return sorted(routes.items())
+
+
+def allows_get(view):
+    actions = getattr(view, 'actions', None)
+    if actions is not None:
+        return 'get' in actions
+    view_class = getattr(view, 'cls', None) or getattr(view, 'view_class', None)
+    return hasattr(view_class, 'get')
+
+
+def route_url(route, objects):
+    """Fills each placeholder with the id of an object of the collection
+    named by the path segment before it."""
+    if route in ROUTE_URLS:
+        return ROUTE_URLS[route]
+    ids = dict(objects['ids'])
+    if route.startswith('/api/restaurants/'):
+        ids.update(objects['restaurant_ids'])
+    segments = route.split('/')
+    for index, segment in enumerate(segments):
+        if PLACEHOLDER.fullmatch(segment):
+            segments[index] = str(ids[segments[index - 1]])
+    return '/'.join(segments)
+
+
+def measure(client, url, data, repeat):
+    def request():
+        start = perf_counter()
+        try:
+            response = client.get(url, data)
+        except Exception:
+            # The test client raises what the view raised instead of answering 500
+            return (perf_counter() - start) * 1000, 500, 0
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return (perf_counter() - start) * 1000, response.status_code, len(content)
+
+    # The first request warms up caches and lazy imports
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        request()
+    timings = [request() for _ in range(repeat)]
+    latencies = sorted(elapsed for elapsed, _, _ in timings)
+    _, status, size = timings[-1]
+    return {
+        'status': status,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'queries': queries.count,
+        'bytes': size,
+    }
+
+
+class QueryCounter:
+    """Counts the queries run while installed as an execute wrapper. The
+    query log cannot be used: every request clears it when it starts."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def find_regressions(baseline, results, threshold):
+    regressions = []
+    for route, result in results.items():
+        before = baseline.get(route)
+        if before is None:
+            continue
+        if result['status'] != before['status']:
+            regressions.append('{}: status {} was {}'.format(route, result['status'], before['status']))
+        if result['queries'] > before['queries']:
+            regressions.append('{}: {} queries, was {}'.format(route, result['queries'], before['queries']))
+        p95_limit = max(before['p95_ms'] * (1 + threshold), before['p95_ms'] + LATENCY_NOISE_MS)
+        if result['p95_ms'] > p95_limit:
+            regressions.append('{}: p95 {:.2f} ms, was {:.2f} ms'.format(route, result['p95_ms'], before['p95_ms']))
+        if result['bytes'] > before['bytes'] * (1 + threshold):
+            regressions.append('{}: {} bytes, was {}'.format(route, result['bytes'], before['bytes']))
+    return regressions
+
+
+def seed_dataset(wineries, rng):
+    """Creates `wineries` approved wineries near Mendoza with their catalog,
+    events, occurrences, reservations and rates, plus one pending winery.
+    Returns the logged in user and an id per collection of the API."""
+    country = Country.objects.create(name='Argentina')
+    gender = Gender.objects.create(name='Other')
+    language = Language.objects.create(name='Spanish')
+    varietals = [Varietal.objects.create(value=value) for value in ('Malbec', 'Cabernet', 'Torrontes')]
+    tag = Tag.objects.create(name='Benchmark')
+    category = EventCategory.objects.create(name='Tasting')
+    restaurant_category = EventCategory.objects.create(name=RESTAURANT_CATEGORY)
+
+    tourists = [
+        WineUser.objects.create_user(
+            email='tourist{}@benchmark.com'.format(number),
+            password='benchmark',
+            first_name='Tourist',
+            last_name=str(number),
+            birth_date=date(1950 + number % 50, 1, 1),
+            gender=gender,
+            language=language,
+            phone='2610000000',
+            country=country,
+        )
+        for number in range(max(wineries, 1))
+    ]
+    now = datetime.now().replace(microsecond=0)
+    events = []
+    for number in range(wineries):
+        winery = Winery.objects.create(
+            name='Winery {}'.format(number),
+            description='Benchmark winery',
+            available_since=now,
+            location=Point(-68.84 + rng.uniform(-0.5, 0.5), -32.89 + rng.uniform(-0.5, 0.5)),
+        )
+        for line_number in range(2):
+            wine_line = WineLine.objects.create(name='Line {}'.format(line_number), description='Line', winery=winery)
+            Wine.objects.bulk_create(
+                Wine(
+                    name='Wine {}'.format(wine_number),
+                    description='Wine',
+                    winery=winery,
+                    varietal=rng.choice(varietals),
+                    wine_line=wine_line,
+                )
+                for wine_number in range(3)
+            )
+        for kind in (EVENT_KIND_EVENT, EVENT_KIND_EVENT, EVENT_KIND_RESTAURANT):
+            event = Event.objects.create(
+                name='Event {}'.format(len(events)),
+                description='Benchmark event',
+                winery=winery,
+                price=rng.randint(100, 2000),
+                kind=kind,
+            )
+            event.categories.add(restaurant_category if kind == EVENT_KIND_RESTAURANT else category)
+            event.tags.add(tag)
+            events.append(event)
+
+    EventOccurrence.objects.bulk_create(
+        EventOccurrence(
+            start=now + timedelta(days=day, hours=20),
+            end=now + timedelta(days=day, hours=23),
+            vacancies=50,
+            event=event,
+        )
+        for event in events
+        for day in range(1, 6)
+    )
+    # Only PostgreSQL sets the primary keys of bulk created rows
+    occurrences = EventOccurrence.objects.filter(event__in=events)
+    Reservation.objects.bulk_create(
+        Reservation(
+            attendee_number=rng.randint(1, 4),
+            paid_amount=0,
+            user=rng.choice(tourists),
+            event_occurrence=occurrence,
+            status=RESERVATION_CONFIRMED,
+        )
+        for occurrence in occurrences
+        for _ in range(2)
+    )
+    Rate.objects.bulk_create(
+        Rate(rate=rng.randint(1, 5), comment='Benchmark', event=event, user=rng.choice(tourists))
+        for event in events
+    )
+    Event.refresh_next_occurrences(Event.objects.filter(pk__in=[event.pk for event in events]))
+    Event.rebuild_ratings(Event.objects.filter(pk__in=[event.pk for event in events]))
+
+    pending = Winery.objects.create(name='Pending winery', description='Benchmark winery')
+    winery = events[0].winery if events else pending
+    user = WineUser.objects.create_superuser(
+        email='admin@benchmark.com',
+        password='benchmark',
+        first_name='Admin',
+        last_name='Benchmark',
+        gender=gender.pk,
+        language=language.pk,
+        phone='2610000000',
+        country=country.pk,
+        winery=winery,
+    )
+    own_events = [event for event in events if event.winery == winery]
+    event = next((event for event in own_events if event.kind == EVENT_KIND_EVENT), None)
+    restaurant = next((event for event in own_events if event.kind == EVENT_KIND_RESTAURANT), None)
+    wine_line = WineLine.objects.filter(winery=winery).first()
+    return {
+        'user': user,
+        'ids': {
+            'users': user.pk,
+            'wineries': winery.pk,
+            'wine-lines': getattr(wine_line, 'pk', 0),
+            'wines': getattr(Wine.objects.filter(wine_line=wine_line).first(), 'pk', 0),
+            'events': getattr(event, 'pk', 0),
+            'tags': tag.pk,
+            'countries': country.pk,
+            'varietals': varietals[0].pk,
+            'languages': language.pk,
+            'genders': gender.pk,
+            'event-categories': category.pk,
+            'approve-wineries': pending.pk,
+            **event_ids(event),
+        },
+        'restaurant_ids': {'restaurants': getattr(restaurant, 'pk', 0), **event_ids(restaurant)},
+    }
+
+
+def event_ids(event):
+    occurrence = EventOccurrence.objects.filter(event=event).first()
+    return {
+        'occurrences': getattr(occurrence, 'pk', 0),
+        'reservations': getattr(Reservation.objects.filter(event_occurrence=occurrence).first(), 'pk', 0),
+        'ratings': getattr(Rate.objects.filter(event=event).first(), 'pk', 0),
+    }
@@ -0,0 +1,70 @@
+import random
+from statistics import median
+from time import perf_counter
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import Winery
+from api.proximity import get_proximity_backend, location_column, nearest
+
+# Around the wine regions of Mendoza, in degrees
+MIN_X, MAX_X = -69.6, -68.0
+MIN_Y, MAX_Y = -35.0, -32.6
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the nearest wineries search walking the spatial index against measuring every winery, '
+        'over random wineries around Mendoza. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wineries', type=int, default=10000)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--radius', type=float, default=100, help='Kilometers')
+        parser.add_argument('--repeat', type=int, default=20, help='Points searched, the median is reported')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        radius = options['radius'] * 1000
+        with transaction.atomic():
+            Winery.objects.bulk_create(
+                Winery(
+                    name='Benchmark',
+                    description='Benchmark',
+                    available_since='2019-10-01T00:00:00',
+                    location=Point(rng.uniform(MIN_X, MAX_X), rng.uniform(MIN_Y, MAX_Y), srid=4326),
+                )
+                for _ in range(options['wineries'])
+            )
+            queryset = Winery.objects.filter(available_since__isnull=False, location__isnull=False)
+            backend = get_proximity_backend(connection)
+            indexed, scanned = [], []
+            for _ in range(options['repeat']):
+                point = Point(rng.uniform(MIN_X, MAX_X), rng.uniform(MIN_Y, MAX_Y), srid=4326)
+
+                start = perf_counter()
+                found = [winery.pk for winery in nearest(queryset, point, options['limit'], radius)]
+                indexed.append((perf_counter() - start) * 1000)
+
+                start = perf_counter()
+                expected = list(
+                    queryset.annotate(distance=backend.distance(location_column(queryset), point))
+                    .filter(distance__lte=radius)
+                    .order_by('distance', 'pk')
+                    .values_list('pk', flat=True)[:options['limit']]
+                )
+                scanned.append((perf_counter() - start) * 1000)
+                if found != expected:
+                    raise CommandError('The index search missed wineries near {}'.format(point.coords))
+            transaction.set_rollback(True)
+
+        self.stdout.write('{} wineries, {} nearest within {:g} km, median of {} points'.format(
+            options['wineries'], options['limit'], options['radius'], options['repeat']
+        ))
+        self.stdout.write('spatial index: {:.2f} ms'.format(median(indexed)))
+        self.stdout.write('full scan: {:.2f} ms'.format(median(scanned)))
+        self.stdout.write(self.style.SUCCESS('Spatial index: {:.1f}x faster'.format(median(scanned) / median(indexed))))
@@ -0,0 +1,75 @@
+from datetime import date, datetime, time, timedelta
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Event, EventOccurrence, EventSchedule, Winery
+
+SCHEDULE_DAYS = (1, 30, 365)
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the occurrences generated by daily schedules of 1, 30 and 365 days, '
+        'batched against one insert per occurrence. Nothing is kept in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per schedule, the median is reported')
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>6} {:>12} {:>14} {:>10} {:>14} {:>10}'.format(
+            'days', 'occurrences', 'batched ms', 'queries', 'row by row ms', 'queries'
+        ))
+        for days in SCHEDULE_DAYS:
+            from_date = date.today() + timedelta(days=1)
+            schedule = [{
+                'from_date': from_date,
+                'to_date': from_date + timedelta(days=days - 1),
+                'start_time': time(20),
+                'end_time': time(23),
+                'weekdays': None,
+            }]
+            batched = [self.measure(self.create_batched, schedule) for _ in range(options['repeat'])]
+            row_by_row = [self.measure(self.create_row_by_row, schedule) for _ in range(options['repeat'])]
+            self.stdout.write('{:>6} {:>12} {:>14.2f} {:>10} {:>14.2f} {:>10}'.format(
+                days,
+                EventSchedule.count_pending_occurrences(schedule, until=schedule[0]['to_date']),
+                median(elapsed for elapsed, _ in batched),
+                batched[0][1],
+                median(elapsed for elapsed, _ in row_by_row),
+                row_by_row[0][1],
+            ))
+
+    @staticmethod
+    def create_batched(event, schedule):
+        event.add_schedules(schedule, vacancies=10, until=schedule[0]['to_date'])
+
+    @staticmethod
+    def create_row_by_row(event, schedule):
+        for elem in schedule:
+            dates = Event.calculate_dates_in_threshold(elem['from_date'], elem['to_date'], elem['weekdays'])
+            for day in dates:
+                EventOccurrence.objects.create(
+                    start=datetime.combine(day, elem['start_time']),
+                    end=datetime.combine(day, elem['end_time']),
+                    vacancies=10,
+                    event=event,
+                )
+
+    @staticmethod
+    def measure(create, schedule):
+        """Returns the milliseconds and queries taken by `create`, rolling
+        back everything it wrote."""
+        with transaction.atomic():
+            winery = Winery.objects.create(name='Benchmark', description='Benchmark')
+            event = Event.objects.create(name='Benchmark', description='Benchmark', winery=winery, price=0)
+            with CaptureQueriesContext(connection) as queries:
+                start = perf_counter()
+                create(event, schedule)
+                elapsed = (perf_counter() - start) * 1000
+            transaction.set_rollback(True)
+        return elapsed, len(queries)
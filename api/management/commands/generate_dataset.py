@@ -0,0 +1,322 @@
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, reset_queries
+from django.db.models import Max
+
+from api import (
+    EVENT_KIND_EVENT,
+    EVENT_KIND_RESTAURANT,
+    RESERVATION_CANCELLED,
+    RESERVATION_CONFIRMED,
+    RESERVATION_CREATED,
+    RESERVATION_PAIDOUT,
+    RESTAURANT_CATEGORY,
+)
+from api.cache import bump_catalog_version
+from api.clusters import clear_cluster_cache
+from api.models import (
+    Country,
+    Event,
+    EventCategory,
+    EventOccurrence,
+    Gender,
+    Language,
+    Rate,
+    Reservation,
+    Tag,
+    Varietal,
+    Wine,
+    WineLine,
+    Winery,
+)
+from api.search import rebuild_index
+from api.tiles import clear_vector_tiles
+from users import TOURIST, WINERY
+from users.models import WineUser
+
+# (latitude, longitude, spread in degrees) of the wine regions of Mendoza
+REGIONS = (
+    (-33.04, -68.88, 0.08),  # Luján de Cuyo
+    (-32.98, -68.78, 0.06),  # Maipú
+    (-33.60, -69.20, 0.15),  # Valle de Uco
+    (-33.10, -68.47, 0.10),  # Zona Este
+    (-34.62, -68.33, 0.10),  # San Rafael
+)
+
+COUNTRIES = ('Argentina', 'Chile', 'Brasil', 'Uruguay', 'Estados Unidos', 'España', 'Francia', 'Alemania')
+LANGUAGES = ('Español', 'English', 'Português', 'Français', 'Deutsch')
+GENDERS = ('Masculino', 'Femenino', 'Otro')
+VARIETALS = ('Malbec', 'Cabernet Sauvignon', 'Bonarda', 'Syrah', 'Merlot', 'Torrontés', 'Chardonnay', 'Pinot Noir')
+TAGS = ('degustación', 'maridaje', 'familia', 'cosecha', 'bodega', 'viñedo', 'cata', 'almuerzo')
+CATEGORIES = ('Degustación', 'Visita guiada', 'Cabalgata', 'Concierto', 'Cosecha', RESTAURANT_CATEGORY)
+
+FIRST_NAMES = ('Juan', 'María', 'Lucía', 'Martín', 'Sofía', 'Mateo', 'Valentina', 'Pedro', 'Emma', 'Tomás')
+LAST_NAMES = ('González', 'Rodríguez', 'Gómez', 'Fernández', 'López', 'Díaz', 'Martínez', 'Pérez', 'Smith', 'Silva')
+WINERY_NAMES = ('Bodega', 'Finca', 'Viña', 'Casa', 'Estancia')
+WINERY_SURNAMES = ('del Sol', 'Los Álamos', 'La Consulta', 'Las Piedras', 'El Cerro', 'Altamira', 'Los Andes')
+EVENT_NAMES = ('Degustación de', 'Visita y cata de', 'Almuerzo con', 'Noche de', 'Cosecha de')
+
+CAPACITIES = (10, 15, 20, 30, 40, 60)
+STEP_DAYS = (1, 1, 2, 7)
+
+
+class BatchWriter:
+    """Buffers new rows of a model with preassigned primary keys and inserts
+    them with bulk_create every `batch_size` rows.
+
+    Children reference rows by the ids `add` hands out, so a writer flushes
+    the writers of the models it points to first."""
+
+    def __init__(self, model, batch_size, report, parents=()):
+        self.model = model
+        self.batch_size = batch_size
+        self.report = report
+        self.parents = parents
+        self.rows = []
+        self.count = 0
+        self.next_id = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        self.first_id = self.next_id
+
+    def add(self, **fields):
+        row = self.model(pk=self.next_id, **fields)
+        self.next_id += 1
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        return row.pk
+
+    def flush(self):
+        for parent in self.parents:
+            parent.flush()
+        if not self.rows:
+            return
+        self.model.objects.bulk_create(self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+        # With DEBUG on, the query log would keep the SQL of every batch
+        reset_queries()
+        self.report(self)
+
+    def ids(self):
+        return range(self.first_id, self.next_id)
+
+
+class Command(BaseCommand):
+    help = (
+        'Adds a synthetic, reproducible dataset of Mendoza wineries with their wines, recurring events, '
+        'occurrences, reservations, rates and users. The same options produce the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--wineries', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=20000, help='Tourists, winery owners are added on top')
+        parser.add_argument('--events-per-winery', type=int, default=5)
+        parser.add_argument('--occurrences-per-event', type=int, default=200)
+        parser.add_argument('--reservations-per-occurrence', type=int, default=2, help='Average, drawn at random')
+        parser.add_argument('--rates-per-event', type=int, default=10, help='Average, drawn at random')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per insert')
+        parser.add_argument('--progress-every', type=int, default=100000, help='Rows between progress lines')
+        parser.add_argument(
+            '--start-date',
+            type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+            default=date.today(),
+            help='Half of the occurrences fall before this day (YYYY-MM-DD), defaults to today',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.started = perf_counter()
+        self.reported = {}
+        batch_size = options['batch_size']
+
+        lookups = {
+            'countries': self.lookup_ids(Country, 'name', COUNTRIES),
+            'languages': self.lookup_ids(Language, 'name', LANGUAGES),
+            'genders': self.lookup_ids(Gender, 'name', GENDERS),
+            'varietals': self.lookup_ids(Varietal, 'value', VARIETALS),
+            'tags': self.lookup_ids(Tag, 'name', TAGS),
+            'categories': self.lookup_ids(EventCategory, 'name', CATEGORIES),
+        }
+        wineries = BatchWriter(Winery, batch_size, self.report)
+        users = BatchWriter(WineUser, batch_size, self.report, parents=[wineries])
+        wine_lines = BatchWriter(WineLine, batch_size, self.report, parents=[wineries])
+        wines = BatchWriter(Wine, batch_size, self.report, parents=[wine_lines])
+        events = BatchWriter(Event, batch_size, self.report, parents=[wineries])
+        event_categories = BatchWriter(Event.categories.through, batch_size, self.report, parents=[events])
+        event_tags = BatchWriter(Event.tags.through, batch_size, self.report, parents=[events])
+        occurrences = BatchWriter(EventOccurrence, batch_size, self.report, parents=[events])
+        reservations = BatchWriter(Reservation, batch_size, self.report, parents=[occurrences, users])
+        rates = BatchWriter(Rate, batch_size, self.report, parents=[events, users])
+        writers = [
+            wineries, users, wine_lines, wines, events, event_categories,
+            event_tags, occurrences, reservations, rates,
+        ]
+
+        # Every user shares one password hash, hashing each would dominate the run
+        password = make_password('winecompanion')
+        for _ in range(options['users']):
+            self.add_user(users, lookups, password, TOURIST)
+        tourists = users.ids()
+
+        for _ in range(options['wineries']):
+            winery = self.add_winery(wineries)
+            self.add_user(users, lookups, password, WINERY, winery=winery)
+            self.add_catalog(wine_lines, wines, lookups, winery)
+            for _ in range(options['events_per_winery']):
+                event, price = self.add_event(events, event_categories, event_tags, lookups, winery)
+                self.add_occurrences(occurrences, reservations, tourists, event, price)
+                count = self.rng.randint(0, 2 * options['rates_per_event'])
+                for user in self.rng.sample(tourists, min(count, len(tourists))):
+                    rates.add(rate=self.rng.randint(1, 5), comment='Comentario de prueba', event_id=event, user_id=user)
+
+        for writer in writers:
+            writer.flush()
+        self.reset_sequences([writer.model for writer in writers])
+
+        self.stdout.write('Refreshing the aggregates and the search index')
+        new_events = Event.objects.filter(pk__in=events.ids())
+        Event.refresh_next_occurrences(new_events)
+        Event.rebuild_ratings(new_events)
+        rebuild_index()
+        bump_catalog_version()
+        clear_cluster_cache()
+        clear_vector_tiles()
+
+        total = sum(writer.count for writer in writers)
+        self.stdout.write(self.style.SUCCESS('Created {} rows in {:.0f}s: {}'.format(
+            total,
+            perf_counter() - self.started,
+            ', '.join('{} {}'.format(writer.count, writer.model._meta.verbose_name_plural) for writer in writers),
+        )))
+
+    def report(self, writer):
+        reported = writer.count // self.options['progress_every']
+        if reported <= self.reported.get(writer.model, 0):
+            return
+        self.reported[writer.model] = reported
+        self.stdout.write('{}: {} rows ({:.0f}s)'.format(
+            writer.model._meta.verbose_name_plural, writer.count, perf_counter() - self.started
+        ))
+
+    @staticmethod
+    def lookup_ids(model, field, values):
+        return [model.objects.get_or_create(**{field: value})[0].pk for value in values]
+
+    def add_user(self, users, lookups, password, user_type, winery=None):
+        rng = self.rng
+        number = users.next_id
+        return users.add(
+            email='user{}@dataset.winecompanion.com'.format(number),
+            password=password,
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            birth_date=date(1940, 1, 1) + timedelta(days=rng.randrange(60 * 365)),
+            user_type=user_type,
+            winery_id=winery,
+            country_id=rng.choice(lookups['countries']),
+            gender_id=rng.choice(lookups['genders']),
+            language_id=rng.choice(lookups['languages']),
+            phone='261{:07d}'.format(rng.randrange(10 ** 7)),
+        )
+
+    def add_winery(self, wineries):
+        rng = self.rng
+        latitude, longitude, spread = rng.choice(REGIONS)
+        approved = rng.random() < 0.9
+        return wineries.add(
+            name='{} {}'.format(rng.choice(WINERY_NAMES), rng.choice(WINERY_SURNAMES))[:30],
+            description='Bodega familiar de Mendoza',
+            website='www.bodega{}.com.ar'.format(wineries.next_id),
+            available_since=datetime.combine(self.options['start_date'], time()) if approved else None,
+            location=Point(rng.gauss(longitude, spread), rng.gauss(latitude, spread)),
+        )
+
+    def add_catalog(self, wine_lines, wines, lookups, winery):
+        rng = self.rng
+        for line_number in range(rng.randint(1, 4)):
+            wine_line = wine_lines.add(name='Línea {}'.format(line_number + 1), description='Línea', winery_id=winery)
+            for _ in range(rng.randint(2, 6)):
+                varietal = rng.choice(VARIETALS)
+                wines.add(
+                    name=varietal[:20],
+                    description='{} de altura'.format(varietal),
+                    winery_id=winery,
+                    varietal_id=lookups['varietals'][VARIETALS.index(varietal)],
+                    wine_line_id=wine_line,
+                )
+
+    def add_event(self, events, event_categories, event_tags, lookups, winery):
+        rng = self.rng
+        kind = EVENT_KIND_RESTAURANT if rng.random() < 0.1 else EVENT_KIND_EVENT
+        price = Decimal(rng.randrange(500, 10000, 50))
+        event = events.add(
+            name='{} {}'.format(rng.choice(EVENT_NAMES), rng.choice(VARIETALS)),
+            description='Evento recurrente',
+            winery_id=winery,
+            price=price,
+            kind=kind,
+        )
+        if kind == EVENT_KIND_RESTAURANT:
+            categories = [lookups['categories'][-1]]
+        else:
+            categories = rng.sample(lookups['categories'][:-1], rng.randint(1, 2))
+        for category in categories:
+            event_categories.add(event_id=event, eventcategory_id=category)
+        for tag in rng.sample(lookups['tags'], rng.randint(0, 3)):
+            event_tags.add(event_id=event, tag_id=tag)
+        return event, price
+
+    def add_occurrences(self, occurrences, reservations, tourists, event, price):
+        """Occurrences every few days at the same hour, half of them before
+        the start date, each with its reservations."""
+        rng = self.rng
+        count = self.options['occurrences_per_event']
+        step = rng.choice(STEP_DAYS)
+        hour = rng.choice((11, 13, 18, 20))
+        first_day = self.options['start_date'] - timedelta(days=step * (count // 2))
+        for number in range(count):
+            start = datetime.combine(first_day + timedelta(days=step * number), time(hour))
+            capacity = rng.choice(CAPACITIES)
+            seats = 0
+            booked = []
+            for _ in range(rng.randint(0, 2 * self.options['reservations_per_occurrence'])):
+                attendees = rng.randint(1, 4)
+                if seats + attendees > capacity:
+                    break
+                status = rng.choice((RESERVATION_CREATED, RESERVATION_CONFIRMED, RESERVATION_PAIDOUT))
+                if rng.random() < 0.05:
+                    status = RESERVATION_CANCELLED
+                else:
+                    seats += attendees
+                booked.append((attendees, status, rng.choice(tourists)))
+            occurrence = occurrences.add(
+                start=start,
+                end=start + timedelta(hours=3),
+                vacancies=capacity - seats,
+                cancelled=start - timedelta(days=1) if rng.random() < 0.02 else None,
+                event_id=event,
+            )
+            for attendees, status, user in booked:
+                reservations.add(
+                    attendee_number=attendees,
+                    paid_amount=price * attendees,
+                    user_id=user,
+                    event_occurrence_id=occurrence,
+                    status=status,
+                )
+
+    def reset_sequences(self, models):
+        """Moves the id sequences past the preassigned primary keys."""
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
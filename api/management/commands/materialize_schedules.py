@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from api.models import EventSchedule
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Writes the occurrences of the event schedules up to the rolling horizon'
+
+    def handle(self, *args, **options):
+        until = EventSchedule.horizon()
+        schedules = EventSchedule.objects.filter(
+            Q(materialized_until__isnull=True) | Q(materialized_until__lt=until),
+            event__cancelled__isnull=True,
+        ).exclude(to_date__lte=F('materialized_until')).order_by('pk')
+
+        created = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                chunk = list(schedules.filter(pk__gt=last_pk).select_for_update()[:CHUNK_SIZE])
+                if not chunk:
+                    break
+                created += len(EventSchedule.materialize(chunk, until))
+            last_pk = chunk[-1].pk
+        self.stdout.write(self.style.SUCCESS(
+            'Created {} occurrences up to {}'.format(created, until.isoformat())
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the rating sum and count stored on every event'
+
+    def handle(self, *args, **options):
+        updated = Event.rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS('Rebuilt ratings of {} events'.format(updated)))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_catalog_version
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recreates the full-text search documents of every event and winery'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS('Indexed {} documents'.format(indexed)))
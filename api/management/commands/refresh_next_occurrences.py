@@ -0,0 +1,37 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_catalog_version
+from api.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Rolls the next occurrence of the events forward once it has started'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Recompute every event instead of only the ones whose next occurrence already started',
+        )
+        parser.add_argument('--loop', action='store_true', help='Keep refreshing instead of exiting after one pass')
+        parser.add_argument('--interval', type=float, default=300, help='Seconds between passes with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            self.refresh(options['all'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def refresh(self, refresh_all):
+        now = datetime.now()
+        events = Event.objects.all()
+        if not refresh_all:
+            events = events.filter(next_occurrence_start__lte=now)
+        updated = Event.refresh_next_occurrences(events, now)
+        if updated:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS('Refreshed the next occurrence of {} events'.format(updated)))
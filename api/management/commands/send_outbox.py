@@ -0,0 +1,45 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from api import MAIL_BATCH_SIZE
+from api.outbox import DeliveryStats, queue_metrics, send_batch
+
+
+class Command(BaseCommand):
+    help = 'Sends the mails queued in the outbox over a single connection, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=MAIL_BATCH_SIZE)
+        parser.add_argument(
+            '--loop', action='store_true', help='Keep polling the outbox instead of exiting once it is drained'
+        )
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when the outbox is drained')
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        stats = DeliveryStats()
+        try:
+            while True:
+                if send_batch(connection, options['batch_size'], stats):
+                    continue
+                if not options['loop']:
+                    break
+                if stats.latencies:
+                    self.report(stats)
+                    stats = DeliveryStats()
+                # Do not hold the connection while idle
+                connection.close()
+                time.sleep(options['interval'])
+        finally:
+            connection.close()
+        self.report(stats)
+
+    def report(self, stats):
+        metrics = queue_metrics()
+        self.stdout.write(self.style.SUCCESS(
+            '{}; {pending} pending ({due} due, oldest {oldest_seconds:.0f}s), {failed} given up'.format(
+                stats.summary(), **metrics
+            )
+        ))
@@ -0,0 +1,127 @@
+import threading
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+
+from api.booking import NotEnoughVacancies, book
+from api.models import Country, Event, EventOccurrence, Gender, Language, Reservation, Winery
+
+MODES = ('single', 'sharded')
+
+
+class Command(BaseCommand):
+    help = (
+        'Books a single occurrence from concurrent threads, checks it was not oversold '
+        'and reports the bookings per second. The rows it creates are removed afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=50, help='Bookings attempted by each thread')
+        parser.add_argument('--vacancies', type=int, default=100)
+        parser.add_argument('--attendees', type=int, default=1, help='People in every reservation')
+        parser.add_argument(
+            '--mode',
+            choices=MODES + ('compare',),
+            default='single',
+            help='Keep the vacancies in the occurrence row, spread them over counters, or run both',
+        )
+
+    def handle(self, *args, **options):
+        modes = MODES if options['mode'] == 'compare' else (options['mode'],)
+        rates = {mode: self.run(mode, options) for mode in modes}
+        if len(rates) > 1:
+            self.stdout.write('Sharded counters: {:.2f}x the bookings/s of the single row'.format(
+                rates['sharded'] / rates['single']
+            ))
+
+    def run(self, mode, options):
+        fixture = self.create_fixture(options['vacancies'], mode == 'sharded')
+        occurrence = fixture['occurrence']
+        counts = {'booked': 0, 'rejected': 0, 'retried': 0}
+        lock = threading.Lock()
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def worker():
+            try:
+                for _ in range(options['attempts']):
+                    while True:
+                        try:
+                            book(fixture['user'].id, occurrence, options['attendees'], paid_amount=0)
+                            count('booked')
+                        except NotEnoughVacancies:
+                            count('rejected')
+                        except OperationalError:
+                            # SQLite rejects concurrent writers instead of queueing them
+                            count('retried')
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        start = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - start
+
+        occurrence.refresh_from_db()
+        left = occurrence.available_vacancies()
+        seats = Reservation.objects.filter(event_occurrence=occurrence).aggregate(
+            seats=Sum('attendee_number')
+        )['seats'] or 0
+        self.delete_fixture(fixture)
+
+        rate = counts['booked'] / elapsed
+        self.stdout.write(
+            '{mode}: {booked} bookings, {rejected} rejected, {retried} retried in {elapsed:.2f}s '
+            '({rate:.1f} bookings/s)'.format(mode=mode, elapsed=elapsed, rate=rate, **counts)
+        )
+        self.stdout.write('{} of {} vacancies booked, {} left'.format(seats, options['vacancies'], left))
+        if seats > options['vacancies'] or seats + left != options['vacancies']:
+            raise CommandError('The occurrence was oversold')
+        self.stdout.write(self.style.SUCCESS('No oversell'))
+        return rate
+
+    @staticmethod
+    def create_fixture(vacancies, sharded):
+        fixture = {
+            'country': Country.objects.create(name='Stress test'),
+            'gender': Gender.objects.create(name='Stress test'),
+            'language': Language.objects.create(name='Stress test'),
+            'winery': Winery.objects.create(name='Stress test', description='Stress test'),
+        }
+        fixture['user'] = get_user_model().objects.create_user(
+            email='stress-test-{}@winecompanion.com'.format(datetime.now().timestamp()),
+            country=fixture['country'],
+            gender=fixture['gender'],
+            language=fixture['language'],
+        )
+        fixture['event'] = Event.objects.create(
+            name='Stress test', description='Stress test', winery=fixture['winery'], price=0
+        )
+        start = datetime.now() + timedelta(days=1)
+        fixture['occurrence'] = EventOccurrence.objects.create(
+            start=start, end=start + timedelta(hours=1), vacancies=vacancies, event=fixture['event']
+        )
+        EventOccurrence.reshard(
+            EventOccurrence.objects.filter(pk=fixture['occurrence'].pk),
+            threshold=0 if sharded else vacancies,
+        )
+        fixture['occurrence'].refresh_from_db()
+        return fixture
+
+    @staticmethod
+    def delete_fixture(fixture):
+        Reservation.objects.filter(event_occurrence=fixture['occurrence']).delete()
+        for key in ('user', 'event', 'winery', 'country', 'gender', 'language'):
+            fixture[key].delete()
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    Rate = apps.get_model('api', 'Rate')
+    rates = Rate.objects.filter(event=OuterRef('pk')).order_by().values('event')
+    Event.objects.update(
+        rating_sum=Coalesce(Subquery(rates.annotate(total=Sum('rate')).values('total')), 0),
+        rating_count=Coalesce(Subquery(rates.annotate(total=Count('id')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_auto_20191126_0759'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+def backfill_event_kind(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    restaurants = Event.objects.filter(categories__name__icontains='restaurant').values('pk')
+    Event.objects.filter(pk__in=restaurants).update(kind=2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_event_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Event'), (2, 'Restaurant')], db_index=True, default=1),
+        ),
+        migrations.RunPython(backfill_event_kind, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:47
+
+from datetime import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_next_occurrence(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    EventOccurrence = apps.get_model('api', 'EventOccurrence')
+    occurrences = EventOccurrence.objects.filter(
+        event=OuterRef('pk'),
+        start__gt=datetime.now(),
+        cancelled__isnull=True,
+    ).order_by().values('event')
+    Event.objects.update(
+        next_occurrence_start=Subquery(occurrences.annotate(first=Min('start')).values('first')),
+        open_occurrences_count=Coalesce(Subquery(occurrences.annotate(total=Count('id')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_event_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='next_occurrence_start',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='open_occurrences_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['kind', 'next_occurrence_start'], name='api_event_kind_next_idx'),
+        ),
+        migrations.RunPython(backfill_next_occurrence, migrations.RunPython.noop),
+    ]
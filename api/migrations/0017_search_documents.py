@@ -0,0 +1,114 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:50
+
+from django.db import migrations, models
+
+POSTGRESQL_INDEX = [
+    'ALTER TABLE api_searchdocument ADD COLUMN vector tsvector',
+    'CREATE INDEX api_searchdocument_vector_idx ON api_searchdocument USING GIN (vector)',
+    """
+    CREATE FUNCTION api_searchdocument_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.vector :=
+            setweight(to_tsvector('spanish', NEW.title), 'A') ||
+            setweight(to_tsvector('english', NEW.title), 'A') ||
+            setweight(to_tsvector('spanish', NEW.body), 'B') ||
+            setweight(to_tsvector('english', NEW.body), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER api_searchdocument_vector_update BEFORE INSERT OR UPDATE ON api_searchdocument
+    FOR EACH ROW EXECUTE PROCEDURE api_searchdocument_vector()
+    """,
+]
+
+POSTGRESQL_DROP_INDEX = [
+    'DROP TRIGGER api_searchdocument_vector_update ON api_searchdocument',
+    'DROP FUNCTION api_searchdocument_vector()',
+    'ALTER TABLE api_searchdocument DROP COLUMN vector',
+]
+
+# External content FTS5 table, the triggers mirror every change of the documents
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE api_searchdocument_fts USING fts5(
+        title, body, content='api_searchdocument', content_rowid='id', tokenize='unicode61 remove_diacritics 1'
+    )
+    """,
+    """
+    CREATE TRIGGER api_searchdocument_fts_insert AFTER INSERT ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER api_searchdocument_fts_delete AFTER DELETE ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts (api_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER api_searchdocument_fts_update AFTER UPDATE ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts (api_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO api_searchdocument_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    """,
+]
+
+SQLITE_DROP_INDEX = [
+    'DROP TRIGGER api_searchdocument_fts_insert',
+    'DROP TRIGGER api_searchdocument_fts_delete',
+    'DROP TRIGGER api_searchdocument_fts_update',
+    'DROP TABLE api_searchdocument_fts',
+]
+
+
+def run_vendor_statements(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+def index_documents(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    Winery = apps.get_model('api', 'Winery')
+    SearchDocument = apps.get_model('api', 'SearchDocument')
+    documents = []
+    for event in Event.objects.select_related('winery').prefetch_related('tags', 'categories'):
+        body = [event.description, event.winery.name]
+        body.extend(tag.name for tag in event.tags.all())
+        body.extend(category.name for category in event.categories.all())
+        documents.append(SearchDocument(kind=1, object_id=event.id, title=event.name, body='\n'.join(body)))
+    for winery in Winery.objects.all():
+        documents.append(SearchDocument(kind=2, object_id=winery.id, title=winery.name, body=winery.description))
+    SearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_event_next_occurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Event'), (2, 'Winery')])),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.TextField()),
+                ('body', models.TextField()),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(
+            run_vendor_statements({'postgresql': POSTGRESQL_INDEX, 'sqlite': SQLITE_INDEX}),
+            run_vendor_statements({'postgresql': POSTGRESQL_DROP_INDEX, 'sqlite': SQLITE_DROP_INDEX}),
+        ),
+        migrations.RunPython(index_documents, migrations.RunPython.noop),
+    ]
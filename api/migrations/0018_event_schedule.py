@@ -0,0 +1,28 @@
+# Generated by Django 2.2.4 on 2026-10-18 01:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_search_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_date', models.DateField()),
+                ('to_date', models.DateField(blank=True, null=True)),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('weekdays', models.PositiveSmallIntegerField(default=127)),
+                ('vacancies', models.PositiveIntegerField()),
+                ('materialized_until', models.DateField(blank=True, null=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to='api.Event')),
+            ],
+        ),
+    ]
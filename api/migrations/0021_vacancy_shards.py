@@ -0,0 +1,31 @@
+# Generated by Django 2.2.4 on 2026-10-18 02:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_mail_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventoccurrence',
+            name='sharded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='VacancyShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('vacancies', models.PositiveIntegerField()),
+                ('event_occurrence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vacancy_shards', to='api.EventOccurrence')),
+            ],
+            options={
+                'unique_together': {('event_occurrence', 'slot')},
+            },
+        ),
+    ]
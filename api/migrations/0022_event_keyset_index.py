@@ -0,0 +1,17 @@
+# Generated by Django 2.2.4 on 2026-10-18 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_vacancy_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['next_occurrence_start', 'id'], name='api_event_next_id_idx'),
+        ),
+    ]
@@ -1,29 +1,92 @@
+import json
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.gis.db.models import PointField
 from django.contrib.gis import geos
-from django.contrib.gis.measure import Distance
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.core.serializers.json import DjangoJSONEncoder
 
 from . import (
+    ALL_WEEKDAYS,
     DEFAULT_CANCELLATION_REASON,
+    EVENT_KIND_EVENT,
+    EVENT_KIND_RESTAURANT,
+    EVENT_KINDS,
+    MAIL_BATCH_SIZE,
+    MAIL_MAX_ATTEMPTS,
+    MAIL_RETRY_BACKOFF,
+    OCCURRENCE_BATCH_SIZE,
     RESERVATION_STATUS,
     RESERVATION_CANCELLED,
     RESERVATION_CONFIRMED,
+    RESTAURANT_CATEGORY,
+    SEARCH_DOCUMENT_KINDS,
 )
+from .cache import bump_catalog_version
+from .live import publish_occurrences
+from .proximity import nearest, nearest_distances
 
 
 class Mail():
     @staticmethod
-    def send_mail(subject, message, mailto, html_message=None, fail_silently=False):
-        mailfrom = settings.EMAIL_HOST_USER
-        if settings.SEND_EMAILS:
-            send_mail(subject, message, mailfrom, mailto, html_message=html_message, fail_silently=fail_silently)
+    def send_mail(subject, template, context, mailto):
+        """Adds the `template` rendered with `context` to the outbox for each
+        address of `mailto`. The send_outbox command delivers it."""
+        Mail.send_mass_mail((subject, template, context, recipient) for recipient in mailto)
+
+    @staticmethod
+    def send_mass_mail(messages):
+        """Adds (subject, template, context, recipient) messages to the outbox
+        with batched inserts."""
+        if not settings.SEND_EMAILS:
+            return []
+        return OutboxMail.objects.bulk_create(
+            (
+                OutboxMail(
+                    subject=subject,
+                    template=template,
+                    context=json.dumps(context, cls=DjangoJSONEncoder, sort_keys=True),
+                    recipient=recipient,
+                )
+                for subject, template, context, recipient in messages
+            ),
+            batch_size=MAIL_BATCH_SIZE,
+        )
+
+
+class OutboxMail(models.Model):
+    """Email waiting to be rendered and sent by the send_outbox command.
+
+    Failed deliveries are retried with exponential backoff until
+    MAIL_MAX_ATTEMPTS; `sent` stays empty for those given up on.
+    """
+    subject = models.CharField(max_length=255)
+    template = models.CharField(max_length=100)
+    context = models.TextField()
+    recipient = models.EmailField()
+    created = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=datetime.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = (('sent', 'next_attempt'), )
+
+    @staticmethod
+    def pending():
+        return OutboxMail.objects.filter(sent__isnull=True, attempts__lt=MAIL_MAX_ATTEMPTS)
+
+    def retry_delay(self):
+        return timedelta(seconds=MAIL_RETRY_BACKOFF * 2 ** (self.attempts - 1))
+
+    def __str__(self):
+        return '{}: {}'.format(self.recipient, self.subject)
 
 
 class Country(models.Model):
@@ -81,16 +144,20 @@ class Winery(models.Model):
         return self.name
 
     @staticmethod
-    def get_nearly_wineries(location, ratio):
-        current_point = geos.fromstr(location)
-        distance_from_point = {'km': ratio}
-        distance = Distance(**distance_from_point)
-        wineries = Winery.objects.filter(
-            location__distance_lt=(current_point, distance),
-            location__isnull=False,
-            available_since__isnull=False,
-        )
-        return wineries
+    def get_nearest_wineries(location, limit, ratio, queryset=None):
+        """Up to `limit` approved wineries within `ratio` km of `location`,
+        nearest first, each with its `distance` in meters."""
+        queryset = Winery.objects.all() if queryset is None else queryset
+        current_point = geos.fromstr(location, srid=4326)
+        return nearest(queryset.filter(available_since__isnull=False), current_point, limit, ratio * 1000)
+
+    @staticmethod
+    def get_nearest_winery_distances(location, limit, ratio):
+        """(pk, meters) of the wineries get_nearest_wineries would return,
+        without loading them."""
+        current_point = geos.fromstr(location, srid=4326)
+        approved = Winery.objects.filter(available_since__isnull=False)
+        return nearest_distances(approved, current_point, limit, ratio * 1000)
 
 
 class WineLine(models.Model):
@@ -151,6 +218,49 @@ class Event(models.Model):
         decimal_places=2,
         validators=[MinValueValidator(Decimal('0.00'))]
     )
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    kind = models.PositiveSmallIntegerField(choices=EVENT_KINDS, default=EVENT_KIND_EVENT, db_index=True)
+    next_occurrence_start = models.DateTimeField(null=True, blank=True, db_index=True)
+    open_occurrences_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'next_occurrence_start'], name='api_event_kind_next_idx'),
+            # Keyset of the event listings
+            models.Index(fields=['next_occurrence_start', 'id'], name='api_event_next_id_idx'),
+        ]
+
+    # Columns maintained with set-based updates from related tables. Saving a
+    # stale instance must not overwrite them.
+    DERIVED_FIELDS = ('rating_sum', 'rating_count', 'kind', 'next_occurrence_start', 'open_occurrences_count')
+
+    def save(self, *args, **kwargs):
+        # New instances may come with a pk, from fixtures for instance; they are inserted
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def average_rating(self):
+        """Average of the event rates, kept without aggregating Rate."""
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @staticmethod
+    def weekday_mask(weekdays):
+        """Bit mask with bit n set when weekday n (Monday is 0) is included.
+        No weekdays means every day."""
+        if weekdays is None:
+            return ALL_WEEKDAYS
+        mask = 0
+        for weekday in weekdays:
+            mask |= 1 << weekday
+        return mask
 
     @staticmethod
     def calculate_dates_in_threshold(start, end, weekdays):
@@ -158,22 +268,93 @@ class Event(models.Model):
         between start and end."""
         if not end:
             return [start]
+        return Event.calculate_dates_in_mask(start, end, Event.weekday_mask(weekdays))
+
+    @staticmethod
+    def calculate_dates_in_mask(start, end, mask):
+        """Returns the dates between start and end, both included, whose
+        weekday is set in the mask."""
         dates = []
-        days_between = (end - start).days + 1
-        for i in range(days_between):
-            day = start + timedelta(days=i)
-            if day.weekday() in weekdays:
-                dates.append(day)
+        # Every selected weekday is a series with a 7 days step from its
+        # first date, so no day outside the mask is visited
+        for weekday in range(7):
+            if not mask & (1 << weekday):
+                continue
+            first = start + timedelta(days=(weekday - start.weekday()) % 7)
+            if first > end:
+                continue
+            weeks = (end - first).days // 7 + 1
+            dates.extend(first + timedelta(weeks=week) for week in range(weeks))
+        dates.sort()
         return dates
 
+    def add_schedules(self, schedule, vacancies, until=None):
+        """Saves the recurrence rules of the validated `schedule` and writes
+        their occurrences up to the horizon."""
+        schedules = [EventSchedule.from_data(elem, vacancies, event=self) for elem in schedule]
+        with transaction.atomic():
+            for event_schedule in schedules:
+                event_schedule.save()
+            EventSchedule.materialize(schedules, until)
+        return schedules
+
+    @staticmethod
+    def rebuild_ratings(events=None):
+        """Recomputes the stored rating aggregates from the Rate table."""
+        events = Event.objects.all() if events is None else events
+        rates = Rate.objects.filter(event=OuterRef('pk')).order_by().values('event')
+        return events.update(
+            rating_sum=Coalesce(Subquery(rates.annotate(total=Sum('rate')).values('total')), 0),
+            rating_count=Coalesce(Subquery(rates.annotate(total=Count('id')).values('total')), 0),
+        )
+
+    @staticmethod
+    def upcoming(now=None):
+        """Filter of the events with an open occurrence ahead of `now`. The
+        stored next start may have passed since refresh_next_occurrences last
+        ran; events that had more open occurrences then still have one."""
+        now = now or datetime.now()
+        return Q(next_occurrence_start__gt=now) | Q(open_occurrences_count__gt=1)
+
+    @staticmethod
+    def refresh_next_occurrences(events=None, now=None):
+        """Recomputes the start of the next open occurrence and the number
+        of open occurrences ahead of `now` for the given events."""
+        events = Event.objects.all() if events is None else events
+        now = now or datetime.now()
+        occurrences = EventOccurrence.objects.filter(
+            event=OuterRef('pk'),
+            start__gt=now,
+            cancelled__isnull=True,
+        ).order_by().values('event')
+        return events.update(
+            next_occurrence_start=Subquery(occurrences.annotate(first=Min('start')).values('first')),
+            open_occurrences_count=Coalesce(Subquery(occurrences.annotate(total=Count('id')).values('total')), 0),
+        )
+
+    @staticmethod
+    def refresh_kinds(events=None):
+        """Recomputes the stored kind from the categories of the events."""
+        events = Event.objects.all() if events is None else events
+        restaurants = Event.objects.filter(categories__name__icontains=RESTAURANT_CATEGORY).values('pk')
+        with transaction.atomic():
+            events.filter(pk__in=restaurants).exclude(kind=EVENT_KIND_RESTAURANT).update(kind=EVENT_KIND_RESTAURANT)
+            events.exclude(pk__in=restaurants).exclude(kind=EVENT_KIND_EVENT).update(kind=EVENT_KIND_EVENT)
+
+    def refresh_kind(self):
+        """Recomputes the stored kind of this event from its categories."""
+        is_restaurant = self.categories.filter(name__icontains=RESTAURANT_CATEGORY).exists()
+        self.kind = EVENT_KIND_RESTAURANT if is_restaurant else EVENT_KIND_EVENT
+        Event.objects.filter(pk=self.pk).exclude(kind=self.kind).update(kind=self.kind)
+
     def cancel(self, reason=None):
-        self.cancelled = datetime.now()
-        occurrences = self.occurrences.filter(start__gt=date.today())
-        for occurrence in occurrences:
-            occurrence.cancel(reason)
-        self.save()
-        success_message = 'The event has been cancelled'
-        return success_message
+        """Cancels the event and its upcoming occurrences. Returns the number
+        of cancelled occurrences and reservations."""
+        with transaction.atomic():
+            cancelled = EventOccurrence.cancel_all(self.occurrences.filter(start__gt=date.today()), reason)
+            self.cancelled = datetime.now()
+            self.save()
+        return cancelled
 
     def __str__(self):
         return self.name
@@ -184,25 +365,220 @@ class EventOccurrence(models.Model):
     end = models.DateTimeField()
     cancelled = models.DateTimeField(null=True, blank=True)
     vacancies = models.PositiveIntegerField()
+    # Bookings take the vacancies from VacancyShard counters and leave
+    # `vacancies` alone, so they never write this row; the total is summed
+    # from the counters when read, see vacancies_total()
+    sharded = models.BooleanField(default=False)
     event = models.ForeignKey(
         Event,
         related_name='occurrences',
         on_delete=models.CASCADE
     )
 
+    @staticmethod
+    def split_vacancies(vacancies):
+        shards = settings.VACANCY_SHARDS
+        return [vacancies // shards + (1 if slot < vacancies % shards else 0) for slot in range(shards)]
+
+    @staticmethod
+    def reshard(occurrences, threshold=None):
+        """Spreads the vacancies of the occurrences above `threshold`
+        (SHARDED_VACANCIES_THRESHOLD by default) over VACANCY_SHARDS
+        counters, rebuilding the counters of sharded ones, and folds those
+        below it back into their row. Only call it when `vacancies` was just
+        set, as it is taken as the current total."""
+        threshold = settings.SHARDED_VACANCIES_THRESHOLD if threshold is None else threshold
+        with transaction.atomic():
+            rows = list(occurrences.filter(
+                Q(sharded=True) | Q(vacancies__gt=threshold),
+            ).select_for_update().values_list('pk', 'vacancies'))
+            VacancyShard.objects.filter(event_occurrence__in=[pk for pk, _ in rows]).delete()
+            sharded = [(pk, vacancies) for pk, vacancies in rows if vacancies > threshold]
+            VacancyShard.objects.bulk_create(
+                VacancyShard(event_occurrence_id=pk, slot=slot, vacancies=slot_vacancies)
+                for pk, vacancies in sharded
+                for slot, slot_vacancies in enumerate(EventOccurrence.split_vacancies(vacancies))
+            )
+            EventOccurrence.objects.filter(pk__in=[pk for pk, _ in sharded]).update(sharded=True)
+            EventOccurrence.objects.filter(
+                pk__in=[pk for pk, vacancies in rows if vacancies <= threshold],
+            ).update(sharded=False)
+        return len(sharded)
+
+    @staticmethod
+    def refresh_vacancy_totals(occurrences):
+        """Stores the sum of the counters of the sharded occurrences as their vacancies."""
+        totals = VacancyShard.objects.filter(
+            event_occurrence=OuterRef('pk'),
+        ).order_by().values('event_occurrence').annotate(total=Sum('vacancies')).values('total')
+        return occurrences.filter(sharded=True).update(vacancies=Coalesce(Subquery(totals), 0))
+
+    def available_vacancies(self):
+        """Vacancies left, summed from the counters of sharded occurrences."""
+        if not self.sharded:
+            return self.vacancies
+        return self.vacancy_shards.aggregate(total=Sum('vacancies'))['total'] or 0
+
+    def vacancies_total(self):
+        """Vacancies to show, cached for VACANCY_TOTAL_REFRESH_SECONDS when
+        they have to be summed from the counters."""
+        if not self.sharded:
+            return self.vacancies
+        key = 'api:vacancies-total:{}'.format(self.pk)
+        total = cache.get(key)
+        if total is None:
+            total = self.available_vacancies()
+            cache.set(key, total, settings.VACANCY_TOTAL_REFRESH_SECONDS)
+        return total
+
+    @staticmethod
+    def cancel_all(occurrences, reason=None):
+        """Cancels the open occurrences of the queryset and their reservations
+        with a few set-based updates. Returns the number of cancelled
+        occurrences and reservations."""
+        occurrences = occurrences.filter(cancelled__isnull=True)
+        with transaction.atomic():
+            # Locked so no booking lands between cancelling the reservations and the occurrences
+            locked = list(occurrences.select_for_update().values_list('pk', 'event'))
+            # Waits for the bookings holding a counter of these occurrences
+            list(VacancyShard.objects.filter(event_occurrence__in=occurrences).select_for_update().values_list('pk'))
+            reservations = Reservation.cancel_all(Reservation.objects.filter(event_occurrence__in=occurrences), reason)
+            cancelled = occurrences.update(cancelled=datetime.now())
+            Event.refresh_next_occurrences(Event.objects.filter(pk__in={event for _, event in locked}))
+            publish_occurrences(EventOccurrence.objects.filter(pk__in=[pk for pk, _ in locked]))
+        transaction.on_commit(bump_catalog_version)
+        return {'occurrences': cancelled, 'reservations': reservations}
+
     def cancel(self, reason=None):
-        self.cancelled = datetime.now()
-        reservations = self.reservation_set.all()
-        for reservation in reservations:
-            reservation.cancel(reason)
-        self.save()
-        success_message = 'The Occurrence has been cancelled'
-        return success_message
+        """Cancels the occurrence and its reservations. Returns the number of
+        cancelled occurrences and reservations."""
+        cancelled = EventOccurrence.cancel_all(EventOccurrence.objects.filter(pk=self.pk), reason)
+        self.refresh_from_db(fields=['cancelled', 'vacancies'])
+        return cancelled
 
     def __str__(self):
         return '{} - {}'.format(self.event.name, self.start)
 
 
+class VacancyShard(models.Model):
+    """One of the counters the vacancies of a sharded occurrence are spread
+    over, so concurrent bookings update different rows."""
+    event_occurrence = models.ForeignKey(EventOccurrence, related_name='vacancy_shards', on_delete=models.CASCADE)
+    slot = models.PositiveSmallIntegerField()
+    vacancies = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (('event_occurrence', 'slot'), )
+
+
+class EventSchedule(models.Model):
+    """Recurrence rule of an event: the weekdays between two dates, or every
+    week from `from_date` on when there is no `to_date`.
+
+    Occurrences are only written up to a rolling horizon, which the
+    materialize_schedules command moves forward. `materialized_until` is the
+    last date written; later dates are expanded when read.
+    """
+    event = models.ForeignKey(Event, related_name='schedules', on_delete=models.CASCADE)
+    from_date = models.DateField()
+    to_date = models.DateField(null=True, blank=True)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    weekdays = models.PositiveSmallIntegerField(default=ALL_WEEKDAYS)
+    vacancies = models.PositiveIntegerField()
+    materialized_until = models.DateField(null=True, blank=True)
+
+    @staticmethod
+    def horizon():
+        return date.today() + timedelta(days=settings.SCHEDULE_HORIZON_DAYS)
+
+    @staticmethod
+    def from_data(elem, vacancies, event=None):
+        """Builds an unsaved schedule from ScheduleSerializer data. Without
+        weekdays nor to_date the schedule is the single from_date."""
+        to_date = elem['to_date']
+        if to_date is None and elem['weekdays'] is None:
+            to_date = elem['from_date']
+        return EventSchedule(
+            event=event,
+            from_date=elem['from_date'],
+            to_date=to_date,
+            start_time=elem['start_time'],
+            end_time=elem['end_time'],
+            weekdays=Event.weekday_mask(elem['weekdays']),
+            vacancies=vacancies,
+        )
+
+    def dates(self, start, end):
+        """Scheduled dates between start and end, both included."""
+        start = max(start, self.from_date)
+        if self.to_date is not None:
+            end = min(end, self.to_date)
+        if start > end:
+            return []
+        return Event.calculate_dates_in_mask(start, end, self.weekdays)
+
+    def pending_dates(self, until):
+        """Returns the dates not written yet up to `until` and the date the
+        schedule is materialized until once they are."""
+        if self.materialized_until is None:
+            start = self.from_date
+            # The first week is written even past the horizon, so the event
+            # is listed and can be booked from the start
+            until = max(until, self.from_date + timedelta(days=6))
+        else:
+            start = self.materialized_until + timedelta(days=1)
+        if self.to_date is not None:
+            until = min(until, self.to_date)
+        return self.dates(start, until), max(until, start - timedelta(days=1))
+
+    def build_occurrence(self, day):
+        return EventOccurrence(
+            start=datetime.combine(day, self.start_time),
+            end=datetime.combine(day, self.end_time),
+            vacancies=self.vacancies,
+            event_id=self.event_id,
+        )
+
+    def projected_occurrences(self, until):
+        """Unsaved occurrences of the dates past the materialized ones, up to
+        `until`."""
+        start = self.from_date if self.materialized_until is None else self.materialized_until + timedelta(days=1)
+        return [self.build_occurrence(day) for day in self.dates(start, until)]
+
+    @staticmethod
+    def count_pending_occurrences(schedule, until=None):
+        """Occurrences that would be written for ScheduleSerializer data."""
+        until = until or EventSchedule.horizon()
+        return sum(len(EventSchedule.from_data(elem, 0).pending_dates(until)[0]) for elem in schedule)
+
+    @staticmethod
+    def materialize(schedules, until=None):
+        """Writes the occurrences of the schedules up to `until` (the horizon
+        by default) with batched inserts in a single transaction."""
+        until = until or EventSchedule.horizon()
+        occurrences = []
+        with transaction.atomic():
+            for schedule in schedules:
+                dates, materialized_until = schedule.pending_dates(until)
+                occurrences.extend(schedule.build_occurrence(day) for day in dates)
+                if materialized_until != schedule.materialized_until:
+                    schedule.materialized_until = materialized_until
+                    EventSchedule.objects.filter(pk=schedule.pk).update(materialized_until=materialized_until)
+            EventOccurrence.objects.bulk_create(occurrences, batch_size=OCCURRENCE_BATCH_SIZE)
+            if occurrences:
+                # bulk_create skips the signals that keep these up to date
+                event_ids = {occurrence.event_id for occurrence in occurrences}
+                Event.refresh_next_occurrences(Event.objects.filter(pk__in=event_ids))
+                if any(occurrence.vacancies > settings.SHARDED_VACANCIES_THRESHOLD for occurrence in occurrences):
+                    EventOccurrence.reshard(EventOccurrence.objects.filter(event__in=event_ids, sharded=False))
+                transaction.on_commit(bump_catalog_version)
+        return occurrences
+
+    def __str__(self):
+        return '{} - {}'.format(self.event.name, self.from_date)
+
+
 class Rate(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
@@ -218,6 +594,42 @@ class Rate(models.Model):
     class Meta:
         unique_together = (('event', 'user'), )
 
+    def save(self, *args, **kwargs):
+        """Saves the rate and updates the rating aggregates of its event
+        in the same transaction."""
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Rate.objects.select_for_update().filter(pk=self.pk).values('event_id', 'rate').first()
+            super().save(*args, **kwargs)
+
+            if previous is None:
+                Event.objects.filter(pk=self.event_id).update(
+                    rating_sum=F('rating_sum') + self.rate,
+                    rating_count=F('rating_count') + 1,
+                )
+            elif previous['event_id'] != self.event_id:
+                Event.objects.filter(pk=previous['event_id']).update(
+                    rating_sum=F('rating_sum') - previous['rate'],
+                    rating_count=F('rating_count') - 1,
+                )
+                Event.objects.filter(pk=self.event_id).update(
+                    rating_sum=F('rating_sum') + self.rate,
+                    rating_count=F('rating_count') + 1,
+                )
+            elif previous['rate'] != self.rate:
+                Event.objects.filter(pk=self.event_id).update(
+                    rating_sum=F('rating_sum') + self.rate - previous['rate'],
+                )
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Event.objects.filter(pk=self.event_id).update(
+                rating_sum=F('rating_sum') - self.rate,
+                rating_count=F('rating_count') - 1,
+            )
+            return super().delete(*args, **kwargs)
+
     @property
     def user_name(self):
         return self.user.full_name
@@ -245,31 +657,59 @@ class Reservation(models.Model):
     def __str__(self):
         return '{}: {}, {}'.format(str(self.id), self.user.first_name, str(self.paid_amount))
 
+    @staticmethod
+    def cancel_all(reservations, reason=None):
+        """Cancels the reservations of the queryset that aren't cancelled yet,
+        gives their seats back to the occurrences and queues an email for each
+        user. Returns the number of cancelled reservations."""
+        reservations = reservations.exclude(status=RESERVATION_CANCELLED)
+        with transaction.atomic():
+            notified = list(reservations.select_for_update(of=('self',)).values(
+                'id',
+                'event_occurrence',
+                'user__first_name',
+                'user__email',
+                'event_occurrence__start',
+                'event_occurrence__event__winery__name',
+            ))
+            seats = reservations.filter(
+                event_occurrence=OuterRef('pk'),
+            ).order_by().values('event_occurrence').annotate(total=Sum('attendee_number')).values('total')
+            occurrences = EventOccurrence.objects.filter(pk__in=reservations.values('event_occurrence'))
+            occurrences.update(vacancies=F('vacancies') + Subquery(seats))
+            # Sharded occurrences get the seats back in their first counter
+            shard_seats = reservations.filter(
+                event_occurrence=OuterRef('event_occurrence'),
+            ).order_by().values('event_occurrence').annotate(total=Sum('attendee_number')).values('total')
+            VacancyShard.objects.filter(
+                slot=0,
+                event_occurrence__in=occurrences.filter(sharded=True),
+            ).update(vacancies=F('vacancies') + Subquery(shard_seats))
+            EventOccurrence.refresh_vacancy_totals(occurrences)
+            cancelled = reservations.update(status=RESERVATION_CANCELLED)
+            publish_occurrences(EventOccurrence.objects.filter(pk__in={row['event_occurrence'] for row in notified}))
+            Mail.send_mass_mail(
+                (
+                    'Winecompanion Reservation Cancelled',
+                    'mail_template.html',
+                    {
+                        'first_name': row['user__first_name'],
+                        'winery': row['event_occurrence__event__winery__name'],
+                        'id': row['id'],
+                        'date': row['event_occurrence__start'].strftime("%d/%m/%Y, %H:%M:%S"),
+                        'reason': reason or DEFAULT_CANCELLATION_REASON,
+                    },
+                    row['user__email'],
+                )
+                for row in notified
+            )
+        transaction.on_commit(bump_catalog_version)
+        return cancelled
+
     def cancel(self, reason=None):
-        if self.status == RESERVATION_CANCELLED:
+        if not Reservation.cancel_all(Reservation.objects.filter(pk=self.pk), reason):
             return 'The reservation was already cancelled'
-
         self.status = RESERVATION_CANCELLED
-        self.save()
-
-        # update vacancies
-        self.event_occurrence.vacancies += self.attendee_number
-        self.event_occurrence.save()
-
-        # send email
-        subject = 'Winecompanion Reservation Cancelled'
-        html_message = render_to_string(
-            'mail_template.html',
-            {
-                'first_name': self.user.first_name,
-                'winery': self.event_occurrence.event.winery.name,
-                'id': self.id,
-                'date': self.event_occurrence.start.strftime("%d/%m/%Y, %H:%M:%S"),
-                'reason': reason or DEFAULT_CANCELLATION_REASON,
-            }
-        )
-        plain_message = strip_tags(html_message)
-        Mail.send_mail(subject, plain_message, [self.user.email], html_message=html_message)
         return 'The reservation has been cancelled'
 
 
@@ -298,3 +738,39 @@ class ImagesWines(models.Model):
         related_name='images',
         on_delete=models.CASCADE
     )
+
+
+class SearchDocument(models.Model):
+    """Text of an event or winery as searched by the `search=` parameter.
+
+    The full-text index lives next to this table and depends on the database:
+    a tsvector column with a GIN index on PostgreSQL and an FTS5 table on
+    SQLite, both created by migration 0017 and kept in step by triggers.
+    """
+    kind = models.PositiveSmallIntegerField(choices=SEARCH_DOCUMENT_KINDS)
+    object_id = models.PositiveIntegerField()
+    title = models.TextField()
+    body = models.TextField()
+
+    class Meta:
+        unique_together = (('kind', 'object_id'), )
+
+    def __str__(self):
+        return self.title
+
+
+class IdempotencyKey(models.Model):
+    """Response of a POST sent with an `Idempotency-Key` header, replayed
+    when the same user retries it with that key."""
+    key = models.CharField(max_length=255)
+    user = models.ForeignKey('users.wineuser', on_delete=models.CASCADE)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_body = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = (('user', 'key'), )
+
+    def __str__(self):
+        return self.key
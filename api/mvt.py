@@ -0,0 +1,102 @@
+"""Mapbox Vector Tile encoding of point layers.
+
+Writes the protobuf messages of the vector tile specification 2.1 by hand,
+for databases that cannot build the tiles themselves. Features are points
+already projected to tile coordinates, with a dict of attributes each.
+"""
+import struct
+
+MVT_VERSION = 2
+
+GEOMETRY_POINT = 1
+COMMAND_MOVE_TO = 1
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+
+# Field numbers of the Tile, Layer, Feature and Value messages
+TILE_LAYERS = 3
+LAYER_NAME, LAYER_FEATURES, LAYER_KEYS, LAYER_VALUES, LAYER_EXTENT, LAYER_VERSION = 1, 2, 3, 4, 5, 15
+FEATURE_TAGS, FEATURE_TYPE, FEATURE_GEOMETRY = 2, 3, 4
+VALUE_STRING, VALUE_DOUBLE, VALUE_UINT, VALUE_SINT, VALUE_BOOL = 1, 3, 5, 6, 7
+
+
+def varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field_key(field, wire_type):
+    return varint(field << 3 | wire_type)
+
+
+def varint_field(field, value):
+    return field_key(field, WIRE_VARINT) + varint(value)
+
+
+def bytes_field(field, payload):
+    return field_key(field, WIRE_LENGTH_DELIMITED) + varint(len(payload)) + payload
+
+
+def packed_field(field, values):
+    return bytes_field(field, b''.join(varint(value) for value in values))
+
+
+def encode_value(value):
+    if isinstance(value, bool):
+        return varint_field(VALUE_BOOL, int(value))
+    if isinstance(value, int):
+        return varint_field(VALUE_UINT, value) if value >= 0 else varint_field(VALUE_SINT, zigzag(value))
+    if isinstance(value, float):
+        return field_key(VALUE_DOUBLE, WIRE_FIXED64) + struct.pack('<d', value)
+    return bytes_field(VALUE_STRING, str(value).encode())
+
+
+def encode_layer(name, features, extent):
+    """Layer message of `features`, ((x, y), attributes) pairs in tile
+    coordinates. Attribute keys and values are stored once per layer and
+    None attributes are left out."""
+    keys, values = {}, {}
+    encoded_features = []
+    for (x, y), attributes in features:
+        tags = []
+        for key, value in attributes.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            # Typed, so that 1 and True or 1.0 stay apart
+            tags.append(values.setdefault((type(value), value), len(values)))
+        geometry = [COMMAND_MOVE_TO | 1 << 3, zigzag(x), zigzag(y)]
+        encoded_features.append(bytes_field(
+            LAYER_FEATURES,
+            packed_field(FEATURE_TAGS, tags)
+            + varint_field(FEATURE_TYPE, GEOMETRY_POINT)
+            + packed_field(FEATURE_GEOMETRY, geometry),
+        ))
+    return b''.join([
+        varint_field(LAYER_VERSION, MVT_VERSION),
+        bytes_field(LAYER_NAME, name.encode()),
+        *encoded_features,
+        *(bytes_field(LAYER_KEYS, key.encode()) for key in keys),
+        *(bytes_field(LAYER_VALUES, encode_value(value)) for _, value in values),
+        varint_field(LAYER_EXTENT, extent),
+    ])
+
+
+def encode_tile(layers, extent):
+    """Tile message of `layers`, a dict of features by layer name. Layers
+    without features are left out, as ST_AsMVT does."""
+    return b''.join(
+        bytes_field(TILE_LAYERS, encode_layer(name, features, extent))
+        for name, features in layers.items()
+        if features
+    )
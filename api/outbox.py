@@ -0,0 +1,154 @@
+"""Delivery of the mails queued in the outbox.
+
+Requests only insert OutboxMail rows. The send_outbox command claims the due
+ones in batches, renders them and sends them over one reused connection, so
+a slow mail server delays the worker instead of the requests. Claims are
+leases committed before sending, so no lock is held while talking to the
+mail server.
+"""
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.template.loader import render_to_string
+from django.utils.html import escape, strip_tags
+
+from . import MAIL_CLAIM_LEASE, MAIL_MAX_ATTEMPTS, MAIL_RECIPIENT_FIELDS
+from .models import OutboxMail
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryStats:
+    """Counts and send latencies of a worker run."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.latencies = []
+
+    def add(self, latency, error=None):
+        self.latencies.append(latency)
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    def summary(self):
+        latencies = sorted(self.latencies) or [0]
+        return 'Sent {} mails, {} failed; send latency p50 {:.1f}ms, max {:.1f}ms'.format(
+            self.sent,
+            self.failed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[-1] * 1000,
+        )
+
+
+def queue_metrics(now=None):
+    """Depth of the outbox: pending and due mails, the age of the oldest due
+    one in seconds and the mails given up on."""
+    now = now or datetime.now()
+    unsent = OutboxMail.objects.filter(sent__isnull=True)
+    metrics = unsent.aggregate(
+        pending=Count('pk', filter=Q(attempts__lt=MAIL_MAX_ATTEMPTS)),
+        due=Count('pk', filter=Q(attempts__lt=MAIL_MAX_ATTEMPTS, next_attempt__lte=now)),
+        failed=Count('pk', filter=Q(attempts__gte=MAIL_MAX_ATTEMPTS)),
+    )
+    oldest = OutboxMail.pending().filter(next_attempt__lte=now).aggregate(oldest=Min('created'))['oldest']
+    metrics['oldest_seconds'] = (now - oldest).total_seconds() if oldest else 0
+    return metrics
+
+
+def recipient_placeholder(name):
+    return '[recipient:{}]'.format(name)
+
+
+def render(mail, rendered):
+    """Renders the html and plain bodies of a mail. Mails with the same
+    template and context but for the MAIL_RECIPIENT_FIELDS reuse the bodies
+    in `rendered`, which hold placeholders for those fields."""
+    context = json.loads(mail.context)
+    recipient = {name: context.pop(name) for name in MAIL_RECIPIENT_FIELDS if name in context}
+    key = (mail.template, tuple(recipient), json.dumps(context, sort_keys=True))
+    if key not in rendered:
+        placeholders = {name: recipient_placeholder(name) for name in recipient}
+        html_message = render_to_string(mail.template, dict(context, **placeholders))
+        rendered[key] = (html_message, strip_tags(html_message))
+    bodies = rendered[key]
+    for name, value in recipient.items():
+        # Escaped as the template would have
+        bodies = tuple(body.replace(recipient_placeholder(name), escape(value)) for body in bodies)
+    return bodies
+
+
+def build_message(mail, connection, rendered):
+    html_message, plain_message = render(mail, rendered)
+    message = EmailMultiAlternatives(
+        mail.subject,
+        plain_message,
+        settings.EMAIL_HOST_USER,
+        [mail.recipient],
+        connection=connection,
+    )
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+def deliver(mail, connection, rendered):
+    """Sends a single mail, returning the error when it could not be sent."""
+    try:
+        connection.open()
+        build_message(mail, connection, rendered).send()
+    except Exception as error:
+        # The connection may be unusable after a failure; the next mail reopens it
+        connection.close()
+        return error
+    return None
+
+
+def claim_batch(batch_size):
+    """Claims up to `batch_size` due mails, counting their attempt and
+    leasing them for MAIL_CLAIM_LEASE seconds, in a short transaction.
+    Other workers skip leased mails, and mails of a worker that died while
+    sending them are retried once the lease runs out."""
+    with transaction.atomic():
+        # Locked rows are skipped, so several workers can drain the outbox
+        batch = list(
+            OutboxMail.pending().filter(
+                next_attempt__lte=datetime.now(),
+            ).select_for_update(skip_locked=True).order_by('next_attempt', 'pk')[:batch_size]
+        )
+        lease = datetime.now() + timedelta(seconds=MAIL_CLAIM_LEASE)
+        for mail in batch:
+            mail.attempts += 1
+            mail.next_attempt = lease
+        OutboxMail.objects.bulk_update(batch, ['attempts', 'next_attempt'])
+    return batch
+
+
+def send_batch(connection, batch_size, stats):
+    """Sends up to `batch_size` due mails over `connection`, scheduling a
+    retry for those that fail. Returns how many mails were claimed.
+
+    Mails are sent outside of any transaction and each result is saved as
+    soon as it is known, so a crash only resends the mail being sent."""
+    batch = claim_batch(batch_size)
+    rendered = {}
+    for mail in batch:
+        started = time.monotonic()
+        error = deliver(mail, connection, rendered)
+        stats.add(time.monotonic() - started, error)
+        if error is None:
+            OutboxMail.objects.filter(pk=mail.pk).update(sent=datetime.now(), last_error='')
+        else:
+            logger.warning('Could not send mail %s (attempt %d): %s', mail.pk, mail.attempts, error)
+            OutboxMail.objects.filter(pk=mail.pk).update(
+                last_error=str(error),
+                next_attempt=datetime.now() + mail.retry_delay(),
+            )
+    return len(batch)
@@ -0,0 +1,131 @@
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as Base64Error
+from functools import reduce
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination over indexed keys.
+
+    The ordering is a unique key, possibly made of several columns such as
+    `('next_occurrence_start', 'id')`. Cursors hold the values of every
+    column of the key at the edge of the page, and the next page is selected
+    with a WHERE on all of them instead of an OFFSET, so deep pages cost the
+    same as the first one, even within rows sharing the first column. As a
+    cursor is a position in the key rather than a row, it stays valid when
+    rows are inserted, removed or moved in between requests. Key columns
+    must not be null.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        """Lets the view pick the keyset with `get_cursor_ordering`, for
+        listings whose key depends on the request. Returning None keeps the
+        ordering of the pagination class."""
+        ordering = view.get_cursor_ordering() if hasattr(view, 'get_cursor_ordering') else None
+        if ordering is None:
+            return super().get_ordering(request, queryset, view)
+        return (ordering, ) if isinstance(ordering, str) else tuple(ordering)
+
+    @staticmethod
+    def after(ordering, position, reverse):
+        """Rows past `position` in the `ordering` key: (a, b) > (x, y) is
+        written as a >= x AND (a > x OR (a = x AND b > y)), for any direction
+        per column. The first condition lets the index of `a` bound the scan."""
+        conditions = []
+        for index, order in enumerate(ordering):
+            name = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+            equal = {field.lstrip('-'): value for field, value in zip(ordering[:index], position)}
+            conditions.append(Q(**equal, **{'{}__{}'.format(name, lookup): position[index]}))
+        after = reduce(lambda left, right: left | right, conditions)
+        if len(ordering) > 1:
+            first_lookup = 'lte' if ordering[0].startswith('-') != reverse else 'gte'
+            after &= Q(**{'{}__{}'.format(ordering[0].lstrip('-'), first_lookup): position[0]})
+        return after
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse, position = self.cursor or (False, None)
+
+        order = [
+            (field[1:] if field.startswith('-') else '-' + field) if reverse else field
+            for field in self.ordering
+        ]
+        queryset = queryset.order_by(*order)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(self.ordering, position, reverse))
+            except (DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+        self.has_next = position is not None if reverse else has_more
+        self.has_previous = has_more if reverse else position is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_position(self, instance):
+        return [
+            instance[field.lstrip('-')] if isinstance(instance, dict) else getattr(instance, field.lstrip('-'))
+            for field in self.ordering
+        ]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor((False, self.get_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor((True, self.get_position(self.page[0])))
+
+    def decode_cursor(self, request):
+        """(reverse, position) of the cursor of the request, or None."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('ascii'))
+            reverse, position = bool(cursor['r']), cursor['p']
+        except (Base64Error, KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (
+            not isinstance(position, list) or len(position) != len(self.ordering)
+            or not all(isinstance(value, (str, int, float)) for value in position)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def encode_cursor(self, cursor):
+        reverse, position = cursor
+        # str() keeps the microseconds of datetimes, which the JSON encoder of Django cuts
+        payload = json.dumps({'r': int(reverse), 'p': position}, default=str)
+        encoded = b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class EventPagination(KeysetPagination):
+    # soonest first, the id orders the events starting together
+    ordering = ('next_occurrence_start', 'id')
+
+
+class ReservationPagination(KeysetPagination):
+    ordering = '-id'
@@ -0,0 +1,146 @@
+"""Nearest wineries to a point and wineries within a bounding box.
+
+Backends walk the spatial index of the location instead of measuring every
+row. For the nearest wineries, PostGIS orders the GiST index with the KNN
+`<->` operator, SpatiaLite looks candidates up by bounding box in the
+R*Tree index and widens the box until enough of them fall within it.
+"""
+import math
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+# Mean earth radius, the bounding boxes are computed on a sphere
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+# Room for geodesic distances measured on the ellipsoid being a bit longer
+# than on the sphere
+BOUNDING_BOX_MARGIN = 1.01
+
+
+def bounding_box(point, radius):
+    """(min_x, min_y, max_x, max_y) in degrees enclosing every point within
+    `radius` meters of `point`. Boxes are not split at the antimeridian."""
+    degrees = radius * BOUNDING_BOX_MARGIN / METERS_PER_DEGREE
+    min_y, max_y = max(point.y - degrees, -90), min(point.y + degrees, 90)
+    widest = max(abs(min_y), abs(max_y))
+    if widest >= 90:
+        return -180, min_y, 180, max_y
+    x_degrees = degrees / math.cos(math.radians(widest))
+    return max(point.x - x_degrees, -180), min_y, min(point.x + x_degrees, 180), max_y
+
+
+class PostgisProximityBackend:
+    """KNN ordering of the geography GiST index, nearest first."""
+    target = 'ST_GeogFromText(%s)'
+
+    def distance(self, column, point):
+        """Geodesic meters between the location column and the point."""
+        return RawSQL('ST_Distance({}, {})'.format(column, self.target), [point.ewkt], output_field=FloatField())
+
+    def in_box(self, queryset, column, box):
+        # The envelope edges are great circles, callers check the exact bounds
+        envelope = 'ST_MakeEnvelope(%s, %s, %s, %s, 4326)::geography'
+        return queryset.extra(where=['{} && {}'.format(column, envelope)], params=list(box))
+
+    def nearest(self, queryset, column, point, limit, radius):
+        params = [point.ewkt]
+        knn = RawSQL('{} <-> {}'.format(column, self.target), params)
+        return list(
+            queryset.extra(where=['ST_DWithin({}, {}, %s)'.format(column, self.target)], params=params + [radius])
+            .annotate(distance=self.distance(column, point))
+            .order_by(knn)
+            .values_list('pk', 'distance')[:limit]
+        )
+
+
+class SpatialiteProximityBackend:
+    """Bounding box lookups in the R*Tree index of the location, growing the
+    box until it holds `limit` wineries within its inscribed circle."""
+    # Meters from the point covered by the first box
+    start_radius = 5000
+    growth = 4
+
+    def distance(self, column, point):
+        """Geodesic meters between the location column and the point."""
+        return RawSQL(
+            'Distance({}, MakePoint(%s, %s, 4326), 1)'.format(column),
+            [point.x, point.y],
+            output_field=FloatField(),
+        )
+
+    def in_box(self, queryset, column, box):
+        opts = queryset.model._meta
+        quote = connections[queryset.db].ops.quote_name
+        index = quote('idx_{}_{}'.format(opts.db_table, opts.get_field('location').column))
+        min_x, min_y, max_x, max_y = box
+        candidates = 'SELECT pkid FROM {} WHERE xmin <= %s AND xmax >= %s AND ymin <= %s AND ymax >= %s'.format(index)
+        return queryset.extra(
+            where=['{}.{} IN ({})'.format(quote(opts.db_table), quote(opts.pk.column), candidates)],
+            params=[max_x, min_x, max_y, min_y],
+        )
+
+    def nearest(self, queryset, column, point, limit, radius):
+        distance = self.distance(column, point)
+        search_radius = min(self.start_radius, radius)
+        while True:
+            nearest = list(
+                self.in_box(queryset, column, bounding_box(point, search_radius))
+                .annotate(distance=distance)
+                .filter(distance__lte=search_radius)
+                .order_by('distance', 'pk')
+                .values_list('pk', 'distance')[:limit]
+            )
+            # Anything closer than the last match lies inside the box too
+            if len(nearest) == limit or search_radius >= radius:
+                return nearest
+            search_radius = min(search_radius * self.growth, radius)
+
+
+PROXIMITY_BACKENDS = {
+    'postgresql': PostgisProximityBackend,
+    'sqlite': SpatialiteProximityBackend,
+}
+
+
+def get_proximity_backend(connection):
+    try:
+        return PROXIMITY_BACKENDS[connection.vendor]()
+    except KeyError:
+        raise ImproperlyConfigured('Proximity search is not available on {}'.format(connection.vendor))
+
+
+def location_column(queryset):
+    quote = connections[queryset.db].ops.quote_name
+    opts = queryset.model._meta
+    return '{}.{}'.format(quote(opts.db_table), quote(opts.get_field('location').column))
+
+
+def nearest_distances(queryset, point, limit, radius):
+    """(pk, meters) of up to `limit` objects of `queryset` within `radius`
+    meters of `point`, nearest first."""
+    backend = get_proximity_backend(connections[queryset.db])
+    queryset = queryset.filter(location__isnull=False)
+    return backend.nearest(queryset, location_column(queryset), point, limit, radius)
+
+
+def nearest(queryset, point, limit, radius):
+    """Up to `limit` objects of `queryset` within `radius` meters of `point`,
+    nearest first, each with its `distance` in meters."""
+    distances = nearest_distances(queryset, point, limit, radius)
+    objects = queryset.in_bulk([pk for pk, _ in distances])
+    results = []
+    for pk, distance in distances:
+        obj = objects[pk]
+        obj.distance = distance
+        results.append(obj)
+    return results
+
+
+def in_box(queryset, box):
+    """Objects of `queryset` whose location may fall in the
+    (min_x, min_y, max_x, max_y) box, looked up in the spatial index."""
+    backend = get_proximity_backend(connections[queryset.db])
+    return backend.in_box(queryset.filter(location__isnull=False), location_column(queryset), box)
@@ -0,0 +1,157 @@
+"""Full-text search over the SearchDocument table.
+
+Every event and winery has one document. The index next to the table
+depends on the database, so each vendor has a backend that filters a
+queryset down to the matching rows and annotates their `search_rank`
+(higher is more relevant).
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from . import SEARCH_DOCUMENT_EVENT, SEARCH_DOCUMENT_WINERY
+from .models import Event, SearchDocument, Winery
+
+MAX_SEARCH_WORDS = 10
+
+WORD_RE = re.compile(r'[^\W_]+')
+
+
+def get_search_words(query):
+    """Splits a user query in the words that are looked up, dropping any
+    operator the engines could otherwise interpret."""
+    return WORD_RE.findall(query.lower())[:MAX_SEARCH_WORDS]
+
+
+class PostgresSearchBackend:
+    """tsvector column with a GIN index, matched in Spanish and English."""
+    configs = ('spanish', 'english')
+
+    def get_tsquery(self, words):
+        text = ' & '.join('{}:*'.format(word) for word in words)
+        sql = ' || '.join("to_tsquery('{}', %s)".format(config) for config in self.configs)
+        return '({})'.format(sql), [text] * len(self.configs)
+
+    def search(self, queryset, kind, words, pk_column):
+        tsquery, params = self.get_tsquery(words)
+        matches = SearchDocument.objects.filter(kind=kind).extra(
+            where=['vector @@ {}'.format(tsquery)],
+            params=params,
+        ).values('object_id')
+        rank = RawSQL(
+            'SELECT ts_rank(vector, {}) FROM api_searchdocument '
+            'WHERE kind = %s AND object_id = {}'.format(tsquery, pk_column),
+            params + [kind],
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+
+class SqliteSearchBackend:
+    """FTS5 table over the documents, ranked with bm25."""
+    # bm25 weights of the title and body columns
+    weights = (10.0, 1.0)
+
+    def get_match(self, words):
+        return ' '.join('"{}"*'.format(word) for word in words)
+
+    def search(self, queryset, kind, words, pk_column):
+        match = self.get_match(words)
+        matches = SearchDocument.objects.filter(kind=kind).extra(
+            where=['id IN (SELECT rowid FROM api_searchdocument_fts '
+                   'WHERE api_searchdocument_fts MATCH %s)'],
+            params=[match],
+        ).values('object_id')
+        # bm25 is lower for better matches
+        rank = RawSQL(
+            'SELECT -bm25(api_searchdocument_fts, {}, {}) FROM api_searchdocument_fts '
+            'WHERE api_searchdocument_fts MATCH %s AND rowid = '
+            '(SELECT id FROM api_searchdocument WHERE kind = %s AND object_id = {})'.format(
+                *self.weights, pk_column
+            ),
+            [match, kind],
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+DOCUMENT_KINDS = {
+    Event: SEARCH_DOCUMENT_EVENT,
+    Winery: SEARCH_DOCUMENT_WINERY,
+}
+
+
+def get_search_backend(connection):
+    try:
+        return SEARCH_BACKENDS[connection.vendor]()
+    except KeyError:
+        raise ImproperlyConfigured('Full-text search is not available on {}'.format(connection.vendor))
+
+
+def search(queryset, words):
+    """Filters the events or wineries of `queryset` matching every word and
+    annotates their `search_rank`."""
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    opts = queryset.model._meta
+    pk_column = '{}.{}'.format(quote(opts.db_table), quote(opts.pk.column))
+    return get_search_backend(connection).search(queryset, DOCUMENT_KINDS[queryset.model], words, pk_column)
+
+
+def event_document(event):
+    body = [event.description, event.winery.name]
+    body.extend(tag.name for tag in event.tags.all())
+    body.extend(category.name for category in event.categories.all())
+    return SearchDocument(kind=SEARCH_DOCUMENT_EVENT, object_id=event.id, title=event.name, body='\n'.join(body))
+
+
+def winery_document(winery):
+    return SearchDocument(kind=SEARCH_DOCUMENT_WINERY, object_id=winery.id, title=winery.name, body=winery.description)
+
+
+def replace_documents(kind, documents):
+    with transaction.atomic():
+        SearchDocument.objects.filter(kind=kind, object_id__in=[document.object_id for document in documents]).delete()
+        SearchDocument.objects.bulk_create(documents)
+
+
+def index_events(events):
+    events = events.select_related('winery').prefetch_related('tags', 'categories')
+    replace_documents(SEARCH_DOCUMENT_EVENT, [event_document(event) for event in events])
+
+
+def index_wineries(wineries):
+    replace_documents(SEARCH_DOCUMENT_WINERY, [winery_document(winery) for winery in wineries])
+
+
+def remove_documents(kind, object_ids):
+    SearchDocument.objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+
+def rebuild_index(chunk_size=500):
+    """Recreates every document, reading the catalog in primary key chunks."""
+    indexers = [
+        (Event.objects.select_related('winery').prefetch_related('tags', 'categories'), event_document),
+        (Winery.objects.all(), winery_document),
+    ]
+    indexed = 0
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        for queryset, build_document in indexers:
+            last_pk = 0
+            while True:
+                chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+                if not chunk:
+                    break
+                SearchDocument.objects.bulk_create([build_document(obj) for obj in chunk])
+                indexed += len(chunk)
+                last_pk = chunk[-1].pk
+    return indexed
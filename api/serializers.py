@@ -1,21 +1,25 @@
-import json
-from datetime import datetime
-from winecompanion import settings
+from datetime import date, datetime, timedelta
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Avg
-from django.db import IntegrityError
+from django.db.models import Prefetch, Q
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.utils.formats import localize
 
 from rest_framework.exceptions import ParseError
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
+from . import RESERVATION_CANCELLED
+from .booking import NotEnoughVacancies, book, book_many
+from .geojson import point_geometry
+from .live import publish_occurrences
 from .models import (
     Country,
     Event,
     EventOccurrence,
+    EventSchedule,
     Winery,
     WineLine,
     Wine,
@@ -30,14 +34,47 @@ from .models import (
 )
 
 
+class SparseFieldsetMixin:
+    """Lets read requests pick the serialized fields with comma separated
+    `?fields=` and `?expand=` parameters, for instance
+    `?fields=id,name&expand=occurrences`. Fields that were not asked for are
+    removed before serializing, so their methods and nested serializers
+    never run. Without `fields` every field is serialized."""
+    fields_param = 'fields'
+    expand_param = 'expand'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get('request'))
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """Names of the fields asked for in the request, or None for all."""
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        params = getattr(request, 'query_params', request.GET)
+        if cls.fields_param not in params:
+            return None
+        requested = set()
+        for param in (cls.fields_param, cls.expand_param):
+            requested.update(name.strip() for name in params.get(param, '').split(',') if name.strip())
+        return requested
+
+
 class ScheduleSerializer(serializers.Serializer):
+    """Dates of an event: the weekdays (Monday is 0) between from_date and
+    to_date. Weekdays without to_date repeat every week with no end, and
+    neither of them means the single from_date."""
     from_date = serializers.DateField()
     to_date = serializers.DateField(allow_null=True)
     start_time = serializers.TimeField()
     end_time = serializers.TimeField()
     weekdays = serializers.ListField(
         allow_null=True,
-        child=serializers.IntegerField())
+        child=serializers.IntegerField(min_value=0, max_value=6))
 
 
 class EventCategorySerializer(serializers.ModelSerializer):
@@ -91,9 +128,17 @@ class VarietalSerializer(serializers.ModelSerializer):
         fields = ['id', 'value']
 
 
+class VacanciesField(serializers.IntegerField):
+    """Vacancies of an occurrence, summed from its counters when it is sharded."""
+
+    def get_attribute(self, instance):
+        return instance.vacancies_total()
+
+
 class VenueSerializer(serializers.ModelSerializer):
     """Serializer for event occurrences """
     id = serializers.ReadOnlyField()
+    vacancies = VacanciesField(read_only=True)
 
     class Meta:
         model = EventOccurrence
@@ -106,7 +151,17 @@ class ImageUrlField(serializers.RelatedField):
         return url
 
 
-class EventSerializer(serializers.ModelSerializer):
+class VarietalField(serializers.PrimaryKeyRelatedField):
+    """Takes the id of a varietal and shows its value."""
+
+    def use_pk_only_optimization(self):
+        return False
+
+    def to_representation(self, value):
+        return value.value
+
+
+class EventSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     id = serializers.ReadOnlyField()
     categories = EventCategorySerializer(many=True)
     occurrences = serializers.SerializerMethodField(read_only=True)
@@ -141,6 +196,53 @@ class EventSerializer(serializers.ModelSerializer):
             'images',
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset, request=None):
+        """Preloads everything read by the serializer so that listing
+        events takes the same number of queries regardless of their amount.
+        Relations of fields left out with `?fields=` are not loaded."""
+        user = getattr(request, 'user', None)
+        user_winery_id = getattr(user, 'winery_id', None)
+        requested = EventSerializer.get_requested_fields(request)
+
+        def wants(*fields):
+            return requested is None or not requested.isdisjoint(fields)
+
+        if wants('winery', 'contact', 'location'):
+            queryset = queryset.select_related('winery')
+        for field in ('categories', 'tags', 'images'):
+            if wants(field):
+                queryset = queryset.prefetch_related(field)
+        if wants('occurrences'):
+            visible_occurrences = Q(start__gt=datetime.now(), cancelled__isnull=True)
+            if user_winery_id:
+                visible_occurrences |= Q(event__winery_id=user_winery_id)
+            queryset = queryset.prefetch_related(
+                'schedules',
+                Prefetch(
+                    'occurrences',
+                    queryset=EventOccurrence.objects.filter(visible_occurrences).order_by('id'),
+                    to_attr='visible_occurrences',
+                ),
+            )
+        if wants('contact'):
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'winery__wineuser_set',
+                    queryset=get_user_model().objects.order_by('id'),
+                    to_attr='contacts',
+                ),
+            )
+        if user and user.is_authenticated and wants('current_user_rating'):
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'rating',
+                    queryset=Rate.objects.filter(user=user).select_related('user'),
+                    to_attr='current_user_rates',
+                ),
+            )
+        return queryset
+
     def create(self, data):
         # TODO: finish docstring
         """Creates and saves an Event associated to
@@ -157,30 +259,11 @@ class EventSerializer(serializers.ModelSerializer):
         categories = data.pop('categories')
         tags = data.pop('tags') if 'tags' in data else []
         data['winery'] = request.user.winery
-        event = Event.objects.create(**data)
-
-        for elem in schedule:
-            start_time = elem['start_time']
-            end_time = elem['end_time']
-            dates = Event.calculate_dates_in_threshold(
-                    elem['from_date'],
-                    elem['to_date'],
-                    elem['weekdays'])
-
-            for date in dates:
-                start = datetime.combine(date, start_time)
-                end = datetime.combine(date, end_time)
-                EventOccurrence.objects.create(
-                    start=start,
-                    end=end,
-                    vacancies=vacancies,
-                    event=event
-                )
-        for category in categories:
-            event.categories.add(get_object_or_404(EventCategory, name=category['name']))
-
-        for tag in tags:
-            event.tags.add(get_object_or_404(Tag, name=tag['name']))
+        with transaction.atomic():
+            event = Event.objects.create(**data)
+            event.add_schedules(schedule, vacancies)
+            event.categories.add(*[get_object_or_404(EventCategory, name=category['name']) for category in categories])
+            event.tags.add(*[get_object_or_404(Tag, name=tag['name']) for tag in tags])
 
         return event
 
@@ -192,35 +275,17 @@ class EventSerializer(serializers.ModelSerializer):
 
         vacancies = validated_data.get('vacancies')
         if vacancies:
-            for elem in validated_data.get('schedule'):
-                start_time = elem['start_time']
-                end_time = elem['end_time']
-                dates = Event.calculate_dates_in_threshold(
-                        elem['from_date'],
-                        elem['to_date'],
-                        elem['weekdays'])
-
-                for date in dates:
-                    start = datetime.combine(date, start_time)
-                    end = datetime.combine(date, end_time)
-                    EventOccurrence.objects.create(
-                        start=start,
-                        end=end,
-                        vacancies=vacancies,
-                        event=instance
-                    )
+            instance.add_schedules(validated_data.get('schedule'), vacancies)
 
         categories = validated_data.get('categories')
         if categories is not None:
-            instance.categories.clear()
-            for category in categories:
-                instance.categories.add(get_object_or_404(EventCategory, name=category['name']))
+            instance.categories.set(
+                [get_object_or_404(EventCategory, name=category['name']) for category in categories]
+            )
 
         tags = validated_data.get('tags')
         if tags is not None:
-            instance.tags.clear()
-            for tag in tags:
-                instance.tags.add(get_object_or_404(Tag, name=tag['name']))
+            instance.tags.set([get_object_or_404(Tag, name=tag['name']) for tag in tags])
 
         instance.save()
         return instance
@@ -262,6 +327,10 @@ class EventSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({'from_date': 'Invalid start date'})
             if end_date and start_date > end_date:
                 raise serializers.ValidationError({'to_date': 'End date must be greater than start date'})
+        if EventSchedule.count_pending_occurrences(schedules) > settings.MAX_SCHEDULE_OCCURRENCES:
+            raise serializers.ValidationError(
+                'The schedule can not generate more than {} occurrences.'.format(settings.MAX_SCHEDULE_OCCURRENCES)
+            )
         return schedules
 
     def validate(self, data):
@@ -270,48 +339,68 @@ class EventSerializer(serializers.ModelSerializer):
         return data
 
     def get_occurrences(self, event):
-        request = self.context.get('request')
-        user = getattr(request, 'user', None)
-        occurrences = EventOccurrence.objects.filter(event=event)
-        if not (request and getattr(user, 'winery', None) and user.winery == event.winery):
-            occurrences = occurrences.filter(
-                start__gt=datetime.now(),
-                cancelled__isnull=True,
-                )
+        occurrences = getattr(event, 'visible_occurrences', None)
+        if occurrences is None:
+            request = self.context.get('request')
+            user = getattr(request, 'user', None)
+            occurrences = EventOccurrence.objects.filter(event=event).order_by('id')
+            if not (request and getattr(user, 'winery', None) and user.winery == event.winery):
+                occurrences = occurrences.filter(
+                    start__gt=datetime.now(),
+                    cancelled__isnull=True,
+                    )
+        occurrences = list(occurrences)
+        if event.cancelled is None:
+            # Dates past the materialized horizon are listed without an id
+            # until the scheduler writes them
+            until = date.today() + timedelta(days=settings.SCHEDULE_PREVIEW_DAYS)
+            for schedule in event.schedules.all():
+                occurrences.extend(schedule.projected_occurrences(until))
         serializer = VenueSerializer(instance=occurrences, many=True)
         return serializer.data
 
     def get_rating(self, event):
-        rate = Rate.objects.filter(event=event).aggregate(Avg('rate'))
-        return rate['rate__avg']
+        return event.average_rating
 
     def get_current_user_rating(self, event):
         request = self.context.get("request")
         if not request or request.user.is_anonymous:
             return None
-        user = request.user
-        rate = Rate.objects.filter(event=event, user=user).first()
+        rates = getattr(event, 'current_user_rates', None)
+        if rates is not None:
+            rate = rates[0] if rates else None
+        else:
+            rate = Rate.objects.filter(event=event, user=request.user).first()
         return RateSerializer(rate).data if rate else None
 
     def get_contact(self, event):
-        user = get_user_model().objects.filter(winery=event.winery).first()
+        contacts = getattr(event.winery, 'contacts', None)
+        if contacts is not None:
+            user = contacts[0] if contacts else None
+        else:
+            user = get_user_model().objects.filter(winery=event.winery).first()
         return {'email': user.email, 'phone_number': user.phone} if user else None
 
     def get_location(self, event):
         if event.winery.location:
-            return json.loads(event.winery.location.json)
+            return point_geometry(event.winery.location)
         return None
 
 
 class WineSerializer(serializers.ModelSerializer):
     """Serializes wines for the api endpoint"""
     id = serializers.ReadOnlyField()
+    varietal = VarietalField(queryset=Varietal.objects.all())
     images = ImageUrlField(read_only=True, many=True)
 
     class Meta:
         model = Wine
         fields = ('id', 'name', 'description', 'varietal', 'images')
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('varietal').prefetch_related('images')
+
     def create(self, data, winery_pk, wineline_pk):
         data['wine_line_id'] = wineline_pk
         data['winery_id'] = winery_pk
@@ -321,10 +410,6 @@ class WineSerializer(serializers.ModelSerializer):
             raise ParseError(datail='Invalid winery or wine line.')
         return wine
 
-    def to_representation(self, obj):
-        self.fields['varietal'] = serializers.SlugRelatedField(slug_field='value', read_only=True)
-        return super().to_representation(obj)
-
 
 class WineLineSerializer(serializers.ModelSerializer):
     """Serializes a wine line for the api endpoint"""
@@ -335,6 +420,12 @@ class WineLineSerializer(serializers.ModelSerializer):
         model = WineLine
         fields = ('id', 'name', 'description', 'wines')
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(
+            Prefetch('wines', queryset=WineSerializer.setup_eager_loading(Wine.objects.all())),
+        )
+
     def create(self, data, winery_pk):
         data['winery_id'] = winery_pk
         try:
@@ -350,7 +441,7 @@ class FileSerializer(serializers.Serializer):
     filefield = serializers.ListField(child=serializers.FileField())
 
 
-class WinerySerializer(serializers.ModelSerializer):
+class WinerySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializes a winery for the api endpoint"""
     id = serializers.ReadOnlyField()
     wine_lines = WineLineSerializer(many=True, read_only=True)
@@ -370,11 +461,49 @@ class WinerySerializer(serializers.ModelSerializer):
             'images',
         )
 
+    @staticmethod
+    def setup_eager_loading(queryset, request=None):
+        """Preloads the wine lines with their wines, the images and the
+        contact, so listing wineries takes the same number of queries
+        however big their catalogs are. Relations of fields left out with
+        `?fields=` are not loaded."""
+        requested = WinerySerializer.get_requested_fields(request)
+
+        def wants(field):
+            return requested is None or field in requested
+
+        if wants('wine_lines'):
+            queryset = queryset.prefetch_related(
+                Prefetch('wine_lines', queryset=WineLineSerializer.setup_eager_loading(WineLine.objects.all())),
+            )
+        if wants('images'):
+            queryset = queryset.prefetch_related('images')
+        if wants('contact'):
+            queryset = queryset.prefetch_related(
+                Prefetch('wineuser_set', queryset=get_user_model().objects.order_by('id'), to_attr='contacts'),
+            )
+        return queryset
+
     def get_contact(self, winery):
-        user = get_user_model().objects.filter(winery=winery).first()
+        contacts = getattr(winery, 'contacts', None)
+        if contacts is not None:
+            user = contacts[0] if contacts else None
+        else:
+            user = get_user_model().objects.filter(winery=winery).first()
         return {'email': user.email, 'phone_number': user.phone} if user else None
 
 
+class NearbyWinerySerializer(WinerySerializer):
+    """Winery found by a proximity search, with its distance in km"""
+    distance = serializers.SerializerMethodField(read_only=True)
+
+    class Meta(WinerySerializer.Meta):
+        fields = WinerySerializer.Meta.fields + ('distance',)
+
+    def get_distance(self, winery):
+        return round(winery.distance / 1000, 3)
+
+
 class EventBriefSerializer(serializers.ModelSerializer):
     """Serializer for event with rediced infromation only for reading purposes"""
     id = serializers.ReadOnlyField()
@@ -390,6 +519,7 @@ class EventOccurrenceSerializer(serializers.ModelSerializer):
     """Serializer for event occurrences """
     id = serializers.ReadOnlyField()
     cancelled = serializers.ReadOnlyField()
+    vacancies = VacanciesField(min_value=0)
     event = EventBriefSerializer(read_only=True)
 
     class Meta:
@@ -414,23 +544,29 @@ class EventOccurrenceSerializer(serializers.ModelSerializer):
         instance.end = end or instance.end
         instance.vacancies = validated_data.get('vacancies', instance.vacancies)
         instance.save()
+        if 'vacancies' in validated_data:
+            EventOccurrence.reshard(EventOccurrence.objects.filter(pk=instance.pk))
+        publish_occurrences(EventOccurrence.objects.filter(pk=instance.pk))
         if start or end:
-            for reservation in instance.reservation_set.all():
-                # send email
-                subject = 'Winecompanion Reservation Date Modified'
-                html_message = render_to_string(
+            context = {
+                'winery': instance.event.winery.name,
+                'id': instance.id,
+                'date': instance.start.strftime("%d/%m/%Y"),
+                'start': localize(instance.start.time()),
+                'end': localize(instance.end.time()),
+            }
+            recipients = instance.reservation_set.exclude(
+                status=RESERVATION_CANCELLED,
+            ).values_list('user__first_name', 'user__email')
+            Mail.send_mass_mail(
+                (
+                    'Winecompanion Reservation Date Modified',
                     'reservation_edited_template.html',
-                    {
-                        'first_name': reservation.user.first_name,
-                        'winery': instance.event.winery.name,
-                        'id': instance.id,
-                        'date': instance.start.strftime("%d/%m/%Y"),
-                        'start': instance.start.time,
-                        'end': instance.end.time,
-                    }
+                    dict(context, first_name=first_name),
+                    email,
                 )
-                plain_message = strip_tags(html_message)
-                Mail.send_mail(subject, plain_message, [reservation.user.email], html_message=html_message)
+                for first_name, email in recipients.iterator()
+            )
         return instance
 
     def validate(self, data):
@@ -471,9 +607,10 @@ class ReservationSerializer(serializers.ModelSerializer):
         return attendee_number
 
     def create(self, data, user_pk):
-        data['user_id'] = user_pk
         try:
-            reservation = Reservation.objects.create(**data)
+            reservation = book(user_pk, **data)
+        except NotEnoughVacancies as error:
+            raise serializers.ValidationError(str(error))
         except IntegrityError:
             raise ParseError(detail='Failed to create Reservation')
         return reservation
@@ -484,7 +621,7 @@ class ReservationSerializer(serializers.ModelSerializer):
         """
         if data['event_occurrence'].event.price * data['attendee_number'] != data['paid_amount']:
             raise serializers.ValidationError('The paid amount is not valid')
-        if data['event_occurrence'].vacancies < data['attendee_number']:
+        if data['event_occurrence'].available_vacancies() < data['attendee_number']:
             raise serializers.ValidationError('Not enough vacancies for the reservation')
         if data['event_occurrence'].start < datetime.now():
             raise serializers.ValidationError('The date is no longer available')
@@ -502,6 +639,54 @@ class ReservationSerializer(serializers.ModelSerializer):
         return super().to_representation(obj)
 
 
+class LoadedOccurrenceField(serializers.PrimaryKeyRelatedField):
+    """Occurrence looked up in the `occurrences` the root serializer loaded
+    for every item at once."""
+
+    def to_internal_value(self, data):
+        try:
+            return self.context['occurrences'][int(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class ReservationBatchItemSerializer(ReservationSerializer):
+    event_occurrence = LoadedOccurrenceField(queryset=EventOccurrence.objects.all())
+
+
+class ReservationBatchSerializer(serializers.Serializer):
+    """Several reservations booked all together or not at all."""
+    reservations = ReservationBatchItemSerializer(many=True, allow_empty=False)
+
+    def to_internal_value(self, data):
+        items = data.get('reservations') if hasattr(data, 'get') else None
+        if isinstance(items, list):
+            ids = {str(item.get('event_occurrence')) for item in items if hasattr(item, 'get')}
+            self.context['occurrences'] = EventOccurrence.objects.select_related('event').in_bulk(
+                [int(pk) for pk in ids if pk.isdigit()]
+            )
+        return super().to_internal_value(data)
+
+    def validate_reservations(self, reservations):
+        if len(reservations) > settings.MAX_BATCH_RESERVATIONS:
+            raise serializers.ValidationError(
+                'A batch can not have more than {} reservations'.format(settings.MAX_BATCH_RESERVATIONS)
+            )
+        return reservations
+
+    def create(self, data, user_pk):
+        items = data['reservations']
+        try:
+            return book_many(user_pk, items)
+        except NotEnoughVacancies as error:
+            raise serializers.ValidationError({'reservations': [
+                {'non_field_errors': [str(error)]} if item['event_occurrence'].pk == error.event_occurrence_id else {}
+                for item in items
+            ]})
+        except IntegrityError:
+            raise ParseError(detail='Failed to create Reservations')
+
+
 class RateSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField()
     user_name = serializers.ReadOnlyField()
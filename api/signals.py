@@ -0,0 +1,195 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import SEARCH_DOCUMENT_EVENT, SEARCH_DOCUMENT_WINERY
+from .cache import bump_catalog_version
+from .clusters import invalidate_tiles
+from .models import (
+    Event,
+    EventCategory,
+    EventOccurrence,
+    ImagesEvent,
+    ImagesWinery,
+    ImagesWines,
+    Rate,
+    Tag,
+    Wine,
+    WineLine,
+    Winery,
+)
+from .search import index_events, index_wineries, remove_documents
+from .tiles import invalidate_vector_tiles
+
+CATALOG_MODELS = [
+    Event,
+    EventOccurrence,
+    ImagesEvent,
+    ImagesWinery,
+    ImagesWines,
+    Rate,
+    Wine,
+    WineLine,
+    Winery,
+]
+
+
+def catalog_changed(sender, **kwargs):
+    # Bumped once committed, or a request in between could cache the previous
+    # data under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid='catalog-save-{}'.format(model.__name__))
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid='catalog-delete-{}'.format(model.__name__))
+
+m2m_changed.connect(catalog_changed, sender=Event.categories.through, dispatch_uid='catalog-event-categories')
+m2m_changed.connect(catalog_changed, sender=Event.tags.through, dispatch_uid='catalog-event-tags')
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL, dispatch_uid='catalog-save-user')
+def user_changed(sender, update_fields=None, **kwargs):
+    # Users show up as winery contacts; logins only touch last_login
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    transaction.on_commit(bump_catalog_version)
+
+
+def changed_events(instance, action, reverse, pk_set):
+    """Events whose categories or tags were changed by an m2m_changed signal,
+    or None while the change is not applied yet."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            return Event.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        instance._cleared_event_ids = list(instance.event_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        return Event.objects.filter(pk__in=pk_set)
+    elif action == 'post_clear':
+        return Event.objects.filter(pk__in=getattr(instance, '_cleared_event_ids', []))
+    return None
+
+
+@receiver(m2m_changed, sender=Event.categories.through, dispatch_uid='event-categories-changed')
+def event_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    events = changed_events(instance, action, reverse, pk_set)
+    if events is None:
+        return
+    # Event.kind is derived from the categories, keep it in step with them
+    if reverse:
+        Event.refresh_kinds(events)
+    else:
+        instance.refresh_kind()
+    index_events(events)
+
+
+@receiver(m2m_changed, sender=Event.tags.through, dispatch_uid='event-tags-changed')
+def event_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    events = changed_events(instance, action, reverse, pk_set)
+    if events is not None:
+        index_events(events)
+
+
+@receiver(post_save, sender=EventCategory, dispatch_uid='event-category-save')
+def event_category_saved(sender, instance, created, **kwargs):
+    if not created:
+        Event.refresh_kinds(instance.event_set.all())
+        index_events(instance.event_set.all())
+        transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Tag, dispatch_uid='tag-save')
+def tag_saved(sender, instance, created, **kwargs):
+    if not created:
+        index_events(instance.event_set.all())
+        transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Event, dispatch_uid='search-event-save')
+def event_saved(sender, instance, **kwargs):
+    index_events(Event.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Winery, dispatch_uid='search-winery-save')
+def winery_saved(sender, instance, **kwargs):
+    index_wineries([instance])
+    # event documents include the winery name
+    index_events(instance.events.all())
+
+
+@receiver(post_delete, sender=Event, dispatch_uid='search-event-delete')
+def event_deleted(sender, instance, **kwargs):
+    remove_documents(SEARCH_DOCUMENT_EVENT, [instance.pk])
+
+
+@receiver(post_delete, sender=Winery, dispatch_uid='search-winery-delete')
+def winery_deleted(sender, instance, **kwargs):
+    remove_documents(SEARCH_DOCUMENT_WINERY, [instance.pk])
+
+
+@receiver(post_save, sender=EventOccurrence, dispatch_uid='event-next-occurrence-save')
+@receiver(post_delete, sender=EventOccurrence, dispatch_uid='event-next-occurrence-delete')
+def event_occurrence_changed(sender, instance, **kwargs):
+    Event.refresh_next_occurrences(Event.objects.filter(pk=instance.event_id))
+
+
+@receiver(post_save, sender=EventOccurrence, dispatch_uid='event-occurrence-shard')
+def event_occurrence_created(sender, instance, created, **kwargs):
+    if created and instance.vacancies > settings.SHARDED_VACANCIES_THRESHOLD:
+        EventOccurrence.reshard(EventOccurrence.objects.filter(pk=instance.pk))
+        instance.sharded = True
+
+
+def map_point(winery):
+    """Location the winery is shown at on the map, None while it is hidden."""
+    return winery.location if winery.available_since and winery.location else None
+
+
+@receiver(pre_save, sender=Winery, dispatch_uid='map-winery-pre-save')
+def winery_moving(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'location', 'available_since'} & set(update_fields):
+        return
+    previous = None
+    if instance.pk:
+        previous = Winery.objects.filter(pk=instance.pk).only('location', 'available_since').first()
+    instance._previous_map_point = map_point(previous) if previous else None
+
+
+@receiver(post_save, sender=Winery, dispatch_uid='map-winery-save')
+def winery_moved(sender, instance, **kwargs):
+    current = map_point(instance)
+    previous = instance.__dict__.pop('_previous_map_point', current)
+    points = [point for point in (previous, current) if point]
+    # Dropped once committed, so that requests in between cannot cache the
+    # tiles again from the previous location
+    if previous != current:
+        transaction.on_commit(lambda: invalidate_tiles(points))
+    # Vector tiles also show the name
+    transaction.on_commit(lambda: invalidate_vector_tiles(points))
+
+
+@receiver(post_delete, sender=Winery, dispatch_uid='map-winery-delete')
+def winery_removed(sender, instance, **kwargs):
+    if map_point(instance):
+        point = instance.location
+        transaction.on_commit(lambda: invalidate_tiles([point]))
+        transaction.on_commit(lambda: invalidate_vector_tiles([point]))
+
+
+@receiver(post_save, sender=Event, dispatch_uid='vector-tiles-event-save')
+@receiver(post_delete, sender=Event, dispatch_uid='vector-tiles-event-delete')
+def event_changed_on_map(sender, instance, **kwargs):
+    # Tiles count the upcoming events of each winery
+    point = Winery.objects.filter(pk=instance.winery_id).values_list('location', flat=True).first()
+    if point:
+        transaction.on_commit(lambda: invalidate_vector_tiles([point]))
+
+
+@receiver(post_save, sender=EventOccurrence, dispatch_uid='vector-tiles-occurrence-save')
+@receiver(post_delete, sender=EventOccurrence, dispatch_uid='vector-tiles-occurrence-delete')
+def event_occurrence_changed_on_map(sender, instance, **kwargs):
+    point = Winery.objects.filter(events=instance.event_id).values_list('location', flat=True).first()
+    if point:
+        transaction.on_commit(lambda: invalidate_vector_tiles([point]))
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from api.models import Winery
+
+
+class TestBenchmarkEndpoints(TestCase):
+    def setUp(self):
+        handle, self.baseline = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, self.baseline)
+
+    def benchmark(self, **options):
+        out = StringIO()
+        call_command(
+            'benchmark_endpoints',
+            wineries=2,
+            repeat=1,
+            baseline=self.baseline,
+            stdout=out,
+            stderr=StringIO(),
+            **options
+        )
+        return out.getvalue()
+
+    def test_save_baseline(self):
+        out = self.benchmark(save=True)
+        with open(self.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.assertEqual(baseline['scale'], {'wineries': 2, 'seed': 0})
+        wineries = baseline['routes']['/api/wineries/']
+        self.assertEqual(wineries['status'], 200)
+        self.assertGreater(wineries['queries'], 0)
+        self.assertGreater(wineries['bytes'], 0)
+        self.assertLessEqual(wineries['p50_ms'], wineries['p95_ms'])
+        self.assertIn('/api/events/<event_pk>/occurrences/<pk>/', baseline['routes'])
+        self.assertIn('/users/', baseline['routes'])
+        self.assertNotIn('/api/upload/', baseline['routes'])
+        self.assertIn('Saved the baseline', out)
+        self.assertFalse(Winery.objects.exists())
+
+    def test_compare_with_baseline(self):
+        self.benchmark(save=True)
+        out = self.benchmark(threshold=10000)
+        self.assertIn('No regressions over the baseline', out)
+
+    def test_more_queries_than_baseline_fail(self):
+        self.benchmark(save=True)
+        with open(self.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        baseline['routes']['/api/wineries/']['queries'] -= 1
+        with open(self.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file)
+        with self.assertRaisesMessage(CommandError, '1 regressions over the baseline'):
+            self.benchmark(threshold=10000)
+
+    def test_baseline_of_other_scale(self):
+        self.benchmark(save=True)
+        with self.assertRaises(CommandError):
+            self.benchmark(seed=1)
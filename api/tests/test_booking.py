@@ -0,0 +1,261 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+
+from api.booking import NotEnoughVacancies, book
+from api.models import Country, Event, EventOccurrence, Gender, Language, Reservation, Winery
+from users.models import WineUser
+
+
+class TestBooking(TestCase):
+    def setUp(self):
+        self.winery = Winery.objects.create(name='My Winery', description='Test Winery')
+        self.user = WineUser.objects.create_user(
+            email='user@user.com',
+            password='12345678',
+            gender=Gender.objects.create(name='Male'),
+            language=Language.objects.create(name='English'),
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=500.0)
+        start = datetime.now() + timedelta(days=1)
+        self.occurrence = EventOccurrence.objects.create(
+            start=start,
+            end=start + timedelta(hours=2),
+            vacancies=5,
+            event=self.event
+        )
+        self.client = Client()
+
+    def test_book_takes_the_vacancies(self):
+        book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies, 2)
+
+        with self.assertRaises(NotEnoughVacancies):
+            book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies, 2)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_reservation_endpoint_books_the_vacancies(self):
+        self.client.force_login(self.user)
+        data = {'attendee_number': 3, 'paid_amount': 1500, 'event_occurrence': self.occurrence.id}
+        response = self.client.post(reverse('reservations-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies, 2)
+
+        response = self.client.post(reverse('reservations-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('errors', response.data)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+
+@override_settings(SHARDED_VACANCIES_THRESHOLD=20, VACANCY_SHARDS=4)
+class TestShardedVacancies(TestCase):
+    def setUp(self):
+        self.winery = Winery.objects.create(name='My Winery', description='Test Winery')
+        self.user = WineUser.objects.create_user(
+            email='user@user.com',
+            password='12345678',
+            gender=Gender.objects.create(name='Male'),
+            language=Language.objects.create(name='English'),
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=500.0)
+        self.occurrence = self.create_occurrence(30)
+
+    def create_occurrence(self, vacancies):
+        start = datetime.now() + timedelta(days=1)
+        return EventOccurrence.objects.create(
+            start=start, end=start + timedelta(hours=2), vacancies=vacancies, event=self.event
+        )
+
+    def shards(self):
+        return list(self.occurrence.vacancy_shards.order_by('slot').values_list('vacancies', flat=True))
+
+    def test_occurrences_above_the_threshold_are_sharded(self):
+        self.assertTrue(self.occurrence.sharded)
+        self.assertEqual(self.shards(), [8, 8, 7, 7])
+        small = self.create_occurrence(20)
+        self.assertFalse(small.sharded)
+        self.assertFalse(small.vacancy_shards.exists())
+
+    def test_bookings_take_from_the_counters(self):
+        book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        self.assertEqual(sum(self.shards()), 27)
+        # taken from a single counter
+        taken = [before - after for before, after in zip([8, 8, 7, 7], self.shards()) if before != after]
+        self.assertEqual(taken, [3])
+        self.assertEqual(self.occurrence.available_vacancies(), 27)
+
+        # more than any counter holds
+        book(self.user.id, self.occurrence, 20, paid_amount=10000)
+        self.assertEqual(sum(self.shards()), 7)
+        with self.assertRaises(NotEnoughVacancies):
+            book(self.user.id, self.occurrence, 8, paid_amount=4000)
+        self.assertEqual(sum(self.shards()), 7)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_total_is_cached_for_reads(self):
+        book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        response = self.client.get(
+            reverse('event-occurrences-detail', kwargs={'event_pk': self.event.id, 'pk': self.occurrence.id})
+        )
+        self.assertEqual(response.json()['vacancies'], 27)
+        book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies_total(), 27)
+        self.assertEqual(self.occurrence.available_vacancies(), 24)
+
+    def test_cancellations_give_the_seats_back(self):
+        reservation = book(self.user.id, self.occurrence, 10, paid_amount=5000)
+        reservation.cancel()
+        self.assertEqual(sum(self.shards()), 30)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies, 30)
+
+        self.occurrence.cancel()
+        with self.assertRaises(NotEnoughVacancies):
+            book(self.user.id, self.occurrence, 1, paid_amount=500)
+
+    def test_editing_the_vacancies_reshards(self):
+        EventOccurrence.objects.filter(pk=self.occurrence.pk).update(vacancies=40)
+        EventOccurrence.reshard(EventOccurrence.objects.filter(pk=self.occurrence.pk))
+        self.assertEqual(self.shards(), [10, 10, 10, 10])
+
+        EventOccurrence.objects.filter(pk=self.occurrence.pk).update(vacancies=10)
+        EventOccurrence.reshard(EventOccurrence.objects.filter(pk=self.occurrence.pk))
+        self.occurrence.refresh_from_db()
+        self.assertFalse(self.occurrence.sharded)
+        self.assertEqual(self.shards(), [])
+        book(self.user.id, self.occurrence, 4, paid_amount=2000)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies, 6)
+
+
+class TestConcurrentBooking(TransactionTestCase):
+    def test_stress_bookings_does_not_oversell(self):
+        out = StringIO()
+        call_command('stress_bookings', threads=4, attempts=10, vacancies=25, stdout=out)
+        self.assertIn('25 of 25 vacancies booked, 0 left', out.getvalue())
+        self.assertIn('No oversell', out.getvalue())
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_sharded_counters_do_not_oversell(self):
+        out = StringIO()
+        call_command('stress_bookings', threads=4, attempts=10, vacancies=25, attendees=2, mode='compare', stdout=out)
+        self.assertEqual(out.getvalue().count('24 of 25 vacancies booked, 1 left'), 2)
+        self.assertEqual(out.getvalue().count('No oversell'), 2)
+        self.assertIn('Sharded counters:', out.getvalue())
+        self.assertFalse(Reservation.objects.exists())
+
+
+class TestBatchBooking(TestCase):
+    def setUp(self):
+        self.winery = Winery.objects.create(name='My Winery', description='Test Winery')
+        self.user = WineUser.objects.create_user(
+            email='user@user.com',
+            password='12345678',
+            gender=Gender.objects.create(name='Male'),
+            language=Language.objects.create(name='English'),
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=500.0)
+        self.occurrences = []
+        for days in range(1, 4):
+            start = datetime.now() + timedelta(days=days)
+            self.occurrences.append(EventOccurrence.objects.create(
+                start=start,
+                end=start + timedelta(hours=2),
+                vacancies=5,
+                event=self.event
+            ))
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def item(self, occurrence, attendee_number):
+        return {
+            'event_occurrence': occurrence.id,
+            'attendee_number': attendee_number,
+            'paid_amount': 500 * attendee_number,
+        }
+
+    def post(self, items):
+        return self.client.post(
+            reverse('reservations-batch'), {'reservations': items}, content_type='application/json'
+        )
+
+    def vacancies(self):
+        return [occurrence.vacancies for occurrence in EventOccurrence.objects.order_by('start')]
+
+    def test_books_every_item(self):
+        first, second, _ = self.occurrences
+        response = self.post([self.item(first, 2), self.item(second, 5), self.item(first, 3)])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        reservations = Reservation.objects.order_by('id')
+        self.assertEqual(
+            response.json()['reservations'],
+            [{'url': reverse('reservations-detail', args=[reservation.id])} for reservation in reservations],
+        )
+        self.assertEqual([r.event_occurrence_id for r in reservations], [first.id, second.id, first.id])
+        self.assertEqual(self.vacancies(), [0, 0, 5])
+
+    def test_books_nothing_when_an_occurrence_is_full(self):
+        first, second, third = self.occurrences
+        response = self.post([self.item(first, 1), self.item(third, 3), self.item(third, 3)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['errors']['reservations'], [
+            {},
+            {'non_field_errors': ['Not enough vacancies for the reservation']},
+            {'non_field_errors': ['Not enough vacancies for the reservation']},
+        ])
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(self.vacancies(), [5, 5, 5])
+
+    def test_reports_the_invalid_items(self):
+        first, second, _ = self.occurrences
+        wrong_amount = dict(self.item(second, 2), paid_amount=1)
+        response = self.post([self.item(first, 1), wrong_amount, dict(self.item(first, 1), event_occurrence=999)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()['errors']['reservations']
+        self.assertEqual(errors[0], {})
+        self.assertEqual(errors[1], {'non_field_errors': ['The paid amount is not valid']})
+        self.assertIn('event_occurrence', errors[2])
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_validation_queries_do_not_grow_with_the_items(self):
+        def validation_queries(items):
+            with CaptureQueriesContext(connection) as queries:
+                self.post(items)
+            return len(queries)
+
+        invalid = dict(self.item(self.occurrences[0], 1), paid_amount=1)
+        self.assertEqual(validation_queries([invalid]), validation_queries([invalid] * 6))
+
+    @override_settings(MAX_BATCH_RESERVATIONS=2)
+    def test_rejects_too_many_or_no_items(self):
+        response = self.post([self.item(occurrence, 1) for occurrence in self.occurrences])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('reservations', response.json()['errors'])
+        self.assertEqual(self.post([]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_retried_batch_is_booked_once(self):
+        items = [self.item(self.occurrences[0], 1), self.item(self.occurrences[1], 1)]
+        for _ in range(2):
+            response = self.client.post(
+                reverse('reservations-batch'),
+                {'reservations': items},
+                content_type='application/json',
+                HTTP_IDEMPOTENCY_KEY='day-trip',
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Reservation.objects.count(), 2)
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import Client, TestCase, TransactionTestCase
+from django.urls import reverse
+
+from api.cache import get_cache_stats, get_catalog_version, reset_cache_stats
+from api.models import Event, EventOccurrence, Rate, Winery, Country, Gender, Language
+from users.models import WineUser
+
+
+class ResponseCacheMixin:
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+        self.winery = Winery.objects.create(
+            name='Bodega1',
+            description='Hola',
+            available_since=datetime.now(),
+        )
+        self.event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=0.0)
+        EventOccurrence.objects.create(
+            start='2036-10-31T20:00:00',
+            end='2036-10-31T23:00:00',
+            vacancies=50,
+            event=self.event
+        )
+        self.client = Client()
+
+
+class TestResponseCache(ResponseCacheMixin, TestCase):
+    def test_anonymous_listing_is_served_from_cache(self):
+        first = self.client.get(reverse('event-list'))
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('event-list'))
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(get_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_query_string_is_part_of_the_key(self):
+        self.client.get(reverse('winery-list'))
+        response = self.client.get(reverse('winery-list'), {'search': 'Bodega'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_authenticated_requests_are_not_cached(self):
+        user = WineUser.objects.create(
+            email='user@test.com',
+            gender=Gender.objects.create(name='Other'),
+            language=Language.objects.create(name='English'),
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.client.force_login(user)
+        self.client.get(reverse('event-list'))
+        response = self.client.get(reverse('event-list'))
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class TestResponseCacheInvalidation(ResponseCacheMixin, TransactionTestCase):
+    def test_catalog_changes_invalidate_cached_responses(self):
+        self.client.get(reverse('event-list'))
+        version = get_catalog_version()
+
+        self.event.name = 'Renamed'
+        self.event.save()
+        self.assertGreater(get_catalog_version(), version)
+
+        response = self.client.get(reverse('event-list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Renamed')
+
+    def test_rate_changes_invalidate_cached_responses(self):
+        user = WineUser.objects.create(
+            email='user@test.com',
+            gender=Gender.objects.create(name='Other'),
+            language=Language.objects.create(name='English'),
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.client.get(reverse('event-list'))
+        Rate.objects.create(event=self.event, user=user, rate=5, comment='Great')
+        response = self.client.get(reverse('event-list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['rating'], 5)
+
+    def test_catalog_version_moves_once_the_change_commits(self):
+        version = get_catalog_version()
+        with transaction.atomic():
+            self.event.name = 'Renamed'
+            self.event.save()
+            # A request served now would still read the previous name
+            self.assertEqual(get_catalog_version(), version)
+        self.assertGreater(get_catalog_version(), version)
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+
+from api import RESERVATION_CANCELLED, RESERVATION_CONFIRMED
+from api.models import Country, Event, EventOccurrence, Gender, Language, OutboxMail, Reservation, Winery
+from users.models import WineUser
+
+
+class CancellationFixtureMixin:
+    def create_fixture(self):
+        self.winery = Winery.objects.create(name='My Winery', description='Test Winery')
+        self.gender = Gender.objects.create(name='Male')
+        self.language = Language.objects.create(name='English')
+        self.country = Country.objects.create(name='Argentina')
+        self.winery_user = WineUser.objects.create_user(
+            email='winery@winecompanion.com',
+            password='12345678',
+            gender=self.gender,
+            language=self.language,
+            country=self.country,
+            winery=self.winery,
+        )
+        self.event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=500.0)
+
+    def create_user(self, number):
+        return WineUser.objects.create_user(
+            email='user{}@user.com'.format(number),
+            first_name='User {}'.format(number),
+            password='12345678',
+            gender=self.gender,
+            language=self.language,
+            country=self.country,
+        )
+
+    def create_occurrences(self, count, reservations_each, days=1):
+        occurrences = []
+        for number in range(count):
+            start = datetime.now() + timedelta(days=days + number)
+            occurrence = EventOccurrence.objects.create(
+                start=start, end=start + timedelta(hours=2), vacancies=10, event=self.event
+            )
+            for _ in range(reservations_each):
+                Reservation.objects.create(
+                    attendee_number=2,
+                    paid_amount=1000,
+                    user=self.create_user(Reservation.objects.count()),
+                    event_occurrence=occurrence,
+                )
+            occurrences.append(occurrence)
+        return occurrences
+
+
+class TestCancellation(CancellationFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.client = Client()
+
+    def test_cancel_event_cascades(self):
+        occurrences = self.create_occurrences(3, 2)
+        past = self.create_occurrences(1, 1, days=-3)[0]
+
+        cancelled = self.event.cancel('Flooded')
+        self.assertEqual(cancelled, {'occurrences': 3, 'reservations': 6})
+
+        self.event.refresh_from_db()
+        self.assertIsNotNone(self.event.cancelled)
+        self.assertIsNone(self.event.next_occurrence_start)
+        self.assertEqual(self.event.open_occurrences_count, 0)
+        for occurrence in occurrences:
+            occurrence.refresh_from_db()
+            self.assertIsNotNone(occurrence.cancelled)
+            self.assertEqual(occurrence.vacancies, 14)
+        self.assertEqual(
+            Reservation.objects.filter(status=RESERVATION_CANCELLED).count(), 6
+        )
+        past.refresh_from_db()
+        self.assertIsNone(past.cancelled)
+        self.assertEqual(past.reservation_set.get().status, RESERVATION_CONFIRMED)
+
+    def test_cancelled_reservations_are_not_restored_twice(self):
+        occurrence = self.create_occurrences(1, 2)[0]
+        first = occurrence.reservation_set.first()
+        self.assertEqual(first.cancel(), 'The reservation has been cancelled')
+        self.assertEqual(first.cancel(), 'The reservation was already cancelled')
+
+        self.assertEqual(occurrence.cancel(), {'occurrences': 1, 'reservations': 1})
+        self.assertEqual(occurrence.vacancies, 14)
+        self.assertEqual(occurrence.cancel(), {'occurrences': 0, 'reservations': 0})
+        self.assertEqual(occurrence.vacancies, 14)
+
+    def test_queries_do_not_grow_with_the_reservations(self):
+        def cancel_queries(occurrences):
+            with CaptureQueriesContext(connection) as queries:
+                EventOccurrence.cancel_all(EventOccurrence.objects.filter(pk__in=[o.pk for o in occurrences]))
+            return len(queries)
+
+        few = self.create_occurrences(1, 1)
+        many = self.create_occurrences(5, 4, days=10)
+        self.assertEqual(cancel_queries(few), cancel_queries(many))
+
+    def test_cancel_event_endpoint_returns_counts(self):
+        self.create_occurrences(2, 3)
+        self.client.force_login(self.winery_user)
+        response = self.client.post(reverse('event-cancel-event', kwargs={'pk': self.event.id}), {'reason': 'Rain'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['cancelled'], {'occurrences': 2, 'reservations': 6})
+
+    def test_cancel_occurrence_endpoint_returns_counts(self):
+        occurrence = self.create_occurrences(1, 3)[0]
+        self.client.force_login(self.winery_user)
+        response = self.client.post(
+            reverse('event-occurrences-cancel-occurrence', kwargs={'event_pk': self.event.id, 'pk': occurrence.id})
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['cancelled'], {'occurrences': 1, 'reservations': 3})
+
+
+@override_settings(SEND_EMAILS=True)
+class TestCancellationNotifications(CancellationFixtureMixin, TestCase):
+    def test_cancelled_users_are_notified_through_the_outbox(self):
+        self.create_fixture()
+        self.create_occurrences(2, 3)
+
+        self.event.cancel('Flooded')
+        self.assertEqual(OutboxMail.objects.count(), 6)
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 6)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            sorted(Reservation.objects.values_list('user__email', flat=True)),
+        )
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, 'Winecompanion Reservation Cancelled')
+        self.assertIn('Flooded', message.alternatives[0][0])
@@ -0,0 +1,72 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Sum
+from django.test import TestCase
+
+from api import RESERVATION_CANCELLED
+from api.models import Event, EventOccurrence, Rate, Reservation, SearchDocument, Wine, Winery
+from users.models import WineUser
+
+OPTIONS = {
+    'wineries': 3,
+    'users': 20,
+    'events_per_winery': 2,
+    'occurrences_per_event': 10,
+    'batch_size': 7,
+    'progress_every': 10,
+}
+
+
+class TestGenerateDataset(TestCase):
+    def generate(self, **options):
+        out = StringIO()
+        call_command('generate_dataset', stdout=out, **dict(OPTIONS, **options))
+        return out.getvalue()
+
+    def snapshot(self):
+        return (
+            list(Winery.objects.order_by('pk').values_list('name', 'location', 'available_since')),
+            list(WineUser.objects.order_by('pk').values_list('email', 'birth_date', 'country__name', 'winery')),
+            list(EventOccurrence.objects.order_by('pk').values_list('event', 'start', 'vacancies', 'cancelled')),
+            list(Reservation.objects.order_by('pk').values_list('user', 'event_occurrence', 'attendee_number')),
+            list(Rate.objects.order_by('pk').values_list('event', 'user', 'rate')),
+        )
+
+    def test_generate_dataset(self):
+        out = self.generate()
+        self.assertEqual(Winery.objects.count(), 3)
+        self.assertEqual(WineUser.objects.count(), 23)
+        self.assertEqual(WineUser.objects.filter(winery__isnull=False).count(), 3)
+        self.assertEqual(Event.objects.count(), 6)
+        self.assertEqual(EventOccurrence.objects.count(), 60)
+        self.assertTrue(Wine.objects.exists())
+        self.assertFalse(Event.objects.filter(categories=None).exists())
+        self.assertEqual(SearchDocument.objects.count(), 9)
+        self.assertEqual(Event.objects.filter(next_occurrence_start__isnull=False).count(), 6)
+        for winery in Winery.objects.all():
+            self.assertTrue(-35.5 < winery.location.y < -32)
+            self.assertTrue(-70 < winery.location.x < -67.5)
+        self.assertIn('reservations: ', out)
+        self.assertIn('Created ', out)
+
+    def test_vacancies_discount_reservations(self):
+        self.generate()
+        for occurrence in EventOccurrence.objects.all():
+            seats = occurrence.reservation_set.exclude(status=RESERVATION_CANCELLED).aggregate(
+                seats=Sum('attendee_number')
+            )['seats'] or 0
+            self.assertIn(occurrence.vacancies + seats, (10, 15, 20, 30, 40, 60))
+
+    def test_same_seed_same_data(self):
+        with transaction.atomic():
+            self.generate()
+            first = self.snapshot()
+            transaction.set_rollback(True)
+        with transaction.atomic():
+            self.generate(seed=1)
+            self.assertNotEqual(self.snapshot(), first)
+            transaction.set_rollback(True)
+        self.generate()
+        self.assertEqual(self.snapshot(), first)
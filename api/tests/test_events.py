@@ -1,13 +1,19 @@
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from io import StringIO
 
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
 from parameterized import parameterized
 
 from users.models import WineUser
-from api.models import Country, Event, EventCategory, EventOccurrence, Tag, Winery, Gender, Language
+from api import EVENT_KIND_EVENT, EVENT_KIND_RESTAURANT
+from api.models import Country, Event, EventCategory, EventOccurrence, Rate, Tag, Winery, Gender, Language
 from api.serializers import EventSerializer, EventOccurrenceSerializer
 
 
@@ -16,6 +22,8 @@ MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY = list(range(7))
 
 class TestEvents(TestCase):
     def setUp(self):
+        # Nothing commits in these tests, so the catalog version never moves
+        cache.clear()
         self.gender = Gender.objects.create(name='Other')
         self.language = Language.objects.create(name='English')
         self.country = Country.objects.create(name='Argentina')
@@ -182,11 +190,48 @@ class TestEvents(TestCase):
         result = Event.calculate_dates_in_threshold(start, end, weekdays)
         self.assertEqual(result, expected)
 
+    def test_dates_between_threshold_without_weekdays(self):
+        result = Event.calculate_dates_in_threshold(date(2019, 8, 30), date(2019, 9, 2), None)
+        self.assertEqual(result, [date(2019, 8, 30), date(2019, 8, 31), date(2019, 9, 1), date(2019, 9, 2)])
+
+    @override_settings(MAX_SCHEDULE_OCCURRENCES=10, SCHEDULE_HORIZON_DAYS=36500)
+    def test_event_creation_schedule_occurrences_cap(self):
+        self.client.force_login(self.winery_user)
+        data = self.valid_data['one_schedule_no_to_date']
+        data['schedule'][0]['to_date'] = '2030-09-28'
+        response = self.client.post(reverse('event-list'), data=data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('schedule', response.data['errors'])
+        self.assertFalse(Event.objects.exists())
+
+    @override_settings(SCHEDULE_HORIZON_DAYS=36500)
+    def test_event_creation_inserts_occurrences_in_batches(self):
+        self.client.force_login(self.winery_user)
+        data = self.valid_data['one_schedule_no_to_date']
+        data['schedule'][0]['to_date'] = '2031-08-27'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('event-list'), data=data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        event = Event.objects.get()
+        self.assertEqual(event.occurrences.count(), 365)
+        self.assertEqual(event.open_occurrences_count, 365)
+        self.assertEqual(event.next_occurrence_start, datetime(2030, 8, 28, 15, 30))
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "api_eventoccurrence"')]
+        self.assertLess(len(inserts), 10)
+
+    def test_benchmark_schedules_command(self):
+        out = StringIO()
+        call_command('benchmark_schedules', repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[:2] for line in lines[1:]], [['1', '1'], ['30', '30'], ['365', '365']])
+        self.assertFalse(Event.objects.exists())
+
     @parameterized.expand([
        ('one_schedule_no_to_date', 1),
        ('one_schedule_with_weekdays', 7),
        ('multiple_schedules_with_weekdays', 12),
     ])
+    @override_settings(SCHEDULE_HORIZON_DAYS=36500)
     def test_event_creation_endpoint_with_different_schedules(self, data_key, expected_occurrences_count):
         self.client.force_login(self.winery_user)
         data = self.valid_data[data_key]
@@ -239,8 +284,15 @@ class TestEvents(TestCase):
         )
         serializer1 = EventSerializer(event1)
         serializer2 = EventSerializer(event2)
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
+
+    def test_event_location_is_geojson_point(self):
+        event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=0.0)
+        self.assertEqual(
+            EventSerializer(event).data['location'],
+            {'type': 'Point', 'coordinates': [-33.094345, -68.929015]},
+        )
 
     def test_search_event_by_name(self):
         """Test returning events that match a name"""
@@ -265,8 +317,8 @@ class TestEvents(TestCase):
 
         serializer1 = EventSerializer(event1)
         serializer2 = EventSerializer(event2)
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_filter_events_before_date(self):
         """Test returning events with a date no superior than the specified"""
@@ -291,8 +343,8 @@ class TestEvents(TestCase):
         )
         serializer1 = EventSerializer(event1)
         serializer2 = EventSerializer(event2)
-        self.assertNotIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
+        self.assertNotIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
 
     def test_filter_events_in_date_range(self):
         """Test returning events with a date no superior than the specified"""
@@ -326,9 +378,9 @@ class TestEvents(TestCase):
         serializer2 = EventSerializer(event2)
         serializer3 = EventSerializer(event3)
         # Test that only the event between the dates is in the response
-        self.assertNotIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertNotIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
+        self.assertNotIn(serializer3.data, res.data['results'])
 
     def test_filter_events_categories(self):
         """Test returning events with category specified"""
@@ -364,8 +416,8 @@ class TestEvents(TestCase):
         )
         serializer1 = EventSerializer(event1)
         serializer2 = EventSerializer(event2)
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_filter_events_multiple_categories(self):
         """Test returning events with category specified"""
@@ -420,10 +472,10 @@ class TestEvents(TestCase):
         serializer2 = EventSerializer(event2)
         serializer3 = EventSerializer(event3)
         # Check that wanted events are in the response
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
         # Check that unwanted event is not in response data
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertNotIn(serializer3.data, res.data['results'])
 
     def test_filter_events_multiple_tags(self):
         """Test returning events with tags specified"""
@@ -478,10 +530,10 @@ class TestEvents(TestCase):
         serializer2 = EventSerializer(event2)
         serializer3 = EventSerializer(event3)
         # Check that wanted events are in the response
-        self.assertIn(serializer1.data, res.data)
-        self.assertIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertIn(serializer2.data, res.data['results'])
         # Check that unwanted event is not in response data
-        self.assertNotIn(serializer3.data, res.data)
+        self.assertNotIn(serializer3.data, res.data['results'])
 
     def test_invalid_schedule(self):
         self.client.force_login(self.winery_user)
@@ -708,8 +760,8 @@ class TestEvents(TestCase):
         serializer1 = EventSerializer(event1)
         serializer2 = EventSerializer(event2)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
 
     def test_restaurants_endpoint(self):
         """Test that the endpoint only returns events with restaurant categories"""
@@ -736,8 +788,28 @@ class TestEvents(TestCase):
         serializer1 = EventSerializer(event1)
         serializer2 = EventSerializer(event2)
 
-        self.assertIn(serializer1.data, res.data)
-        self.assertNotIn(serializer2.data, res.data)
+        self.assertIn(serializer1.data, res.data['results'])
+        self.assertNotIn(serializer2.data, res.data['results'])
+
+    def test_event_kind_follows_categories(self):
+        event = Event.objects.create(name='Evento', description='Desc 1', winery=self.winery, price=0.0)
+        event.categories.add(self.category1, self.category_restaurant)
+        event.refresh_from_db()
+        self.assertEqual(event.kind, EVENT_KIND_RESTAURANT)
+
+        event.categories.remove(self.category_restaurant)
+        event.refresh_from_db()
+        self.assertEqual(event.kind, EVENT_KIND_EVENT)
+
+        self.category1.event_set.clear()
+        self.category_restaurant.event_set.add(event)
+        event.refresh_from_db()
+        self.assertEqual(event.kind, EVENT_KIND_RESTAURANT)
+
+        self.category_restaurant.name = 'Tasting'
+        self.category_restaurant.save()
+        event.refresh_from_db()
+        self.assertEqual(event.kind, EVENT_KIND_EVENT)
 
     def test_event_get_occurrences(self):
         event = Event.objects.create(name='Test Event', description='Desc 1', winery=self.winery, price=0.0)
@@ -751,7 +823,7 @@ class TestEvents(TestCase):
             reverse('event-occurrences-list', kwargs={'event_pk': event.id}),
         )
         serializer = EventOccurrenceSerializer(occurrence)
-        self.assertIn(serializer.data, res.data)
+        self.assertIn(serializer.data, res.data['results'])
 
     def test_event_occurrences_post(self):
         self.client.force_login(self.winery_user)
@@ -786,7 +858,7 @@ class TestEvents(TestCase):
             reverse('restaurant-occurrences-list', kwargs={'restaurant_pk': restaurant.id}),
         )
         serializer = EventOccurrenceSerializer(occurrence)
-        self.assertIn(serializer.data, res.data)
+        self.assertIn(serializer.data, res.data['results'])
 
     def test_restaurant_occurrences_post(self):
         self.client.force_login(self.winery_user)
@@ -846,3 +918,182 @@ class TestEvents(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('Invalid start date', response.data['errors']['schedule']['from_date'])
+
+    def test_event_list_query_count_does_not_grow_with_events(self):
+        tourist = WineUser.objects.create(
+            email='tourist@winecompanion.com',
+            gender=self.gender,
+            language=self.language,
+            phone='2616489179',
+            country=self.country,
+        )
+        tag = Tag.objects.create(name='tag1')
+
+        def create_events(amount):
+            for i in range(amount):
+                event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=0.0)
+                event.categories.add(self.category1)
+                event.tags.add(tag)
+                EventOccurrence.objects.create(
+                    start='2036-10-31T20:00:00',
+                    end='2036-10-31T23:00:00',
+                    vacancies=50,
+                    event=event
+                )
+                Rate.objects.create(event=event, user=tourist, rate=4, comment='Good')
+
+        def count_list_queries():
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('event-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(context.captured_queries)
+
+        self.client.force_login(tourist)
+        create_events(2)
+        few_events_queries = count_list_queries()
+        create_events(8)
+        many_events_queries = count_list_queries()
+        self.assertEqual(few_events_queries, many_events_queries)
+
+    def test_event_list_cursor_pagination(self):
+        events = []
+        for i in range(5):
+            event = Event.objects.create(name='Event {}'.format(i), description='Desc', winery=self.winery, price=0.0)
+            EventOccurrence.objects.create(
+                start='2036-10-{}T20:00:00'.format(25 - i),
+                end='2036-10-{}T23:00:00'.format(25 - i),
+                vacancies=50,
+                event=event
+            )
+            events.append(event)
+        # soonest first
+        events.reverse()
+
+        res = self.client.get(reverse('event-list'), {'page_size': 2})
+        self.assertEqual([event['id'] for event in res.data['results']], [events[0].id, events[1].id])
+        self.assertIsNone(res.data['previous'])
+
+        # removing an already listed row does not shift the following pages
+        expected = [event.id for event in events]
+        events[0].delete()
+        seen = [event['id'] for event in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            seen.extend(event['id'] for event in res.data['results'])
+        self.assertEqual(seen, expected)
+
+    def test_event_list_pages_through_events_starting_together(self):
+        events = []
+        for i in range(5):
+            event = Event.objects.create(name='Event {}'.format(i), description='Desc', winery=self.winery, price=0.0)
+            EventOccurrence.objects.create(
+                start='2036-10-25T20:00:00', end='2036-10-25T23:00:00', vacancies=50, event=event
+            )
+            events.append(event.id)
+
+        res = self.client.get(reverse('event-list'), {'page_size': 2})
+        seen = [event['id'] for event in res.data['results']]
+        while res.data['next']:
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(res.data['next'])
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+            seen.extend(event['id'] for event in res.data['results'])
+        self.assertEqual(seen, events)
+
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([event['id'] for event in res.data['results']], events[2:4])
+        res = self.client.get(reverse('event-list'), {'page_size': 2, 'search': 'Event'})
+        seen = [event['id'] for event in res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            seen.extend(event['id'] for event in res.data['results'])
+        self.assertEqual(sorted(seen), events)
+
+        res = self.client.get(reverse('event-list'), {'cursor': 'bm90IGpzb24='})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_next_occurrence_follows_occurrences(self):
+        event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=0.0)
+        later = EventOccurrence.objects.create(
+            start='2036-10-31T20:00:00', end='2036-10-31T23:00:00', vacancies=50, event=event
+        )
+        sooner = EventOccurrence.objects.create(
+            start='2036-10-01T20:00:00', end='2036-10-01T23:00:00', vacancies=50, event=event
+        )
+        EventOccurrence.objects.create(
+            start='2019-10-01T20:00:00', end='2019-10-01T23:00:00', vacancies=50, event=event
+        )
+        event.refresh_from_db()
+        self.assertEqual(event.next_occurrence_start, datetime(2036, 10, 1, 20))
+        self.assertEqual(event.open_occurrences_count, 2)
+
+        sooner.cancel()
+        event.refresh_from_db()
+        self.assertEqual(event.next_occurrence_start, datetime(2036, 10, 31, 20))
+        self.assertEqual(event.open_occurrences_count, 1)
+
+        # saving a stale instance keeps the stored values
+        event.next_occurrence_start = None
+        event.save()
+        event.refresh_from_db()
+        self.assertEqual(event.next_occurrence_start, datetime(2036, 10, 31, 20))
+
+        later.delete()
+        event.refresh_from_db()
+        self.assertIsNone(event.next_occurrence_start)
+        self.assertEqual(event.open_occurrences_count, 0)
+
+    def test_new_event_with_a_pk_is_inserted(self):
+        event = Event(pk=4242, name='Event', description='Desc', winery=self.winery, price=0.0)
+        event.save()
+        self.assertEqual(Event.objects.get(pk=4242).name, 'Event')
+
+    def test_refresh_next_occurrences_command_rolls_past_occurrences(self):
+        event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=0.0)
+        EventOccurrence.objects.create(
+            start='2036-10-31T20:00:00', end='2036-10-31T23:00:00', vacancies=50, event=event
+        )
+        # as left behind once its next occurrence has started
+        Event.objects.filter(pk=event.pk).update(next_occurrence_start=datetime(2019, 10, 1, 20))
+        self.assertNotIn(event.id, [e['id'] for e in self.client.get(reverse('event-list')).data['results']])
+
+        out = StringIO()
+        call_command('refresh_next_occurrences', stdout=out)
+        self.assertIn('Refreshed the next occurrence of 1 events', out.getvalue())
+        event.refresh_from_db()
+        self.assertEqual(event.next_occurrence_start, datetime(2036, 10, 31, 20))
+        self.assertIn(event.id, [e['id'] for e in self.client.get(reverse('event-list')).data['results']])
+
+    def test_events_with_later_occurrences_stay_listed_until_refreshed(self):
+        event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=0.0)
+        for day in (30, 31):
+            start = datetime(2036, 10, day, 20)
+            EventOccurrence.objects.create(start=start, end=start + timedelta(hours=3), vacancies=50, event=event)
+        # as left behind once the first of its occurrences has started
+        Event.objects.filter(pk=event.pk).update(next_occurrence_start=datetime(2019, 10, 1, 20))
+        self.assertIn(event.id, [e['id'] for e in self.client.get(reverse('event-list')).data['results']])
+        response = self.client.get(reverse('winery-events', kwargs={'pk': self.winery.id}))
+        self.assertIn(event.id, [e['id'] for e in response.data])
+
+    def test_event_list_sparse_fieldsets(self):
+        event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=0.0)
+        event.categories.add(self.category1)
+        EventOccurrence.objects.create(
+            start='2036-10-31T20:00:00',
+            end='2036-10-31T23:00:00',
+            vacancies=50,
+            event=event
+        )
+
+        with CaptureQueriesContext(connection) as full:
+            res = self.client.get(reverse('event-list'))
+        self.assertIn('occurrences', res.data['results'][0])
+
+        with CaptureQueriesContext(connection) as sparse:
+            res = self.client.get(reverse('event-list'), {'fields': 'id,name,price,winery,images'})
+        self.assertEqual(set(res.data['results'][0]), {'id', 'name', 'price', 'winery', 'images'})
+        self.assertLess(len(sparse), len(full))
+
+        res = self.client.get(reverse('event-list'), {'fields': 'id,name', 'expand': 'occurrences'})
+        self.assertEqual(set(res.data['results'][0]), {'id', 'name', 'occurrences'})
+        self.assertEqual(len(res.data['results'][0]['occurrences']), 1)
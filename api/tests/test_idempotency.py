@@ -0,0 +1,151 @@
+import threading
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from api.models import (
+    Country,
+    Event,
+    EventOccurrence,
+    Gender,
+    IdempotencyKey,
+    Language,
+    Reservation,
+    Winery,
+)
+from users.models import WineUser
+
+
+class IdempotencyFixtureMixin:
+    def create_fixture(self):
+        self.winery = Winery.objects.create(name='My Winery', description='Test Winery')
+        self.user = WineUser.objects.create_user(
+            email='user@user.com',
+            password='12345678',
+            gender=Gender.objects.create(name='Male'),
+            language=Language.objects.create(name='English'),
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=500.0)
+        start = datetime.now() + timedelta(days=1)
+        self.occurrence = EventOccurrence.objects.create(
+            start=start,
+            end=start + timedelta(hours=2),
+            vacancies=10,
+            event=self.event
+        )
+        self.data = {'attendee_number': 2, 'paid_amount': 1000, 'event_occurrence': self.occurrence.id}
+
+
+class TestIdempotencyKey(IdempotencyFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def post(self, data, key='retry-1'):
+        return self.client.post(reverse('reservations-list'), data, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post(self.data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        retry = self.post(self.data)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies, 8)
+
+    def test_requests_without_key_are_not_deduplicated(self):
+        self.client.post(reverse('reservations-list'), self.data)
+        self.client.post(reverse('reservations-list'), self.data)
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_different_keys_are_different_requests(self):
+        self.post(self.data, key='retry-1')
+        self.post(self.data, key='retry-2')
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    def test_reusing_key_for_other_payload_is_rejected(self):
+        self.post(self.data)
+        response = self.post(dict(self.data, attendee_number=3))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertIn('errors', response.json())
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_error_responses_are_replayed(self):
+        first = self.post(dict(self.data, attendee_number=20))
+        self.assertEqual(first.status_code, status.HTTP_400_BAD_REQUEST)
+        retry = self.post(dict(self.data, attendee_number=20))
+        self.assertEqual(retry.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_too_long_key_is_rejected(self):
+        response = self.post(self.data, key='k' * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Reservation.objects.exists())
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expired_key_is_processed_again(self):
+        self.post(self.data)
+        IdempotencyKey.objects.update(created=datetime.now() - timedelta(minutes=5))
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_purge_command_deletes_expired_keys(self):
+        self.post(self.data, key='old')
+        IdempotencyKey.objects.update(created=datetime.now() - timedelta(minutes=5))
+        self.post(self.data, key='new')
+
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 idempotency keys', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+class TestConcurrentIdempotencyKey(IdempotencyFixtureMixin, TransactionTestCase):
+    def test_concurrent_duplicates_book_once(self):
+        self.create_fixture()
+        responses = []
+
+        def post(client):
+            try:
+                while True:
+                    try:
+                        response = client.post(reverse('reservations-list'), self.data, HTTP_IDEMPOTENCY_KEY='retry-1')
+                    except OperationalError:
+                        # SQLite rejects concurrent writers instead of queueing them
+                        continue
+                    responses.append(response)
+                    break
+            finally:
+                connection.close()
+
+        clients = [Client() for _ in range(4)]
+        for client in clients:
+            client.force_login(self.user)
+        threads = [threading.Thread(target=post, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * 4)
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.occurrence.refresh_from_db()
+        self.assertEqual(self.occurrence.vacancies, 8)
@@ -0,0 +1,155 @@
+import json
+from datetime import datetime, timedelta
+
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from api import RESERVATION_CANCELLED
+from api.booking import book
+from api.live import LocalBroker, event_channel, get_broker, winery_channel
+from api.models import Country, Event, EventOccurrence, Gender, Language, Reservation, Winery
+from users.models import WineUser
+
+
+class LiveFixtureMixin:
+    def create_fixture(self):
+        self.winery = Winery.objects.create(name='My Winery', description='Test Winery', available_since=datetime.now())
+        self.user = WineUser.objects.create_user(
+            email='user@user.com',
+            password='12345678',
+            gender=Gender.objects.create(name='Male'),
+            language=Language.objects.create(name='English'),
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.event = Event.objects.create(name='Event', description='Desc', winery=self.winery, price=500.0)
+        start = datetime.now() + timedelta(days=1)
+        self.occurrence = EventOccurrence.objects.create(
+            start=start,
+            end=start + timedelta(hours=2),
+            vacancies=10,
+            event=self.event
+        )
+
+
+def events_of(chunks):
+    return [
+        json.loads(chunk.split('data: ', 1)[1])
+        for chunk in chunks if chunk.startswith('event: occurrence')
+    ]
+
+
+class TestLocalBroker(TestCase):
+    def test_messages_fan_out_to_the_channel_subscribers(self):
+        broker = LocalBroker()
+        event = broker.subscribe(['event:1'])
+        winery = broker.subscribe(['winery:1'])
+        other = broker.subscribe(['event:2'])
+
+        broker.publish(['event:1', 'winery:1'], {'occurrence': 1})
+        self.assertEqual(event.get(timeout=0), {'occurrence': 1})
+        self.assertEqual(winery.get(timeout=0), {'occurrence': 1})
+        self.assertIsNone(other.get(timeout=0))
+
+        event.close()
+        broker.publish(['event:1'], {'occurrence': 2})
+        self.assertIsNone(event.get(timeout=0))
+        self.assertEqual(broker.subscriptions.keys(), {'winery:1', 'event:2'})
+
+
+class TestLiveUpdatesFeed(LiveFixtureMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.event_updates = get_broker().subscribe([event_channel(self.event.id)])
+        self.winery_updates = get_broker().subscribe([winery_channel(self.winery.id)])
+
+    def tearDown(self):
+        self.event_updates.close()
+        self.winery_updates.close()
+
+    def test_booking_publishes_the_vacancies(self):
+        book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        expected = {'occurrence': self.occurrence.id, 'event': self.event.id, 'vacancies': 7, 'cancelled': None}
+        self.assertEqual(self.event_updates.get(timeout=1), expected)
+        self.assertEqual(self.winery_updates.get(timeout=1), expected)
+
+    def test_cancellations_publish_the_vacancies(self):
+        reservation = book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        self.event_updates.get(timeout=1)
+
+        reservation.cancel()
+        self.assertEqual(self.event_updates.get(timeout=1)['vacancies'], 10)
+
+        self.event.cancel()
+        message = self.event_updates.get(timeout=1)
+        self.assertEqual(message['occurrence'], self.occurrence.id)
+        self.assertIsNotNone(message['cancelled'])
+        self.assertFalse(Reservation.objects.exclude(status=RESERVATION_CANCELLED).exists())
+
+    @override_settings(SHARDED_VACANCIES_THRESHOLD=5, VACANCY_SHARDS=4)
+    def test_sharded_occurrences_publish_their_counters(self):
+        EventOccurrence.reshard(EventOccurrence.objects.filter(pk=self.occurrence.pk))
+        book(self.user.id, self.occurrence, 3, paid_amount=1500)
+        self.assertEqual(self.event_updates.get(timeout=1)['vacancies'], 7)
+        book(self.user.id, self.occurrence, 2, paid_amount=1000)
+        self.assertEqual(self.event_updates.get(timeout=1)['vacancies'], 5)
+        # Bookings only write the counters, not the occurrence row
+        self.occurrence.refresh_from_db()
+        self.assertTrue(self.occurrence.sharded)
+        self.assertEqual(self.occurrence.vacancies, 10)
+
+
+@override_settings(LIVE_UPDATES_MAX_SECONDS=0.3, LIVE_UPDATES_KEEPALIVE_SECONDS=0.1)
+class TestLiveUpdatesStream(LiveFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.client = Client()
+
+    def open_stream(self, url):
+        response = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        return (chunk.decode() for chunk in response.streaming_content)
+
+    def test_event_stream_starts_with_the_vacancies(self):
+        chunks = self.open_stream(reverse('event-live', kwargs={'pk': self.event.id}))
+        self.assertEqual(next(chunks), 'retry: 3000\n\n')
+        snapshot = next(chunks)
+        self.assertEqual(
+            events_of([snapshot]),
+            [{'occurrence': self.occurrence.id, 'event': self.event.id, 'vacancies': 10, 'cancelled': None}],
+        )
+
+        get_broker().publish([event_channel(self.event.id)], {'occurrence': self.occurrence.id, 'vacancies': 8})
+        rest = list(chunks)
+        self.assertEqual(events_of(rest), [{'occurrence': self.occurrence.id, 'vacancies': 8}])
+        self.assertIn(': keepalive\n\n', rest)
+        self.assertFalse(get_broker().subscriptions)
+
+    def test_winery_stream_includes_every_event(self):
+        other = Event.objects.create(name='Other', description='Desc', winery=self.winery, price=0.0)
+        start = datetime.now() + timedelta(days=2)
+        EventOccurrence.objects.create(start=start, end=start + timedelta(hours=1), vacancies=4, event=other)
+
+        chunks = list(self.open_stream(reverse('winery-live', kwargs={'pk': self.winery.id})))
+        self.assertEqual(sorted(message['event'] for message in events_of(chunks)), [self.event.id, other.id])
+
+    @override_settings(LIVE_UPDATES_MAX_STREAMS=1)
+    def test_streams_per_process_are_capped(self):
+        url = reverse('event-live', kwargs={'pk': self.event.id})
+        first = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        response = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '30')
+
+        # Closing the response frees its slot, even if it was never read
+        first.close()
+        response = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response.close()
+
+    def test_unknown_event_is_not_found(self):
+        response = self.client.get(reverse('event-live', kwargs={'pk': 999}), HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
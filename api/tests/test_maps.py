@@ -0,0 +1,259 @@
+import json
+from io import StringIO
+from unittest import mock
+
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase, TransactionTestCase
+
+from rest_framework import status
+
+from api import CLUSTER_MAX_ZOOM, CLUSTER_MIN_WINERIES
+from api.cache import get_version
+from api.clusters import CLUSTERS_VERSION_KEY, clear_cluster_cache, tile_bounds, tile_key, tile_of
+from api.models import ImagesWinery, Winery
+from api.proximity import bounding_box, get_proximity_backend, location_column
+
+# Mendoza city
+LONGITUDE, LATITUDE = -68.8458, -32.8895
+# Degrees of latitude in about 1 km
+KM = 1 / 111.2
+
+
+class TestNearestWineries(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.url = '/api/maps/'
+
+    def create_winery(self, name, north_km, east_km=0, approved=True):
+        return Winery.objects.create(
+            name=name,
+            description='Winery',
+            available_since='2019-10-01T00:00:00' if approved else None,
+            location=Point(LONGITUDE + east_km * KM * 1.19, LATITUDE + north_km * KM, srid=4326),
+        )
+
+    def search(self, **params):
+        params.setdefault('q', '{},{}'.format(LONGITUDE, LATITUDE))
+        return self.client.get(self.url, params)
+
+    def test_nearest_first_with_distance(self):
+        self.create_winery('Far', 40)
+        self.create_winery('Near', 1)
+        self.create_winery('Middle', 0, east_km=12)
+        response = self.search()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([winery['name'] for winery in response.data], ['Near', 'Middle', 'Far'])
+        self.assertAlmostEqual(response.data[0]['distance'], 1, delta=0.05)
+        self.assertAlmostEqual(response.data[1]['distance'], 12, delta=0.5)
+        self.assertAlmostEqual(response.data[2]['distance'], 40, delta=1)
+        self.assertIn('wine_lines', response.data[0])
+
+    def test_limit_and_radius(self):
+        for distance in (30, 10, 20, 90, 150):
+            self.create_winery('{} km'.format(distance), distance)
+        response = self.search(limit=2)
+        self.assertEqual([winery['name'] for winery in response.data], ['10 km', '20 km'])
+        response = self.search(r=50)
+        self.assertEqual([winery['name'] for winery in response.data], ['10 km', '20 km', '30 km'])
+        response = self.search()
+        self.assertEqual(len(response.data), 4)
+        response = self.search(r=1e9)
+        self.assertEqual(len(response.data), 5)
+
+    def test_only_approved_wineries_with_location(self):
+        self.create_winery('Pending', 1, approved=False)
+        Winery.objects.create(name='Nowhere', description='Winery', available_since='2019-10-01T00:00:00')
+        self.create_winery('Approved', 2)
+        response = self.search()
+        self.assertEqual([winery['name'] for winery in response.data], ['Approved'])
+
+    def test_sparse_fields(self):
+        self.create_winery('Near', 1)
+        response = self.search(fields='id,name,distance')
+        self.assertEqual([set(winery) for winery in response.data], [{'id', 'name', 'distance'}])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.search(q='nowhere').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.search(limit=0).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.search(r='far').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.search(q='1,b').status_code, status.HTTP_400_BAD_REQUEST)
+        for radius in ('inf', 'nan', '-1'):
+            self.assertEqual(self.search(r=radius).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def features(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        collection = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        return collection['features']
+
+    def test_geojson_features(self):
+        far = self.create_winery('Far', 40)
+        near = self.create_winery('Near', 1)
+        ImagesWinery.objects.create(winery=near, filefield='thumbnail.jpg')
+        ImagesWinery.objects.create(winery=near, filefield='other.jpg')
+        self.create_winery('Pending', 2, approved=False)
+        features = self.features(self.search(format='geojson'))
+        self.assertEqual([feature['id'] for feature in features], [near.id, far.id])
+        self.assertEqual(features[0]['geometry'], {'type': 'Point', 'coordinates': list(near.location.coords)})
+        self.assertEqual(features[0]['properties']['name'], 'Near')
+        self.assertEqual(features[0]['properties']['thumbnail'], '/media/thumbnail.jpg')
+        self.assertAlmostEqual(features[0]['properties']['distance'], 1, delta=0.05)
+        self.assertIsNone(features[1]['properties']['thumbnail'])
+
+        query = {'q': '{},{}'.format(LONGITUDE, LATITUDE)}
+        response = self.client.get(self.url, query, HTTP_ACCEPT='application/geo+json')
+        self.assertEqual(len(self.features(response)), 2)
+        self.assertEqual(self.features(self.search(format='geojson', r=0.5)), [])
+        self.assertEqual(self.search(format='geojson', limit=0).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cached_json_is_not_served_as_geojson(self):
+        self.create_winery('Near', 1)
+        response = self.search()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(self.search()['X-Cache'], 'HIT')
+
+        query = {'q': '{},{}'.format(LONGITUDE, LATITUDE)}
+        response = self.client.get(self.url, query, HTTP_ACCEPT='application/geo+json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([feature['properties']['name'] for feature in self.features(response)], ['Near'])
+
+    def test_geojson_read_in_chunks(self):
+        for distance in (5, 1, 4, 2, 3):
+            self.create_winery('{} km'.format(distance), distance)
+        with mock.patch('api.geojson.GEOJSON_CHUNK_SIZE', 2):
+            features = self.features(self.search(format='geojson'))
+        names = [feature['properties']['name'] for feature in features]
+        self.assertEqual(names, ['1 km', '2 km', '3 km', '4 km', '5 km'])
+
+    def test_same_wineries_as_measuring_all(self):
+        # Wineries far beyond the first bounding box, in every direction
+        for number in range(12):
+            self.create_winery(str(number), (number - 6) * 7, east_km=(number % 5 - 2) * 9)
+        point = Point(LONGITUDE, LATITUDE, srid=4326)
+        distance = get_proximity_backend(connection).distance(location_column(Winery.objects.all()), point)
+        everything = list(
+            Winery.objects.annotate(distance=distance).order_by('distance').values_list('name', flat=True)
+        )
+        for limit in (1, 3, 12):
+            found = Winery.get_nearest_wineries(point.wkt, limit, 100)
+            self.assertEqual([winery.name for winery in found], everything[:limit])
+
+    def test_bounding_box(self):
+        min_x, min_y, max_x, max_y = bounding_box(Point(LONGITUDE, LATITUDE), 10000)
+        self.assertAlmostEqual(max_y - LATITUDE, 0.09, places=2)
+        self.assertGreater(max_x - LONGITUDE, max_y - LATITUDE)
+        self.assertEqual(bounding_box(Point(0, 89.9), 100000)[::2], (-180, 180))
+
+    def test_benchmark_nearest_command(self):
+        out = StringIO()
+        call_command('benchmark_nearest', wineries=200, repeat=2, stdout=out)
+        self.assertIn('faster', out.getvalue())
+        self.assertFalse(Winery.objects.exists())
+
+
+class MapClustersMixin:
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.url = '/api/maps/clusters/'
+        self.box = '-69.5,-33.5,-68.3,-32.5'
+
+    def create_winery(self, name, north_km, east_km=0, approved=True):
+        return Winery.objects.create(
+            name=name,
+            description='Winery',
+            available_since='2019-10-01T00:00:00' if approved else None,
+            location=Point(LONGITUDE + east_km * KM * 1.19, LATITUDE + north_km * KM, srid=4326),
+        )
+
+    def clusters(self, zoom, bbox=None):
+        response = self.client.get(self.url, {'bbox': bbox or self.box, 'zoom': zoom})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+
+class TestMapClusters(MapClustersMixin, TestCase):
+    def test_dense_wineries_clustered(self):
+        for number in range(CLUSTER_MIN_WINERIES):
+            self.create_winery(str(number), number * 0.1)
+        lonely = self.create_winery('Lonely', -40)
+        self.create_winery('Pending', -40.1, approved=False)
+
+        data = self.clusters(zoom=8)
+        self.assertEqual(len(data['clusters']), 1)
+        cluster = data['clusters'][0]
+        self.assertEqual(cluster['count'], CLUSTER_MIN_WINERIES)
+        self.assertAlmostEqual(cluster['centroid'][0], LONGITUDE)
+        self.assertAlmostEqual(cluster['centroid'][1], LATITUDE + 0.2 * KM)
+        self.assertEqual([winery['id'] for winery in data['wineries']], [lonely.id])
+        self.assertAlmostEqual(data['wineries'][0]['location'][1], LATITUDE - 40 * KM)
+
+        data = self.clusters(zoom=CLUSTER_MAX_ZOOM + 2, bbox='-68.85,-32.89,-68.84,-32.88')
+        self.assertEqual(data['zoom'], CLUSTER_MAX_ZOOM)
+        self.assertEqual(data['clusters'], [])
+        self.assertEqual(len(data['wineries']), CLUSTER_MIN_WINERIES)
+
+    def test_tiles(self):
+        x, y = tile_of(LONGITUDE, LATITUDE, 10)
+        min_x, min_y, max_x, max_y = tile_bounds(10, x, y)
+        self.assertTrue(min_x <= LONGITUDE < max_x and min_y < LATITUDE <= max_y)
+        self.assertEqual(tile_of(-180, 85, 3), (0, 0))
+        self.assertEqual(tile_of(180, -85, 3), (7, 7))
+
+    def test_tiles_cached(self):
+        winery = self.create_winery('Winery', 0)
+        self.assertEqual(len(self.clusters(zoom=8)['wineries']), 1)
+        # Updates skip the signals, the cached tiles are kept
+        Winery.objects.filter(pk=winery.pk).update(location=Point(0, 0, srid=4326))
+        self.assertEqual(len(self.clusters(zoom=8)['wineries']), 1)
+        clear_cluster_cache()
+        self.assertEqual(self.clusters(zoom=8)['wineries'], [])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        for params in (
+            {'bbox': '-69.5,-33.5,-68.3', 'zoom': 8},
+            {'bbox': 'a,b,c,d', 'zoom': 8},
+            {'bbox': '-68.3,-33.5,-69.5,-32.5', 'zoom': 8},
+            {'bbox': self.box, 'zoom': -1},
+            {'bbox': self.box, 'zoom': 'far'},
+            {'bbox': '-180,-85,180,85', 'zoom': 10},
+        ):
+            self.assertEqual(self.client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestMapClustersInvalidation(MapClustersMixin, TransactionTestCase):
+    def test_tiles_dropped_when_wineries_move_or_get_approved(self):
+        winery = self.create_winery('Winery', 0)
+        pending = self.create_winery('Pending', 1, approved=False)
+        self.assertEqual(len(self.clusters(zoom=8)['wineries']), 1)
+
+        pending.available_since = '2019-10-01T00:00:00'
+        pending.save()
+        self.assertEqual(len(self.clusters(zoom=8)['wineries']), 2)
+
+        winery.location = Point(0, 0, srid=4326)
+        winery.save()
+        self.assertEqual([winery['id'] for winery in self.clusters(zoom=8)['wineries']], [pending.id])
+        self.assertEqual(len(self.clusters(zoom=8, bbox='-1,-1,1,1')['wineries']), 1)
+
+        pending.delete()
+        self.assertEqual(self.clusters(zoom=8)['wineries'], [])
+
+    def test_tiles_dropped_once_the_change_commits(self):
+        winery = self.create_winery('Winery', 0)
+        self.clusters(zoom=8)
+        key = tile_key(get_version(CLUSTERS_VERSION_KEY), 8, *tile_of(LONGITUDE, LATITUDE, 8))
+        with transaction.atomic():
+            winery.location = Point(0, 0, srid=4326)
+            winery.save()
+            self.assertIsNotNone(cache.get(key))
+        self.assertIsNone(cache.get(key))
@@ -0,0 +1,201 @@
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.html import escape
+from rest_framework import status
+
+from api import MAIL_CLAIM_LEASE, MAIL_MAX_ATTEMPTS, MAIL_RETRY_BACKOFF
+from api.models import Country, Gender, Language, Mail, OutboxMail, Reservation
+from api.tests.test_cancellation import CancellationFixtureMixin
+
+
+class CountingBackend(EmailBackend):
+    connections = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CountingBackend.connections += 1
+
+
+class FlakyBackend(EmailBackend):
+    def send_messages(self, messages):
+        if any('fail' in message.to[0] for message in messages):
+            raise ConnectionError('Connection refused')
+        return super().send_messages(messages)
+
+
+def queue_mails(*recipients):
+    Mail.send_mass_mail(
+        ('Subject', 'user_registration_template.html', {'user': 'User', 'url': 'http://x'}, recipient)
+        for recipient in recipients
+    )
+
+
+def send_outbox(**options):
+    out = StringIO()
+    call_command('send_outbox', stdout=out, **options)
+    return out.getvalue()
+
+
+@override_settings(SEND_EMAILS=True)
+class TestOutbox(TestCase):
+    @override_settings(SEND_EMAILS=False)
+    def test_nothing_is_queued_when_emails_are_disabled(self):
+        Mail.send_mail('Subject', 'user_registration_template.html', {}, ['user@test.com'])
+        self.assertFalse(OutboxMail.objects.exists())
+
+    def test_send_mail_only_queues(self):
+        Mail.send_mail('Subject', 'reset_password_template.html', {'user': 'Ana'}, ['a@test.com', 'b@test.com'])
+        self.assertEqual(sorted(OutboxMail.objects.values_list('recipient', flat=True)), ['a@test.com', 'b@test.com'])
+        self.assertEqual(len(mail.outbox), 0)
+
+        send_outbox()
+        self.assertEqual(len(mail.outbox), 2)
+        message = mail.outbox[0]
+        self.assertEqual(message.subject, 'Subject')
+        self.assertIn('Ana', message.body)
+        self.assertEqual(message.alternatives[0][1], 'text/html')
+        self.assertFalse(OutboxMail.pending().filter(sent__isnull=True).exists())
+
+    @override_settings(EMAIL_BACKEND='api.tests.test_outbox.CountingBackend')
+    def test_batches_reuse_one_connection(self):
+        queue_mails(*['user{}@test.com'.format(number) for number in range(25)])
+        CountingBackend.connections = 0
+
+        out = send_outbox(batch_size=10)
+        self.assertEqual(CountingBackend.connections, 1)
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertIn('Sent 25 mails, 0 failed', out)
+        self.assertIn('0 pending', out)
+
+    @override_settings(EMAIL_BACKEND='api.tests.test_outbox.FlakyBackend')
+    def test_failures_are_retried_with_backoff(self):
+        queue_mails('ok@test.com', 'fail@test.com')
+
+        out = send_outbox()
+        self.assertIn('Sent 1 mails, 1 failed', out)
+        self.assertIn('1 pending (0 due', out)
+        failed = OutboxMail.objects.get(recipient='fail@test.com')
+        self.assertIsNone(failed.sent)
+        self.assertEqual(failed.attempts, 1)
+        self.assertEqual(failed.last_error, 'Connection refused')
+        self.assertAlmostEqual(
+            failed.next_attempt, datetime.now() + timedelta(seconds=MAIL_RETRY_BACKOFF), delta=timedelta(seconds=5)
+        )
+
+        # not due yet
+        self.assertIn('Sent 0 mails, 0 failed', send_outbox())
+
+        for attempt in range(2, MAIL_MAX_ATTEMPTS + 1):
+            OutboxMail.objects.filter(pk=failed.pk).update(next_attempt=datetime.now())
+            send_outbox()
+            failed.refresh_from_db()
+            self.assertEqual(failed.attempts, attempt)
+        self.assertGreater(failed.retry_delay(), timedelta(seconds=MAIL_RETRY_BACKOFF))
+
+        OutboxMail.objects.filter(pk=failed.pk).update(next_attempt=datetime.now())
+        out = send_outbox()
+        self.assertIn('Sent 0 mails, 0 failed', out)
+        self.assertIn('1 given up', out)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_crashed_worker_leaves_sent_mails_recorded(self):
+        queue_mails('first@test.com', 'second@test.com')
+        with mock.patch('api.outbox.deliver', side_effect=[None, SystemExit]):
+            with self.assertRaises(SystemExit):
+                send_outbox()
+        first = OutboxMail.objects.get(recipient='first@test.com')
+        self.assertIsNotNone(first.sent)
+        second = OutboxMail.objects.get(recipient='second@test.com')
+        self.assertIsNone(second.sent)
+        self.assertEqual(second.attempts, 1)
+        self.assertAlmostEqual(
+            second.next_attempt, datetime.now() + timedelta(seconds=MAIL_CLAIM_LEASE), delta=timedelta(seconds=5)
+        )
+
+        # leased until the lease runs out
+        self.assertIn('Sent 0 mails, 0 failed', send_outbox())
+        OutboxMail.objects.filter(pk=second.pk).update(next_attempt=datetime.now())
+        self.assertIn('Sent 1 mails, 0 failed', send_outbox())
+        self.assertEqual([message.to for message in mail.outbox], [['second@test.com']])
+
+    def test_user_registration_queues_the_activation_mail(self):
+        data = {
+            'email': 'example@winecompanion.com',
+            'password': 'testuserpass',
+            'first_name': 'First Name',
+            'last_name': 'Last Name',
+            'gender': Gender.objects.create(name='Other').id,
+            'language': Language.objects.create(name='English').id,
+            'phone': '2616489178',
+            'country': Country.objects.create(name='Argentina').id,
+        }
+        response = self.client.post(reverse('users-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboxMail.objects.get()
+        self.assertEqual(queued.recipient, 'example@winecompanion.com')
+        self.assertEqual(queued.subject, 'Winecompanion - Activate Account')
+
+        send_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('confirm/', mail.outbox[0].alternatives[0][0])
+
+
+@override_settings(SEND_EMAILS=True)
+class TestRescheduleNotifications(CancellationFixtureMixin, TestCase):
+    def setUp(self):
+        self.create_fixture()
+        self.client.force_login(self.winery_user)
+
+    def reschedule(self, occurrence, days):
+        start = occurrence.start + timedelta(days=days)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                reverse('event-occurrences-detail', kwargs={'event_pk': self.event.id, 'pk': occurrence.id}),
+                {'start': start.isoformat(), 'end': (start + timedelta(hours=2)).isoformat()},
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_the_reservations(self):
+        few, many = self.create_occurrences(1, 1), self.create_occurrences(1, 12, days=5)
+        self.assertEqual(self.reschedule(few[0], 1), self.reschedule(many[0], 1))
+        self.assertEqual(OutboxMail.objects.filter(subject='Winecompanion Reservation Date Modified').count(), 13)
+
+    def test_cancelled_reservations_are_not_notified(self):
+        occurrence = self.create_occurrences(1, 3)[0]
+        occurrence.reservation_set.first().cancel()
+        OutboxMail.objects.all().delete()
+
+        self.reschedule(occurrence, 1)
+        self.assertEqual(OutboxMail.objects.count(), 2)
+
+    def test_shared_body_is_rendered_once(self):
+        occurrence = self.create_occurrences(1, 4)[0]
+        # a second reservation of the same user gets the same mail
+        user = occurrence.reservation_set.first().user
+        Reservation.objects.create(attendee_number=1, paid_amount=500, user=user, event_occurrence=occurrence)
+        user.first_name = 'Ana & <Bob>'
+        user.save()
+        self.reschedule(occurrence, 1)
+
+        with mock.patch('api.outbox.render_to_string', wraps=render_to_string) as render:
+            send_outbox()
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        first_names = dict(Reservation.objects.values_list('user__email', 'user__first_name'))
+        for message in mail.outbox:
+            self.assertEqual(message.subject, 'Winecompanion Reservation Date Modified')
+            self.assertIn('<h2>{},</h2>'.format(escape(first_names[message.to[0]])), message.alternatives[0][0])
+        self.assertEqual(sum('Ana &amp; &lt;Bob&gt;' in message.body for message in mail.outbox), 2)
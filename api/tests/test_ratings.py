@@ -1,3 +1,7 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import Avg
 from django.test import TestCase, Client
 from django.urls import reverse
 
@@ -130,3 +134,54 @@ class TestRatings(TestCase):
             reverse('event-detail', kwargs={'pk': self.event.id}),
         )
         self.assertIsNone(response.data.get('current_user_rating'))
+
+    def assertRatingAggregatesAreConsistent(self):
+        self.event.refresh_from_db()
+        expected = Rate.objects.filter(event=self.event).aggregate(Avg('rate'))['rate__avg']
+        self.assertEqual(self.event.rating_count, Rate.objects.filter(event=self.event).count())
+        self.assertEqual(self.event.average_rating, expected)
+
+    def test_rating_aggregates_follow_rate_changes(self):
+        other_user = WineUser.objects.create_user(
+            email='other@test.com',
+            password='abcd',
+            first_name='Other',
+            last_name='User',
+            gender=self.gender,
+            language=self.language,
+            country=self.country,
+        )
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse('event-ratings-list', kwargs={'event_pk': self.event.id}),
+            self.valid_rate_json_data
+        )
+        self.assertRatingAggregatesAreConsistent()
+
+        other_rate = Rate.objects.create(event=self.event, user=other_user, rate=5, comment='Great')
+        self.assertRatingAggregatesAreConsistent()
+
+        rate = Rate.objects.get(event=self.event, user=self.user)
+        response = self.client.patch(
+            reverse('event-ratings-detail', kwargs={'event_pk': self.event.id, 'pk': rate.id}),
+            {'rate': 1},
+            content_type='application/json'
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertRatingAggregatesAreConsistent()
+
+        response = self.client.delete(
+            reverse('event-ratings-detail', kwargs={'event_pk': self.event.id, 'pk': rate.id}),
+        )
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        self.assertRatingAggregatesAreConsistent()
+
+        other_rate.delete()
+        self.assertRatingAggregatesAreConsistent()
+        self.assertIsNone(self.event.average_rating)
+
+    def test_rebuild_event_ratings_command(self):
+        Rate.objects.create(**self.valid_rate_creation_data)
+        Event.objects.filter(pk=self.event.pk).update(rating_sum=0, rating_count=0)
+        call_command('rebuild_event_ratings', stdout=StringIO())
+        self.assertRatingAggregatesAreConsistent()
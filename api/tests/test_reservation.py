@@ -208,7 +208,7 @@ class TestReservation(TestCase):
         response = self.client.get(
             reverse('users-reservations')
         )
-        self.assertDictContainsSubset({'id': reservation.id}, response.data[0])
+        self.assertDictContainsSubset({'id': reservation.id}, response.data['results'][0])
 
     def test_get_user_reservations_not_logged_in(self):
         Reservation.objects.create(**self.valid_creation_data)
@@ -0,0 +1,95 @@
+from datetime import date, datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from api.models import Country, Event, EventCategory, EventSchedule, Gender, Language, Winery
+from api.serializers import EventSerializer
+from users.models import WineUser
+
+EVERY_DAY = list(range(7))
+
+
+@override_settings(SCHEDULE_HORIZON_DAYS=14, SCHEDULE_PREVIEW_DAYS=28)
+class TestEventSchedules(TestCase):
+    def setUp(self):
+        self.winery = Winery.objects.create(
+            name='Bodega1',
+            description='Hola',
+            available_since=datetime.now(),
+        )
+        self.winery_user = WineUser.objects.create(
+            email='testuser@winecompanion.com',
+            winery=self.winery,
+            gender=Gender.objects.create(name='Other'),
+            language=Language.objects.create(name='English'),
+            phone='2616489178',
+            country=Country.objects.create(name='Argentina'),
+        )
+        self.category = EventCategory.objects.create(name='Tour')
+        self.tomorrow = date.today() + timedelta(days=1)
+        self.client = Client()
+
+    def create_event(self, from_date, to_date=None, weekdays=EVERY_DAY):
+        self.client.force_login(self.winery_user)
+        data = {
+            'name': 'Tour',
+            'description': 'Recorrido',
+            'vacancies': 10,
+            'price': 500.0,
+            'categories': [{'name': self.category.name}],
+            'schedule': [{
+                'from_date': from_date.isoformat(),
+                'to_date': to_date.isoformat() if to_date else None,
+                'start_time': '15:30:00',
+                'end_time': '16:30:00',
+                'weekdays': weekdays,
+            }],
+        }
+        response = self.client.post(reverse('event-list'), data=data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.logout()
+        return Event.objects.get()
+
+    def test_open_ended_schedule_is_materialized_up_to_the_horizon(self):
+        event = self.create_event(self.tomorrow)
+        horizon = date.today() + timedelta(days=14)
+
+        dates = [occurrence.start.date() for occurrence in event.occurrences.order_by('start')]
+        self.assertEqual(dates[0], self.tomorrow)
+        self.assertEqual(dates[-1], horizon)
+        self.assertEqual(EventSchedule.objects.get().materialized_until, horizon)
+
+        # later dates are listed without being stored
+        occurrences = EventSerializer(event).data['occurrences']
+        self.assertEqual(len(occurrences), 28)
+        self.assertEqual([occurrence['id'] for occurrence in occurrences[len(dates):]], [None] * (28 - len(dates)))
+
+    def test_materialize_schedules_command_moves_the_horizon(self):
+        event = self.create_event(self.tomorrow, to_date=self.tomorrow + timedelta(days=19))
+        self.assertEqual(event.occurrences.count(), 14)
+
+        out = StringIO()
+        with override_settings(SCHEDULE_HORIZON_DAYS=28):
+            call_command('materialize_schedules', stdout=out)
+            self.assertIn('Created 6 occurrences', out.getvalue())
+            call_command('materialize_schedules', stdout=out)
+            self.assertIn('Created 0 occurrences', out.getvalue())
+
+        event.refresh_from_db()
+        self.assertEqual(event.occurrences.count(), 20)
+        self.assertEqual(event.open_occurrences_count, 20)
+        last_occurrence = EventSerializer(event).data['occurrences'][-1]
+        self.assertEqual(last_occurrence['start'][:10], event.schedules.get().to_date.isoformat())
+
+    def test_schedule_past_the_horizon_writes_its_first_week(self):
+        from_date = self.tomorrow + timedelta(days=100)
+        event = self.create_event(from_date, weekdays=[from_date.weekday()])
+
+        self.assertEqual([occurrence.start.date() for occurrence in event.occurrences.all()], [from_date])
+        self.assertEqual(event.next_occurrence_start.date(), from_date)
+        res = self.client.get(reverse('event-list'))
+        self.assertEqual([listed['id'] for listed in res.data['results']], [event.id])
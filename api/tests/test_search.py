@@ -0,0 +1,95 @@
+from datetime import datetime
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from api import SEARCH_DOCUMENT_EVENT
+from api.models import Event, EventCategory, EventOccurrence, SearchDocument, Tag, Winery
+
+
+class TestFullTextSearch(TestCase):
+    def setUp(self):
+        # Nothing commits in these tests, so the catalog version never moves
+        cache.clear()
+        self.winery = Winery.objects.create(
+            name='Bodega Catena',
+            description='Viñedos en altura',
+            available_since=datetime.now(),
+        )
+        self.other_winery = Winery.objects.create(
+            name='Otra bodega',
+            description='Vinos de Luján',
+            available_since=datetime.now(),
+        )
+        self.client = Client()
+
+    def create_event(self, name, description, winery=None):
+        event = Event.objects.create(name=name, description=description, winery=winery or self.winery, price=0.0)
+        EventOccurrence.objects.create(
+            start='2036-10-31T20:00:00',
+            end='2036-10-31T23:00:00',
+            vacancies=50,
+            event=event
+        )
+        return event
+
+    def search_events(self, query):
+        res = self.client.get(reverse('event-list'), {'search': query})
+        return [event['id'] for event in res.data['results']]
+
+    def test_events_are_ranked_by_relevance(self):
+        in_description = self.create_event('Almuerzo', 'Almuerzo y degustación de malbec')
+        in_name = self.create_event('Degustación de malbec', 'Vinos de la casa')
+        self.create_event('Tour', 'Recorrido por la bodega')
+
+        self.assertEqual(self.search_events('malbec'), [in_name.id, in_description.id])
+
+    def test_search_ignores_accents_and_matches_prefixes(self):
+        event = self.create_event('Degustación', 'Vinos')
+        self.assertEqual(self.search_events('degustacion'), [event.id])
+        self.assertEqual(self.search_events('degus'), [event.id])
+        self.assertEqual(self.search_events('degustación "OR" -'), [])
+
+    def test_search_covers_winery_tags_and_categories(self):
+        event = self.create_event('Tour', 'Recorrido')
+        other_event = self.create_event('Tour', 'Recorrido', winery=self.other_winery)
+        event.tags.add(Tag.objects.create(name='Familiar'))
+        event.categories.add(EventCategory.objects.create(name='Cata'))
+
+        self.assertEqual(self.search_events('catena'), [event.id])
+        self.assertEqual(self.search_events('familiar'), [event.id])
+        self.assertEqual(self.search_events('cata tour'), [event.id])
+        self.assertEqual(sorted(self.search_events('tour')), [event.id, other_event.id])
+
+    def test_documents_follow_catalog_changes(self):
+        event = self.create_event('Tour', 'Recorrido')
+        self.winery.name = 'Zuccardi'
+        self.winery.save()
+        self.assertEqual(self.search_events('zuccardi'), [event.id])
+
+        tag = Tag.objects.create(name='Familiar')
+        event.tags.add(tag)
+        tag.name = 'Nocturno'
+        tag.save()
+        self.assertEqual(self.search_events('familiar'), [])
+        self.assertEqual(self.search_events('nocturno'), [event.id])
+
+        event.delete()
+        self.assertFalse(SearchDocument.objects.filter(kind=SEARCH_DOCUMENT_EVENT, object_id=event.id).exists())
+
+    def test_search_wineries(self):
+        res = self.client.get(reverse('winery-list'), {'search': 'lujan'})
+        self.assertEqual([winery['id'] for winery in res.data['results']], [self.other_winery.id])
+
+    def test_rebuild_search_index_command(self):
+        event = self.create_event('Tour', 'Recorrido')
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self.search_events('tour'), [])
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 3 documents', out.getvalue())
+        self.assertEqual(self.search_events('tour'), [event.id])
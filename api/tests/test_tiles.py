@@ -0,0 +1,240 @@
+import os
+import shutil
+import struct
+import tempfile
+from datetime import datetime, timedelta
+
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from rest_framework import status
+
+from api.clusters import tile_of, tile_position
+from api.models import Event, EventOccurrence, Winery
+from api.mvt import encode_tile
+from api.tiles import clear_vector_tiles, invalidate_vector_tiles, tile_path, tile_versions
+
+# Mendoza city
+LONGITUDE, LATITUDE = -68.8458, -32.8895
+ZOOM = 12
+
+
+def read_varint(data, position):
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        value |= (byte & 0x7f) << shift
+        position += 1
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def read_fields(data):
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, position = read_varint(data, position)
+        elif wire_type == 1:
+            value, position = data[position:position + 8], position + 8
+        else:
+            length, position = read_varint(data, position)
+            value, position = data[position:position + length], position + length
+        yield field, value
+
+
+def read_packed(data):
+    values, position = [], 0
+    while position < len(data):
+        value, position = read_varint(data, position)
+        values.append(value)
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_value(data):
+    field, value = next(read_fields(data))
+    return {
+        1: lambda: value.decode(),
+        3: lambda: struct.unpack('<d', value)[0],
+        5: lambda: value,
+        6: lambda: unzigzag(value),
+        7: lambda: bool(value),
+    }[field]()
+
+
+def decode_tile(data):
+    """{layer name: (extent, [((x, y), attributes)])} of a tile of points."""
+    layers = {}
+    for _, layer_data in read_fields(data):
+        layer = {'features': [], 'keys': [], 'values': []}
+        for field, value in read_fields(layer_data):
+            if field == 1:
+                layer['name'] = value.decode()
+            elif field == 2:
+                layer['features'].append(dict(read_fields(value)))
+            elif field == 3:
+                layer['keys'].append(value.decode())
+            elif field == 4:
+                layer['values'].append(decode_value(value))
+            elif field == 5:
+                layer['extent'] = value
+        features = []
+        for feature in layer['features']:
+            assert feature[3] == 1
+            command, x, y = read_packed(feature[4])
+            assert command == 9
+            tags = read_packed(feature.get(2, b''))
+            attributes = {layer['keys'][key]: layer['values'][value] for key, value in zip(tags[::2], tags[1::2])}
+            features.append(((unzigzag(x), unzigzag(y)), attributes))
+        layers[layer['name']] = (layer['extent'], features)
+    return layers
+
+
+class VectorTilesMixin:
+    def setUp(self):
+        cache.clear()
+        self.tiles_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tiles_root, ignore_errors=True)
+        settings_override = override_settings(VECTOR_TILES_ROOT=self.tiles_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = Client()
+        self.x, self.y = tile_of(LONGITUDE, LATITUDE, ZOOM)
+        self.url = '/api/tiles/{}/{}/{}.mvt'.format(ZOOM, self.x, self.y)
+
+    def create_winery(self, name, longitude=LONGITUDE, latitude=LATITUDE, approved=True):
+        return Winery.objects.create(
+            name=name,
+            description='Winery',
+            available_since='2019-10-01T00:00:00' if approved else None,
+            location=Point(longitude, latitude, srid=4326),
+        )
+
+    def create_event(self, winery, days):
+        event = Event.objects.create(name='Event', description='Event', winery=winery, price=0.0)
+        start = datetime.now() + timedelta(days=days)
+        EventOccurrence.objects.create(start=start, end=start + timedelta(hours=2), vacancies=10, event=event)
+        return event
+
+    def get_features(self, **headers):
+        response = self.client.get(self.url, **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        layers = decode_tile(response.content)
+        if not layers:
+            return []
+        extent, features = layers['wineries']
+        self.assertEqual(extent, 4096)
+        return features
+
+
+class TestVectorTiles(VectorTilesMixin, TestCase):
+    def test_tile_of_approved_wineries(self):
+        winery = self.create_winery('Winery')
+        self.create_event(winery, days=3)
+        self.create_event(winery, days=10)
+        self.create_event(winery, days=-3)
+        self.create_winery('Pending', approved=False)
+        self.create_winery('Elsewhere', longitude=LONGITUDE + 1)
+
+        features = self.get_features()
+        self.assertEqual(len(features), 1)
+        (x, y), attributes = features[0]
+        self.assertEqual(attributes, {'id': winery.id, 'name': 'Winery', 'upcoming_events': 2})
+        position_x, position_y = tile_position(LONGITUDE, LATITUDE, ZOOM)
+        self.assertEqual((x, y), (round((position_x - self.x) * 4096), round((position_y - self.y) * 4096)))
+
+    def test_cached_on_disk_with_etag(self):
+        winery = self.create_winery('Winery')
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(os.path.exists(tile_path(ZOOM, self.x, self.y, tile_versions(ZOOM, self.x, self.y))))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        # Updates skip the signals, the tile on disk is kept
+        Winery.objects.filter(pk=winery.pk).update(name='Renamed')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        clear_vector_tiles()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(decode_tile(response.content)['wineries'][1][0][1]['name'], 'Renamed')
+
+    @override_settings(VECTOR_TILES_MAX_AGE=0)
+    def test_expired_tiles_rebuilt(self):
+        self.create_winery('Winery')
+        self.get_features()
+        Winery.objects.update(name='Renamed')
+        self.assertEqual(self.get_features()[0][1]['name'], 'Renamed')
+
+    def test_only_tiles_with_wineries_are_written(self):
+        self.assertEqual(self.get_features(), [])
+        self.assertEqual(os.listdir(self.tiles_root), [])
+        self.assertIsNone(tile_versions(ZOOM, self.x, self.y, create=False)[1])
+
+        self.create_winery('Winery')
+        x, y = tile_of(LONGITUDE, LATITUDE, 16)
+        self.assertEqual(self.client.get('/api/tiles/16/{}/{}.mvt'.format(x, y)).status_code, status.HTTP_200_OK)
+        self.assertEqual(os.listdir(self.tiles_root), [])
+        self.assertEqual(len(self.get_features()), 1)
+        self.assertEqual(len(os.listdir(self.tiles_root)), 1)
+
+    def test_invalidation_is_shared_through_the_cache(self):
+        winery = self.create_winery('Winery')
+        self.get_features()
+        path = tile_path(ZOOM, self.x, self.y, tile_versions(ZOOM, self.x, self.y))
+        # A save handled by another process only drops the version
+        Winery.objects.filter(pk=winery.pk).update(name='Renamed')
+        invalidate_vector_tiles([winery.location])
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.get_features()[0][1]['name'], 'Renamed')
+        self.assertFalse(os.path.exists(path))
+
+    def test_invalid_tiles(self):
+        self.assertEqual(self.client.get('/api/tiles/19/0/0.mvt').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/tiles/2/4/0.mvt').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/tiles/2/0/-1.mvt').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_encode_tile(self):
+        attributes = {'int': 300, 'negative': -2, 'float': 1.5, 'bool': True, 'text': 'Malbec', 'missing': None}
+        tile = encode_tile({'points': [((10, -5), attributes), ((4096, 0), {'int': 300, 'one': 1})], 'none': []}, 512)
+        extent, features = decode_tile(tile)['points']
+        self.assertEqual(extent, 512)
+        del attributes['missing']
+        self.assertEqual(features[0], ((10, -5), attributes))
+        self.assertEqual(features[1], ((4096, 0), {'int': 300, 'one': 1}))
+        self.assertEqual(encode_tile({'none': []}, 512), b'')
+
+
+class TestVectorTilesInvalidation(VectorTilesMixin, TransactionTestCase):
+    def test_tiles_dropped_when_wineries_or_events_are_saved(self):
+        winery = self.create_winery('Winery')
+        pending = self.create_winery('Pending', approved=False)
+        self.assertEqual(len(self.get_features()), 1)
+
+        winery.name = 'Renamed'
+        winery.save()
+        self.assertEqual(self.get_features()[0][1]['name'], 'Renamed')
+
+        event = self.create_event(winery, days=3)
+        self.assertEqual(self.get_features()[0][1]['upcoming_events'], 1)
+        event.occurrences.update(start=datetime.now() - timedelta(days=1))
+        Event.refresh_next_occurrences()
+        event.save()
+        self.assertEqual(self.get_features()[0][1]['upcoming_events'], 0)
+
+        pending.available_since = datetime.now()
+        pending.save()
+        self.assertEqual(len(self.get_features()), 2)
+
+        winery.location = Point(0, 0, srid=4326)
+        winery.save()
+        self.assertEqual([attributes['name'] for _, attributes in self.get_features()], ['Pending'])
@@ -1,16 +1,21 @@
+from django.core.cache import cache
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.core.exceptions import ValidationError
+from django.db import connection
 
 from rest_framework import status
 
 from users.models import WineUser
-from api.models import Country, Winery, WineLine, Wine, Gender, Language, Varietal
+from api.models import Country, ImagesWinery, ImagesWines, Winery, WineLine, Wine, Gender, Language, Varietal
 from api.serializers import WinerySerializer, WineLineSerializer, WineSerializer
 
 
 class TestWinery(TestCase):
     def setUp(self):
+        # Nothing commits in these tests, so the catalog version never moves
+        cache.clear()
         self.gender = Gender.objects.create(name='Other')
         self.language = Language.objects.create(name='English')
         self.valid_winery_data = {
@@ -52,6 +57,77 @@ class TestWinery(TestCase):
         )
         self.assertEqual(status.HTTP_200_OK, response.status_code)
 
+    def test_winery_endpoint_sparse_fieldsets(self):
+        Winery.objects.create(available_since='2019-10-01T00:00:00', **self.valid_winery_data)
+        response = self.client.get(reverse('winery-list'), {'fields': 'id,name'})
+        self.assertEqual([set(winery) for winery in response.data['results']], [{'id', 'name'}])
+        response = self.client.get(reverse('winery-list'), {'fields': 'id', 'expand': 'wine_lines'})
+        self.assertEqual([set(winery) for winery in response.data['results']], [{'id', 'wine_lines'}])
+        # Without `fields` the whole winery is serialized, catalog and contact included
+        full = {'id', 'name', 'description', 'website', 'wine_lines', 'location', 'contact', 'images'}
+        response = self.client.get(reverse('winery-list'))
+        self.assertEqual([set(winery) for winery in response.data['results']], [full])
+        response = self.client.get(reverse('winery-list'), {'expand': 'wine_lines'})
+        self.assertEqual([set(winery) for winery in response.data['results']], [full])
+
+    def test_winery_list_queries_do_not_grow_with_catalog(self):
+        country = Country.objects.create(name='Argentina')
+        varietal = Varietal.objects.create(value='Malbec')
+        admin = WineUser.objects.create_superuser(
+            email='admin@admin.com',
+            password='12345678',
+            first_name='User',
+            last_name='Test',
+            gender=self.gender.id,
+            language=self.language.id,
+            country=country.id,
+        )
+
+        def create_wineries(amount, approved):
+            for number in range(amount):
+                winery = Winery.objects.create(
+                    name='Winery {}'.format(number),
+                    description='Test',
+                    available_since='2019-10-01T00:00:00' if approved else None,
+                )
+                ImagesWinery.objects.create(winery=winery, filefield='winery.jpg')
+                WineUser.objects.create(
+                    email='owner{}@winecompanion.com'.format(winery.id),
+                    winery=winery,
+                    gender=self.gender,
+                    language=self.language,
+                    country=country,
+                )
+                for line_number in range(2):
+                    wine_line = WineLine.objects.create(name='Line', description='Line', winery=winery)
+                    for _ in range(3):
+                        wine = Wine.objects.create(
+                            name='Wine', description='Wine', winery=winery, varietal=varietal, wine_line=wine_line,
+                        )
+                        ImagesWines.objects.create(wine=wine, filefield='wine.jpg')
+
+        def count_list_queries(url):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(context.captured_queries)
+
+        self.client.force_login(admin)
+        create_wineries(1, approved=True)
+        create_wineries(1, approved=False)
+        few_queries = [count_list_queries(reverse(name)) for name in ('winery-list', 'approve-wineries-list')]
+        create_wineries(4, approved=True)
+        create_wineries(4, approved=False)
+        many_queries = [count_list_queries(reverse(name)) for name in ('winery-list', 'approve-wineries-list')]
+        self.assertEqual(few_queries, many_queries)
+
+        response = self.client.get(reverse('winery-list'))
+        winery = response.data['results'][0]
+        self.assertEqual(winery['contact']['email'], 'owner{}@winecompanion.com'.format(winery['id']))
+        self.assertEqual(winery['images'], ['/media/winery.jpg'])
+        self.assertEqual(winery['wine_lines'][0]['wines'][0]['varietal'], 'Malbec')
+        self.assertEqual(winery['wine_lines'][0]['wines'][0]['images'], ['/media/wine.jpg'])
+
     def test_winery_endpoint_create_should_not_be_allowed(self):
         data = self.valid_winery_data
         response = self.client.post(
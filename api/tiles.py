@@ -0,0 +1,223 @@
+"""Mapbox Vector Tiles of the approved wineries, cached on disk.
+
+Each tile has a `wineries` layer with a point per approved winery and its
+id, name and number of upcoming events. PostGIS builds the tiles with
+ST_AsMVT, other databases project the points here and encode them with
+`api.mvt`.
+
+Tiles holding wineries are written under VECTOR_TILES_ROOT up to
+VECTOR_TILES_CACHE_MAX_ZOOM, so the files are bounded by the wineries
+rather than by what clients ask for. Each process has its own files, named
+after a version of the tile kept in the shared cache: saving a winery or
+event drops the versions of its tiles, which every process then rebuilds.
+Tiles are also rebuilt after VECTOR_TILES_MAX_AGE seconds, as upcoming
+events run out with time.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import Count, Q
+from rest_framework.renderers import BaseRenderer
+
+from . import VECTOR_TILE_EXTENT, VECTOR_TILES_CACHE_MAX_ZOOM, VECTOR_TILES_LAYER
+from .cache import bump_version, get_version
+from .clusters import tile_bounds, tile_of, tile_position
+from .models import Winery
+from .mvt import encode_tile
+from .proximity import in_box
+
+VECTOR_TILES_VERSION_KEY = 'api:vector-tiles-version'
+
+# Half the width of the web mercator plane, in meters
+MERCATOR_ORIGIN = 20037508.342789244
+
+
+class VectorTileRenderer(BaseRenderer):
+    """Lets clients ask for vector tiles; errors are sent as JSON."""
+    media_type = 'application/vnd.mapbox-vector-tile'
+    format = 'mvt'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data)
+
+
+def mercator_bounds(zoom, x, y):
+    """(min_x, min_y, max_x, max_y) of a tile in web mercator meters."""
+    size = 2 * MERCATOR_ORIGIN / 2 ** zoom
+    return (
+        -MERCATOR_ORIGIN + x * size,
+        MERCATOR_ORIGIN - (y + 1) * size,
+        -MERCATOR_ORIGIN + (x + 1) * size,
+        MERCATOR_ORIGIN - y * size,
+    )
+
+
+def tile_wineries(zoom, x, y, now):
+    """Approved wineries that may fall in the tile, with their upcoming
+    events counted."""
+    approved = Winery.objects.filter(available_since__isnull=False)
+    return (
+        in_box(approved, tile_bounds(zoom, x, y))
+        .annotate(upcoming_events=Count('events', filter=Q(events__next_occurrence_start__gt=now)))
+        .order_by('pk')
+        .values('id', 'name', 'location', 'upcoming_events')
+    )
+
+
+class PostgisTileBackend:
+    """ST_AsMVT over the wineries of the tile, clipped by ST_AsMVTGeom."""
+
+    def render(self, zoom, x, y, now):
+        wineries = tile_wineries(zoom, x, y, now)
+        sql, params = wineries.query.get_compiler(wineries.db).as_sql()
+        envelope = 'ST_MakeEnvelope(%s, %s, %s, %s, 3857)'
+        tile_sql = (
+            'SELECT ST_AsMVT(tile, %s, %s, \'geom\') FROM ('
+            'SELECT id, name, upcoming_events, '
+            'ST_AsMVTGeom(ST_Transform(ST_SetSRID(winery.location::geometry, 4326), 3857), {}, %s, 0, true) AS geom '
+            'FROM ({}) AS winery) AS tile WHERE geom IS NOT NULL'
+        ).format(envelope, sql)
+        tile_params = [VECTOR_TILES_LAYER, VECTOR_TILE_EXTENT, *mercator_bounds(zoom, x, y), VECTOR_TILE_EXTENT]
+        with connections[wineries.db].cursor() as cursor:
+            cursor.execute(tile_sql, tile_params + list(params))
+            tile = cursor.fetchone()[0]
+        return bytes(tile or b'')
+
+
+class PythonTileBackend:
+    """Points projected to tile coordinates and encoded by `api.mvt`."""
+
+    def render(self, zoom, x, y, now):
+        features = []
+        for winery in tile_wineries(zoom, x, y, now):
+            position_x, position_y = tile_position(winery['location'].x, winery['location'].y, zoom)
+            # The box lookup may return wineries just across the tile edges
+            if (int(position_x), int(position_y)) != (x, y):
+                continue
+            point = round((position_x - x) * VECTOR_TILE_EXTENT), round((position_y - y) * VECTOR_TILE_EXTENT)
+            attributes = {'id': winery['id'], 'name': winery['name'], 'upcoming_events': winery['upcoming_events']}
+            features.append((point, attributes))
+        return encode_tile({VECTOR_TILES_LAYER: features}, VECTOR_TILE_EXTENT)
+
+
+TILE_BACKENDS = {
+    'postgresql': PostgisTileBackend,
+    'sqlite': PythonTileBackend,
+}
+
+
+def get_tile_backend(connection):
+    try:
+        return TILE_BACKENDS[connection.vendor]()
+    except KeyError:
+        raise ImproperlyConfigured('Vector tiles are not available on {}'.format(connection.vendor))
+
+
+def tile_version_key(zoom, x, y):
+    return 'api:vector-tile-version:{}:{}:{}'.format(zoom, x, y)
+
+
+def tile_versions(zoom, x, y, create=True):
+    """Versions of every tile and of this one, from the shared cache. The
+    version of the tile is None while it has none and `create` is False."""
+    key = tile_version_key(zoom, x, y)
+    versions = cache.get_many([VECTOR_TILES_VERSION_KEY, key])
+    version = versions.get(key)
+    if version is None and create:
+        version = get_version(key)
+    return versions.get(VECTOR_TILES_VERSION_KEY) or get_version(VECTOR_TILES_VERSION_KEY), version
+
+
+def tile_path(zoom, x, y, versions):
+    all_version, version = versions
+    return os.path.join(settings.VECTOR_TILES_ROOT, str(all_version), str(zoom), str(x), '{}.{}.mvt'.format(y, version))
+
+
+def tile_etag(tile):
+    return '"{}"'.format(hashlib.md5(tile).hexdigest())
+
+
+def read_tile(path):
+    try:
+        if time.time() - os.path.getmtime(path) < settings.VECTOR_TILES_MAX_AGE:
+            with open(path, 'rb') as tile_file:
+                return tile_file.read()
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def write_tile(path, versions, tile):
+    all_version_root = os.path.join(settings.VECTOR_TILES_ROOT, str(versions[0]))
+    if not os.path.isdir(all_version_root):
+        # Every tile got a new version, the files of the older ones go
+        os.makedirs(all_version_root, exist_ok=True)
+        remove_files(
+            os.path.join(settings.VECTOR_TILES_ROOT, name)
+            for name in os.listdir(settings.VECTOR_TILES_ROOT)
+            if name != str(versions[0])
+        )
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Written aside and moved in place, so readers never get half a tile
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as tile_file:
+        tile_file.write(tile)
+    os.replace(tile_file.name, path)
+    # Older versions of the same tile
+    y = os.path.basename(path).split('.')[0]
+    remove_files(older for older in glob.glob(os.path.join(directory, '{}.*.mvt'.format(y))) if older != path)
+
+
+def get_tile(zoom, x, y):
+    """(tile, etag) of a tile, read from disk unless missing or expired.
+    Only tiles with wineries, up to VECTOR_TILES_CACHE_MAX_ZOOM, are kept,
+    and only those get a version in the shared cache."""
+    cached = zoom <= VECTOR_TILES_CACHE_MAX_ZOOM
+    if cached:
+        versions = tile_versions(zoom, x, y, create=False)
+        tile = read_tile(tile_path(zoom, x, y, versions)) if versions[1] is not None else None
+        if tile is not None:
+            return tile, tile_etag(tile)
+
+    tile = get_tile_backend(connections[Winery.objects.db]).render(zoom, x, y, datetime.now())
+    if cached and tile:
+        versions = tile_versions(zoom, x, y)
+        write_tile(tile_path(zoom, x, y, versions), versions, tile)
+    return tile, tile_etag(tile)
+
+
+def invalidate_vector_tiles(points):
+    """Drops the versions of the tiles holding any of `points`, at every
+    cached zoom, so that every process rebuilds them."""
+    cache.delete_many([
+        tile_version_key(zoom, *tile_of(point.x, point.y, zoom))
+        for point in points
+        for zoom in range(VECTOR_TILES_CACHE_MAX_ZOOM + 1)
+    ])
+
+
+def clear_vector_tiles():
+    """Drops every tile, for changes made without signals."""
+    bump_version(VECTOR_TILES_VERSION_KEY)
+    shutil.rmtree(settings.VECTOR_TILES_ROOT, ignore_errors=True)
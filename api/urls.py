@@ -10,6 +10,7 @@ from api.views import (
     EventReservationsView,
     EventOccurrencesView,
     FileUploadView,
+    MapClustersView,
     MapsView,
     RatingView,
     ReportsView,
@@ -19,6 +20,7 @@ from api.views import (
     TagView,
     VarietalView,
     WineryView,
+    WineryTilesView,
     WineLineView,
     WineView,
     GenderView,
@@ -103,6 +105,8 @@ urlpatterns = [
     path('', include(restaurant_reservations_router.urls)),
     path('', include(restaurant_ratings_router.urls)),
     path('maps/', MapsView.as_view()),
+    path('maps/clusters/', MapClustersView.as_view(), name='map-clusters'),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', WineryTilesView.as_view(), name='winery-tiles'),
     path('reports/reservations/', ReportsView.as_view(), name='reservation-count-reports'),
     path('upload/', FileUploadView.as_view()),
 ]
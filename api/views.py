@@ -1,3 +1,4 @@
+import math
 from datetime import (
     date,
     datetime,
@@ -8,6 +9,8 @@ from django.db.models import (
     Avg,
     Case,
     Count,
+    ExpressionWrapper,
+    FloatField,
     IntegerField,
     F,
     Sum,
@@ -23,21 +26,40 @@ from django_filters import (
     ModelMultipleChoiceFilter,
 )
 from django_filters.rest_framework import DjangoFilterBackend
+from django.contrib.gis.geos import GEOSException
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import filters
+from django.utils.http import parse_etags
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
 from . import (
     DEFAULT_CANCELLATION_REASON,
+    EVENT_KIND_EVENT,
+    EVENT_KIND_RESTAURANT,
+    LIVE_STREAMS_RETRY_AFTER,
+    MAX_NEAREST_FEATURES,
+    MAX_NEAREST_WINERIES,
+    MAX_NEAREST_WINERIES_RADIUS,
+    NEAREST_WINERIES_LIMIT,
+    NEAREST_WINERIES_RADIUS,
+    VECTOR_TILES_MAX_ZOOM,
 )
+from .cache import cache_anonymous_response
+from .clusters import get_clusters
+from .filters import FullTextSearchFilter
+from .geojson import GeoJSONRenderer, geojson_response, nearby_winery_features
+from .idempotency import idempotent
+from .live import EventStreamRenderer, event_channel, limited_stream, winery_channel
+from .tiles import VectorTileRenderer, get_tile
 from users.permissions import (
     AdminOnly,
     AdminOrReadOnly,
@@ -49,6 +71,10 @@ from users.permissions import (
     ListAdminOnly,
     LoginRequiredToEdit,
 )
+from .pagination import (
+    EventPagination,
+    KeysetPagination,
+)
 from .models import (
     Country,
     Event,
@@ -73,9 +99,11 @@ from .serializers import (
     EventOccurrenceSerializer,
     EventSerializer,
     RateSerializer,
+    ReservationBatchSerializer,
     ReservationSerializer,
     TagSerializer,
     WinerySerializer,
+    NearbyWinerySerializer,
     WineLineSerializer,
     WineSerializer,
     FileSerializer,
@@ -88,7 +116,7 @@ from .serializers import (
 class EventFilter(FilterSet):
     # https://django-filter.readthedocs.io/en/latest/guide/usage.html#declaring-filters
 
-    start = DateTimeFromToRangeFilter(field_name="occurrences__start")
+    start = DateTimeFromToRangeFilter(field_name="occurrences__start", distinct=True)
     category = ModelMultipleChoiceFilter(
         field_name="categories__name",
         to_field_name="name",
@@ -103,13 +131,29 @@ class EventFilter(FilterSet):
         fields = ["occurrences__start", "category", "tag"]
 
 
+def live_response(channels, occurrences):
+    """Stream of the vacancies of the occurrences and their later changes."""
+    events = limited_stream(channels, occurrences)
+    if events is None:
+        return Response(
+            {"errors": "Too many live streams, retry later."},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={'Retry-After': str(LIVE_STREAMS_RETRY_AFTER)},
+        )
+    response = StreamingHttpResponse(events, content_type=EventStreamRenderer.media_type)
+    response['Cache-Control'] = 'no-cache'
+    # Keeps nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class EventsView(viewsets.ModelViewSet):
 
     serializer_class = EventSerializer
+    pagination_class = EventPagination
 
     # search elements (must use search= as query params)
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
-    search_fields = ["name", "description"]
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
 
     # filter elements (must use field= as query params )
     filterset_class = EventFilter
@@ -117,6 +161,19 @@ class EventsView(viewsets.ModelViewSet):
     permission_classes = [AllowWineryOwnerOrReadOnly & CreateOnlyIfWineryApproved]
     http_method_names = ['get', 'post', 'patch', 'head', 'options', 'trace']
 
+    @cache_anonymous_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_cursor_ordering(self):
+        if FullTextSearchFilter.get_search_words(self.request):
+            return FullTextSearchFilter.ordering
+        # Owners also list events without upcoming occurrences, which have no next start
+        if getattr(self.request.user, 'winery', None):
+            return ('id',)
+        return EventPagination.ordering
+
+    @idempotent
     def create(self, request):
         serializer = self.get_serializer(data=request.data)
         if not serializer.is_valid():
@@ -138,72 +195,106 @@ class EventsView(viewsets.ModelViewSet):
             return Response({'detail': 'Access Denied'}, status=status.HTTP_403_FORBIDDEN)
         try:
             reason = request.data.get('reason', DEFAULT_CANCELLATION_REASON)
-            message = event.cancel(reason)
-            return Response({'detail': message}, status=status.HTTP_200_OK)
+            cancelled = event.cancel(reason)
+            return Response(
+                {'detail': 'The event has been cancelled', 'cancelled': cancelled},
+                status=status.HTTP_200_OK,
+            )
         except Exception:
             return Response(
                 {"errors": "Bad Request."}, status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=True, methods=['get'], name='live-event', renderer_classes=[EventStreamRenderer])
+    def live(self, request, pk):
+        event = get_object_or_404(Event, id=pk)
+        occurrences = EventOccurrence.objects.filter(event=event, start__gt=datetime.now(), cancelled__isnull=True)
+        return live_response([event_channel(event.id)], occurrences)
+
     def get_queryset(self):
         if getattr(self.request.user, 'winery', None):
             own_events = Event.objects.filter(
                 winery=self.request.user.winery.id,
-            ).exclude(categories__name__icontains='restaurant').distinct()
-            return own_events
+                kind=EVENT_KIND_EVENT,
+            )
+            return EventSerializer.setup_eager_loading(own_events, self.request)
 
         all_events = Event.objects.filter(
-            occurrences__start__gt=datetime.now(),
-            occurrences__cancelled__isnull=True,
+            Event.upcoming(),
             cancelled__isnull=True,
-        ).exclude(categories__name__icontains='restaurant').distinct()
-        return all_events
+            kind=EVENT_KIND_EVENT,
+        )
+        return EventSerializer.setup_eager_loading(all_events, self.request)
 
 
 class WineryView(viewsets.ModelViewSet):
     queryset = Winery.objects.filter(available_since__isnull=False)
     serializer_class = WinerySerializer
+    pagination_class = KeysetPagination
 
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
-    search_fields = ["name", "description"]
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
     http_method_names = ['get', 'patch', 'head', 'options', 'trace']
 
     permission_classes = [AllowWineryOwnerOrReadOnly]
 
+    def get_queryset(self):
+        return WinerySerializer.setup_eager_loading(super().get_queryset(), self.request)
+
+    @cache_anonymous_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_cursor_ordering(self):
+        if FullTextSearchFilter.get_search_words(self.request):
+            return FullTextSearchFilter.ordering
+        return None
+
+    @action(detail=True, methods=['get'], name='live-winery', renderer_classes=[EventStreamRenderer])
+    def live(self, request, pk):
+        winery = get_object_or_404(Winery, id=pk, available_since__isnull=False)
+        occurrences = EventOccurrence.objects.filter(
+            event__winery=winery,
+            start__gt=datetime.now(),
+            cancelled__isnull=True,
+        )
+        return live_response([winery_channel(winery.id)], occurrences)
+
     @action(detail=True, methods=['get'], name='get-winery-events')
     def events(self, request, pk=None):
         events = Event.objects.filter(
-            occurrences__start__gt=datetime.now(),
+            Event.upcoming(),
             winery=pk,
             cancelled__isnull=True,
-        ).exclude(categories__name__icontains='restaurant').distinct()
+            kind=EVENT_KIND_EVENT,
+        )
 
         own_events = None
         if getattr(request.user, 'winery', None) and request.user.winery.id == int(pk):
             own_events = Event.objects.filter(
                 winery=pk,
-            ).exclude(categories__name__icontains='restaurant').distinct()
-        query = events | own_events if own_events else events
-        event_list = EventSerializer(query, many=True)
+                kind=EVENT_KIND_EVENT,
+            )
+        query = events | own_events if own_events is not None else events
+        event_list = EventSerializer(EventSerializer.setup_eager_loading(query), many=True)
         return Response(event_list.data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['get'], name='get-winery-restaurants')
     def restaurants(self, request, pk=None):
         restaurants = Event.objects.filter(
-            occurrences__start__gt=datetime.now(),
-            categories__name__icontains='restaurant',
+            Event.upcoming(),
+            kind=EVENT_KIND_RESTAURANT,
             winery=pk,
             cancelled__isnull=True,
-        ).distinct()
+        )
 
         own_restaurants = None
         if getattr(request.user, 'winery', None) and request.user.winery.id == int(pk):
             own_restaurants = Event.objects.filter(
                 winery=pk,
-                categories__name__icontains='restaurant',
-            ).distinct()
-        query = restaurants | own_restaurants if own_restaurants else restaurants
-        restaurants_list = EventSerializer(query, many=True)
+                kind=EVENT_KIND_RESTAURANT,
+            )
+        query = restaurants | own_restaurants if own_restaurants is not None else restaurants
+        restaurants_list = EventSerializer(EventSerializer.setup_eager_loading(query), many=True)
         return Response(restaurants_list.data, status=status.HTTP_200_OK)
 
 
@@ -238,7 +329,7 @@ class WineView(viewsets.ModelViewSet):
         winery = get_object_or_404(Winery, id=self.kwargs["winery_pk"])
         if wine_line.winery.id != winery.id:
             raise PermissionDenied(detail="winery and wine line don't match")
-        return Wine.objects.filter(wine_line=wine_line.id)
+        return WineSerializer.setup_eager_loading(Wine.objects.filter(wine_line=wine_line.id))
 
 
 class WineLineView(viewsets.ModelViewSet):
@@ -265,24 +356,79 @@ class WineLineView(viewsets.ModelViewSet):
 
     def get_queryset(self):
         winery = get_object_or_404(Winery, id=self.kwargs["winery_pk"])
-        return WineLine.objects.filter(winery=winery.id)
+        return WineLineSerializer.setup_eager_loading(WineLine.objects.filter(winery=winery.id))
 
 
 class MapsView(APIView):
+    """Nearest approved wineries to `q`, or only their pins as a streamed
+    GeoJSON FeatureCollection with `?format=geojson`."""
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [GeoJSONRenderer]
+
+    @cache_anonymous_response
     def get(self, request, *args, **kwargs):
         q = request.GET.get("q")
-        r = request.GET.get("r")
-        if r is None:
-            r = 100
+        r = request.GET.get("r", NEAREST_WINERIES_RADIUS)
+        limit = request.GET.get("limit", NEAREST_WINERIES_LIMIT)
+        geojson = request.accepted_renderer.format == GeoJSONRenderer.format
         try:
             q = "POINT({})".format(q.replace(",", " "))
-            queryset = Winery.get_nearly_wineries(q, r)
-            serializer = WinerySerializer(queryset, many=True)
-            return Response(serializer.data)
-        except Exception:
+            r = float(r)
+            limit = min(int(limit), MAX_NEAREST_FEATURES if geojson else MAX_NEAREST_WINERIES)
+            if not math.isfinite(r) or r <= 0 or limit <= 0:
+                raise ValueError
+            r = min(r, MAX_NEAREST_WINERIES_RADIUS)
+            if geojson:
+                distances = Winery.get_nearest_winery_distances(q, limit, r)
+            else:
+                queryset = WinerySerializer.setup_eager_loading(Winery.objects.all(), request)
+                wineries = Winery.get_nearest_wineries(q, limit, r, queryset=queryset)
+        except (AttributeError, ValueError, GEOSException):
+            return Response(
+                {"errors": "Invalid Request."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if geojson:
+            return geojson_response(nearby_winery_features(Winery.objects.all(), distances))
+        serializer = NearbyWinerySerializer(wineries, many=True, context={'request': request})
+        return Response(serializer.data)
+
+
+class MapClustersView(APIView):
+    """Approved wineries in the tiles covering `bbox`, as clusters with
+    their count, centroid and bounds where they are dense at `zoom`."""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            box = [float(value) for value in request.GET["bbox"].split(",")]
+            zoom = int(request.GET["zoom"])
+            min_x, min_y, max_x, max_y = box
+            if not (-180 <= min_x <= max_x <= 180 and -90 <= min_y <= max_y <= 90) or zoom < 0:
+                raise ValueError
+            clusters = get_clusters(Winery.objects.filter(available_since__isnull=False), box, zoom)
+        except (KeyError, ValueError):
             return Response(
                 {"errors": "Invalid Request."}, status=status.HTTP_400_BAD_REQUEST
             )
+        return Response(clusters)
+
+
+class WineryTilesView(APIView):
+    """Vector tile of the approved wineries and their upcoming events."""
+    renderer_classes = [VectorTileRenderer] + api_settings.DEFAULT_RENDERER_CLASSES
+
+    def get(self, request, z, x, y):
+        if z > VECTOR_TILES_MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            return Response(
+                {"errors": "Invalid tile."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        tile, etag = get_tile(z, x, y)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(tile, content_type=VectorTileRenderer.media_type)
+        response['ETag'] = etag
+        # Cached by clients, but checked against the ETag on every use
+        response['Cache-Control'] = 'no-cache'
+        return response
 
 
 class TagView(viewsets.ModelViewSet):
@@ -395,24 +541,37 @@ class ReservationView(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated & ListAdminOnly & AllowCreateButUpdateOwnerOnly]
     http_method_names = ['get', 'post', 'head', 'options', 'trace']
 
+    @idempotent
     def create(self, request):
         serializer = self.get_serializer(data=request.data)
         if not serializer.is_valid():
             return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-        reservation = serializer.create(serializer.validated_data, request.user.id)
-
-        # get event occurrency and decrement vacancies
-        event_occurrence = get_object_or_404(
-            EventOccurrence, pk=request.data["event_occurrence"]
-        )
-        event_occurrence.vacancies -= int(request.data["attendee_number"])
-        event_occurrence.save()
+        try:
+            reservation = serializer.create(serializer.validated_data, request.user.id)
+        except ValidationError as error:
+            return Response({'errors': error.detail}, status=status.HTTP_400_BAD_REQUEST)
         return Response(
             {"url": reverse("reservations-detail", args=[reservation.id])},
             status=status.HTTP_201_CREATED,
         )
 
+    @action(detail=False, methods=['post'], name='batch-reservations')
+    @idempotent
+    def batch(self, request):
+        serializer = ReservationBatchSerializer(data=request.data, context=self.get_serializer_context())
+        if not serializer.is_valid():
+            return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            reservations = serializer.create(serializer.validated_data, request.user.id)
+        except ValidationError as error:
+            return Response({'errors': error.detail}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {'reservations': [{'url': reverse('reservations-detail', args=[r.id])} for r in reservations]},
+            status=status.HTTP_201_CREATED,
+        )
+
     @action(detail=True, methods=['post'], name='cancel-reservation')
     def cancel_reservation(self, request, pk):
         reservation = get_object_or_404(Reservation, id=pk)
@@ -431,6 +590,7 @@ class ReservationView(viewsets.ModelViewSet):
 class RatingView(viewsets.ModelViewSet):
     serializer_class = RateSerializer
     model_class = Rate
+    pagination_class = KeysetPagination
 
     permission_classes = [LoginRequiredToEdit & IsOwnerOrReadOnly]
 
@@ -496,26 +656,26 @@ class RestaurantsView(EventsView):
 
     def get_queryset(self):
         all_restaurants = Event.objects.filter(
-            occurrences__start__gt=datetime.now(),
-            occurrences__cancelled__isnull=True,
-            categories__name__icontains='restaurant',
+            Event.upcoming(),
+            kind=EVENT_KIND_RESTAURANT,
             cancelled__isnull=True,
-        ).distinct()
+        )
 
         own_restaurants = None
         if getattr(self.request.user, 'winery', None):
             own_restaurants = Event.objects.filter(
                 winery=self.request.user.winery.id,
-                categories__name__icontains='restaurant',
-            ).distinct()
+                kind=EVENT_KIND_RESTAURANT,
+            )
 
-        queryset = all_restaurants if not own_restaurants else all_restaurants | own_restaurants
-        return queryset
+        queryset = all_restaurants if own_restaurants is None else all_restaurants | own_restaurants
+        return EventSerializer.setup_eager_loading(queryset, self.request)
 
 
 class EventOccurrencesView(viewsets.ModelViewSet):
     serializer_class = EventOccurrenceSerializer
     model_class = EventOccurrence
+    pagination_class = KeysetPagination
 
     permission_classes = [AllowEventOwnerOrReadOnly]
     http_method_names = ['get', 'post', 'patch', 'head', 'options', 'trace']
@@ -562,13 +722,17 @@ class EventOccurrencesView(viewsets.ModelViewSet):
         if not getattr(request.user, 'winery', None) or request.user.winery.id != occurrence.event.winery.id:
             return Response({'detail': 'Access Denied'}, status=status.HTTP_403_FORBIDDEN)
         reason = request.data.get('reason')
-        message = occurrence.cancel(reason)
-        return Response({'detail': message}, status=status.HTTP_200_OK)
+        cancelled = occurrence.cancel(reason)
+        return Response(
+            {'detail': 'The Occurrence has been cancelled', 'cancelled': cancelled},
+            status=status.HTTP_200_OK,
+        )
 
 
 class RestaurantOccurrencesView(viewsets.ModelViewSet):
     serializer_class = EventOccurrenceSerializer
     model_class = EventOccurrence
+    pagination_class = KeysetPagination
     http_method_names = ['get', 'post', 'patch', 'head', 'options', 'trace']
 
     def create(self, request, restaurant_pk):
@@ -610,20 +774,25 @@ class RestaurantOccurrencesView(viewsets.ModelViewSet):
         if not getattr(request.user, 'winery', None) or request.user.winery.id != occurrence.event.winery.id:
             return Response({'detail': 'Access Denied'}, status=status.HTTP_403_FORBIDDEN)
         reason = request.data.get('reason')
-        message = occurrence.cancel(reason)
-        return Response({'detail': message}, status=status.HTTP_200_OK)
+        cancelled = occurrence.cancel(reason)
+        return Response(
+            {'detail': 'The Occurrence has been cancelled', 'cancelled': cancelled},
+            status=status.HTTP_200_OK,
+        )
 
 
 class WineryApprovalView(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     queryset = Winery.objects.filter(available_since__isnull=True)
     serializer_class = WinerySerializer
 
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
-    search_fields = ['name', 'description']
+    filter_backends = [FullTextSearchFilter, DjangoFilterBackend]
     http_method_names = ['get', 'head', 'options', 'post']
 
     permission_classes = [AdminOnly]
 
+    def get_queryset(self):
+        return WinerySerializer.setup_eager_loading(super().get_queryset(), self.request)
+
     @action(detail=True, methods=['post'], name='approve')
     def approve(self, request, pk):
         winery = get_object_or_404(Winery, id=pk)
@@ -712,14 +881,7 @@ class ReportsView(APIView):
                     old_sum=Sum('old')
                 )
             ),
-            "events_by_rating": (
-                user_events_ratings
-                .values("event__name")
-                .annotate(avg_rating=Coalesce(Avg("rate"), 0))
-                .annotate(name=F("event__name"))
-                .values("name", "avg_rating")
-                .order_by("-avg_rating")[:10]
-            ),
+            "events_by_rating": self.events_by_rating(user_events, user_events_ratings, from_date or to_date),
             "reservations_by_earnings": (
                 user_events_reservations
                 .values("event_occurrence__event__name")
@@ -745,6 +907,29 @@ class ReportsView(APIView):
 
         return Response(response)
 
+    @staticmethod
+    def events_by_rating(events, ratings, filtered_by_date):
+        if filtered_by_date:
+            return (
+                ratings
+                .values("event__name")
+                .annotate(avg_rating=Coalesce(Avg("rate"), 0))
+                .annotate(name=F("event__name"))
+                .values("name", "avg_rating")
+                .order_by("-avg_rating")[:10]
+            )
+        # Without a date range the stored aggregates already hold the answer
+        return (
+            events
+            .filter(rating_count__gt=0)
+            .annotate(avg_rating=ExpressionWrapper(
+                F("rating_sum") * 1.0 / F("rating_count"),
+                output_field=FloatField())
+            )
+            .values("name", "avg_rating")
+            .order_by("-avg_rating")[:10]
+        )
+
 
 class EventReservationsView(RetrieveModelMixin,
                             ListModelMixin,
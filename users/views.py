@@ -1,8 +1,7 @@
 from django.conf import settings
+from django.db.models import Prefetch
 from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
@@ -13,8 +12,9 @@ from django_rest_passwordreset.signals import reset_password_token_created, post
 from django_rest_passwordreset.models import ResetPasswordToken
 
 from .models import WineUser, UserSerializer
-from api.models import Reservation, Mail
-from api.serializers import ReservationSerializer
+from api.models import Reservation, Mail, Winery
+from api.pagination import ReservationPagination
+from api.serializers import ReservationSerializer, WinerySerializer
 
 
 from .permissions import (
@@ -37,16 +37,15 @@ def password_reset_token_created(sender, instance, reset_password_token, *args,
     # send email
     token = reset_password_token.key
     url = settings.URL_FRONT_END
-    subject = 'Winecompanion - Password Assistance'
-    html_message = render_to_string(
-            'reset_password_template.html',
-            {
-                'user': reset_password_token.user.first_name,
-                'url': "{}{}confirm/{}".format(url, reverse('password_reset:reset-password-request'), token),
-            }
-        )
-    plain_message = strip_tags(html_message)
-    Mail.send_mail(subject, plain_message, [reset_password_token.user.email], html_message=html_message)
+    Mail.send_mail(
+        'Winecompanion - Password Assistance',
+        'reset_password_template.html',
+        {
+            'user': reset_password_token.user.first_name,
+            'url': "{}{}confirm/{}".format(url, reverse('password_reset:reset-password-request'), token),
+        },
+        [reset_password_token.user.email],
+    )
 
 
 class WineUserView(viewsets.ModelViewSet):
@@ -55,6 +54,11 @@ class WineUserView(viewsets.ModelViewSet):
 
     permission_classes = [ListAdminOnly, AllowCreateUserButUpdateOwnerOnly]
 
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related(
+            Prefetch('winery', queryset=WinerySerializer.setup_eager_loading(Winery.objects.all())),
+        )
+
     def create(self, request):
         serializer = UserSerializer(data=request.data)
         if not serializer.is_valid():
@@ -67,26 +71,25 @@ class WineUserView(viewsets.ModelViewSet):
                         ip_address=request.META.get(HTTP_IP_ADDRESS_HEADER, ''),
                     )
         url = settings.URL_FRONT_END
-        subject_activate = 'Winecompanion - Activate Account'
-        html_message_activate = render_to_string(
+        Mail.send_mail(
+            'Winecompanion - Activate Account',
             'user_registration_template.html',
             {
                 'user': wine_user.first_name,
                 'url': "{}{}confirm/{}".format(url, reverse('password_reset:reset-password-request'), token.key),
-            }
+            },
+            [wine_user.email],
         )
-
-        plain_message_activate = strip_tags(html_message_activate)
-        Mail.send_mail(subject_activate, plain_message_activate, [wine_user.email], html_message=html_message_activate)
         return Response({'url': reverse('users-detail', args=[wine_user.id])}, status=status.HTTP_201_CREATED)
 
     @action(detail=False, methods=['get'], name='get-user-reservations')
     def reservations(self, request):
-        if request.user.is_anonymous:
-            return Response([], status=status.HTTP_200_OK)
-        res = Reservation.objects.filter(user=request.user.id).order_by('-id')
-        reservations = ReservationSerializer(res, many=True)
-        return Response(reservations.data, status=status.HTTP_200_OK)
+        # Anonymous requests are turned away with a 401 by AllowCreateUserButUpdateOwnerOnly
+        res = Reservation.objects.filter(user=request.user.id)
+        paginator = ReservationPagination()
+        page = paginator.paginate_queryset(res, request, view=self)
+        reservations = ReservationSerializer(page, many=True)
+        return paginator.get_paginated_response(reservations.data)
 
     @action(detail=True, methods=['post'], name='set-password')
     def set_password(self, request, pk):
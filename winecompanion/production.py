@@ -99,6 +99,52 @@ DB_FROM_ENV = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(DB_FROM_ENV)
 
 DATABASES['default']['ENGINE'] = 'django.contrib.gis.db.backends.postgis'
+
+# Shared by every worker, so a catalog version bump is seen by all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_response_cache',
+    }
+}
+
+RESPONSE_CACHE_TIMEOUT = 300
+
+MAP_CLUSTERS_CACHE_TIMEOUT = 86400
+
+VECTOR_TILES_ROOT = os.path.join(BASE_DIR, "tiles")
+VECTOR_TILES_MAX_AGE = 900
+
+# Most occurrences a single event create or update may generate from its schedules
+MAX_SCHEDULE_OCCURRENCES = 1000
+
+# Schedules write their occurrences this many days ahead, later dates are
+# only listed, up to SCHEDULE_PREVIEW_DAYS ahead
+SCHEDULE_HORIZON_DAYS = 90
+SCHEDULE_PREVIEW_DAYS = 365
+
+# Seconds a POST response is kept for replays with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Most reservations a single batch booking may create
+MAX_BATCH_RESERVATIONS = 20
+
+# Occurrences with more vacancies than this spread them over VACANCY_SHARDS
+# counters, so concurrent bookings don't all wait on the same row
+SHARDED_VACANCIES_THRESHOLD = 500
+VACANCY_SHARDS = 8
+# Seconds the cached vacancies total of a sharded occurrence may lag behind its counters
+VACANCY_TOTAL_REFRESH_SECONDS = 5
+
+# Pub/sub that fans the live occurrence updates out to the event streams
+LIVE_UPDATES_BACKEND = 'api.live.PostgresBroker'
+# Seconds an event stream stays open before the client has to reconnect
+LIVE_UPDATES_MAX_SECONDS = 300
+LIVE_UPDATES_KEEPALIVE_SECONDS = 15
+LIVE_UPDATES_RETRY_MILLISECONDS = 3000
+# Streams a process serves at once; each holds one of the gunicorn threads
+LIVE_UPDATES_MAX_STREAMS = 4
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -29,16 +29,9 @@ ALLOWED_HOSTS = ['*']
 
 # Email settings definition
 SEND_EMAILS = os.getenv('SEND_EMAILS', False)
-# For synchronous shipping
+# Mails are queued in the outbox and delivered by `manage.py send_outbox --loop` with this backend
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 
-# For asynchronous shipping
-# EMAIL_BACKEND = "mailer.backend.DbBackend"
-
-# See https://github.com/pinax/django-mailer; Don't forget to add (and modify) next two lines to crontab;
-# *       * * * * (/path/to/your/python /path/to/your/manage.py send_mail >> ~/cron_mail.log 2>&1)
-# 0,20,40 * * * * (/path/to/your/python /path/to/your/manage.py retry_deferred >> ~/cron_mail_deferred.log 2>&1)
-
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
@@ -119,6 +112,60 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'winecompanion',
+    }
+}
+
+# Seconds an anonymous listing response is kept; entries are also
+# invalidated as soon as catalog data changes.
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Seconds a tile of map clusters is kept; tiles are also dropped as soon as
+# a winery in them moves or its approval changes
+MAP_CLUSTERS_CACHE_TIMEOUT = 86400
+
+# Vector tiles are cached on disk in VECTOR_TILES_ROOT, they are deleted
+# when a winery or event in them is saved and rebuilt after
+# VECTOR_TILES_MAX_AGE seconds, as upcoming events run out with time
+VECTOR_TILES_ROOT = os.path.join(BASE_DIR, "tiles")
+VECTOR_TILES_MAX_AGE = 900
+
+# Most occurrences a single event create or update may generate from its schedules
+MAX_SCHEDULE_OCCURRENCES = 1000
+
+# Schedules write their occurrences this many days ahead, later dates are
+# only listed, up to SCHEDULE_PREVIEW_DAYS ahead
+SCHEDULE_HORIZON_DAYS = 90
+SCHEDULE_PREVIEW_DAYS = 365
+
+# Seconds a POST response is kept for replays with the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Most reservations a single batch booking may create
+MAX_BATCH_RESERVATIONS = 20
+
+# Occurrences with more vacancies than this spread them over VACANCY_SHARDS
+# counters, so concurrent bookings don't all wait on the same row
+SHARDED_VACANCIES_THRESHOLD = 500
+VACANCY_SHARDS = 8
+# Seconds the cached vacancies total of a sharded occurrence may lag behind its counters
+VACANCY_TOTAL_REFRESH_SECONDS = 5
+
+# Pub/sub that fans the live occurrence updates out to the event streams
+LIVE_UPDATES_BACKEND = 'api.live.LocalBroker'
+# Seconds an event stream stays open before the client has to reconnect
+LIVE_UPDATES_MAX_SECONDS = 300
+LIVE_UPDATES_KEEPALIVE_SECONDS = 15
+LIVE_UPDATES_RETRY_MILLISECONDS = 3000
+# Streams a process serves at once; each holds one of the gunicorn threads
+LIVE_UPDATES_MAX_STREAMS = 4
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 